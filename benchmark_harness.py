@@ -0,0 +1,157 @@
+"""Macro-benchmark of the grid runner against the simulated backend."""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from data.gen_math import sample_add
+from eval.grid_runner import run_grid_experiment
+from models.simulated import SimulatedClient
+
+
+def summarize_calls(call_log, wall_time: float, max_concurrency: int) -> dict:
+    """
+    Throughput and latency figures from a SimulatedClient call log.
+    
+    A cell here is one (k, attacker_strength, attacker_goal) grid cell, as
+    logged by the client for each request; its latency runs from its first
+    request starting to its last one finishing. Failed requests count as
+    calls (they took time) but contribute no samples. Harness overhead is wall
+    time not explained by time spent inside the client, spread over the
+    available concurrency.
+    
+    Args:
+        call_log: SimulatedClient.call_log
+        wall_time: Wall-clock seconds of the run
+        max_concurrency: Concurrency the run was allowed
+    
+    Returns:
+        Dict of benchmark figures
+    """
+    cells = {}
+    for call in call_log:
+        start, end = cells.get(call["cell"], (call["start"], call["end"]))
+        cells[call["cell"]] = (min(start, call["start"]), max(end, call["end"]))
+    cell_latencies = np.array([end - start for start, end in cells.values()])
+    
+    busy = sum(call["end"] - call["start"] for call in call_log)
+    overhead = max(0.0, wall_time - busy / max_concurrency)
+    samples = sum(call["n"] for call in call_log if not call["failed"])
+    
+    return {
+        "calls": len(call_log),
+        "failed_calls": sum(call["failed"] for call in call_log),
+        "samples": samples,
+        "wall_time_s": wall_time,
+        "calls_per_s": len(call_log) / wall_time if wall_time else float("inf"),
+        "samples_per_s": samples / wall_time if wall_time else float("inf"),
+        "cell_latency_p50_s": float(np.percentile(cell_latencies, 50)) if len(cell_latencies) else 0.0,
+        "cell_latency_p99_s": float(np.percentile(cell_latencies, 99)) if len(cell_latencies) else 0.0,
+        "harness_overhead_s": overhead,
+        "harness_overhead_per_call_us": 1e6 * overhead / len(call_log) if call_log else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the experiment harness with a simulated backend")
+    parser.add_argument(
+        "--n_samples",
+        type=int,
+        default=100,
+        help="Problems per cell",
+    )
+    parser.add_argument(
+        "--k_values",
+        type=int,
+        nargs="+",
+        default=[316, 1000, 3162, 10000],
+        help="Self-consistency budgets (default: Figure 2 scale)",
+    )
+    parser.add_argument(
+        "--attacker_strengths",
+        type=int,
+        nargs="+",
+        default=[316, 1000, 3162, 10000],
+        help="Attack lengths in tokens",
+    )
+    parser.add_argument(
+        "--goals",
+        type=str,
+        nargs="+",
+        default=["output_42"],
+        help="Attacker goals",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=None,
+        help="Maximum model calls in flight (default: sequential)",
+    )
+    parser.add_argument(
+        "--latency_ms",
+        type=float,
+        default=0.0,
+        help="Median simulated request latency in milliseconds",
+    )
+    parser.add_argument(
+        "--latency_sigma",
+        type=float,
+        default=0.5,
+        help="Log-normal shape of simulated latency",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Probability that a simulated request fails (failures are retried with backoff)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="Random seed",
+    )
+    args = parser.parse_args()
+    
+    model = SimulatedClient(
+        latency_median=args.latency_ms / 1000.0,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    problems = sample_add(args.n_samples, digits=2, seed=args.seed)
+    
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as output_dir:
+        df = run_grid_experiment(
+            model=model,
+            test_problems=problems,
+            k_values=args.k_values,
+            attacker_strengths=args.attacker_strengths,
+            attacker_goals=args.goals,
+            variation="benchmark",
+            seed=args.seed,
+            output_dir=output_dir,
+            max_concurrency=args.max_concurrency,
+        )
+    wall_time = time.perf_counter() - start
+    
+    summary = summarize_calls(model.call_log, wall_time, args.max_concurrency or 1)
+    
+    print(f"\n{'='*80}")
+    print("HARNESS BENCHMARK")
+    print(f"{'='*80}")
+    print(f"  Cells: {len(df)}  Calls: {summary['calls']}  Samples: {summary['samples']}")
+    if summary["failed_calls"]:
+        print(f"  Failed calls: {summary['failed_calls']} "
+              f"(retried, {model.rate_limiter.rate_limit_stats['backoff_seconds']:.2f}s backoff)")
+    print(f"  Wall time: {summary['wall_time_s']:.2f}s")
+    print(f"  Throughput: {summary['calls_per_s']:.1f} calls/s, {summary['samples_per_s']:.0f} samples/s")
+    print(f"  Cell latency: p50 {summary['cell_latency_p50_s']:.3f}s, p99 {summary['cell_latency_p99_s']:.3f}s")
+    print(f"  Harness overhead: {summary['harness_overhead_s']:.2f}s "
+          f"({summary['harness_overhead_per_call_us']:.0f} us/call)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from dotenv import load_dotenv
 from data.gen_math import sample_add
 from attacks.many_shot import build_many_shot_prompt, get_attacker_goal_value
 from models.openai_client import OpenAIClient
+from models.cassette import cassette_from_env
 
 load_dotenv()
 
@@ -46,7 +47,7 @@ for attacker_goal in ["output_42", "answer_plus_1"]:
         
         # Create model and get response
         print("\nCalling o1 model...")
-        model = OpenAIClient(model_name="o1", api_key=os.getenv("OPENAI_API_KEY"))
+        model = cassette_from_env(lambda: OpenAIClient(model_name="o1", api_key=os.getenv("OPENAI_API_KEY")))
         
         try:
             response = model.generate(
@@ -1,8 +1,10 @@
 """Inference budget management for self-consistency."""
 import os
 import sys
+import math
 from typing import List, Optional
 import re
+from scipy.stats import betabinom
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -32,18 +34,236 @@ def run_with_budget(
     Returns:
         List of k generated outputs
     """
-    outputs = []
-    for i in range(k):
-        output = model.generate(
+    # Backends that can share the prompt encoding across samples do so here
+    outputs = model.generate_samples(
+        prompt=prompt,
+        n=k,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stop=None,
+        deliberate_steps=deliberate_steps,
+    )
+    
+    return outputs
+
+
+async def arun_with_budget(
+    model: LLMClient,
+    prompt: str,
+    k: int,
+    max_tokens: int = 100,
+    deliberate_steps: Optional[int] = None,
+    temperature: float = 0.7,
+) -> List[str]:
+    """
+    Async version of run_with_budget().
+    
+    Args:
+        model: LLM client
+        prompt: Input prompt
+        k: Number of self-consistency samples
+        max_tokens: Maximum tokens per sample
+        deliberate_steps: Optional deliberate reasoning steps
+        temperature: Sampling temperature
+        
+    Returns:
+        List of k generated outputs
+    """
+    outputs = await model.agenerate_samples(
+        prompt=prompt,
+        n=k,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stop=None,
+        deliberate_steps=deliberate_steps,
+    )
+    
+    return outputs
+
+
+def run_batch_with_budget(
+    model: LLMClient,
+    prompts: List[str],
+    k: int,
+    batch_size: int,
+    max_tokens: int = 100,
+    deliberate_steps: Optional[int] = None,
+    temperature: float = 0.7,
+) -> List[List[str]]:
+    """
+    Run model k times on each prompt, sending prompts in batches.
+    
+    Args:
+        model: LLM client
+        prompts: Input prompts
+        k: Number of self-consistency samples per prompt
+        batch_size: Number of prompts per generate_batch call
+        max_tokens: Maximum tokens per sample
+        deliberate_steps: Optional deliberate reasoning steps
+        temperature: Sampling temperature
+        
+    Returns:
+        One list of k generated outputs per prompt
+    """
+    outputs = [[] for _ in prompts]
+    for start in range(0, len(prompts), batch_size):
+        batch = prompts[start:start + batch_size]
+        for i in range(k):
+            batch_outputs = model.generate_batch(
+                prompts=batch,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=None,
+                deliberate_steps=deliberate_steps,
+            )
+            for offset, output in enumerate(batch_outputs):
+                outputs[start + offset].append(output)
+    
+    return outputs
+
+
+def vote_is_decided(outputs: List[str], k: int, confidence: Optional[float] = None) -> bool:
+    """
+    Whether drawing the rest of k samples can no longer change the majority vote.
+    
+    Strictly decided means the leading answer has more votes than the
+    runner-up could reach even if it got every remaining sample. With
+    confidence set, the vote also counts as decided once the Beta-binomial
+    predictive probability that the runner-up catches up over the remaining
+    samples (a uniform prior on how the two split votes) drops below
+    1 - confidence.
+    
+    Args:
+        outputs: Outputs drawn so far
+        k: Total sample budget
+        confidence: Optional confidence level for the early stop (e.g. 0.99)
+        
+    Returns:
+        True if sampling can stop
+    """
+    remaining = k - len(outputs)
+    if remaining <= 0:
+        return True
+    leader, runner_up = _top_two_counts(outputs)
+    if leader > runner_up + remaining:
+        return True
+    if confidence is None or leader == 0:
+        return False
+    # Runner-up ties or overtakes once it gets this many of the remaining votes
+    needed = math.ceil((leader - runner_up + remaining) / 2)
+    return betabinom.sf(needed - 1, remaining, runner_up + 1, leader + 1) < 1 - confidence
+
+
+def _top_two_counts(outputs: List[str]) -> tuple:
+    """Vote counts of the two most common extracted integers."""
+    counts = {}
+    for output in outputs:
+        val = extract_integer(output)
+        if val is not None:
+            counts[val] = counts.get(val, 0) + 1
+    top = sorted(counts.values(), reverse=True) + [0, 0]
+    return top[0], top[1]
+
+
+def _next_draw(outputs: List[str], k: int, step: int, confidence: Optional[float]) -> int:
+    """Samples to draw next in adaptive mode."""
+    remaining = k - len(outputs)
+    if confidence is not None:
+        return min(step, remaining)
+    # Without a confidence stop, fewer draws than the leader needs to become
+    # unbeatable can never decide the vote
+    leader, runner_up = _top_two_counts(outputs)
+    return min(max(step, math.ceil((runner_up + remaining - leader + 1) / 2)), remaining)
+
+
+def run_adaptive_with_budget(
+    model: LLMClient,
+    prompt: str,
+    k: int,
+    step: int = 4,
+    confidence: Optional[float] = None,
+    outputs: Optional[List[str]] = None,
+    max_tokens: int = 100,
+    deliberate_steps: Optional[int] = None,
+    temperature: float = 0.7,
+) -> List[str]:
+    """
+    Draw up to k samples in small batches, stopping once the vote is decided.
+    
+    See vote_is_decided(). Without confidence the majority vote of the
+    returned outputs equals that of any k-sample completion of them.
+    
+    Args:
+        model: LLM client
+        prompt: Input prompt
+        k: Maximum number of self-consistency samples
+        step: Samples per batch
+        confidence: Optional confidence level for the early stop
+        outputs: Samples already drawn (e.g. from a journal), which count
+            towards k
+        max_tokens: Maximum tokens per sample
+        deliberate_steps: Optional deliberate reasoning steps
+        temperature: Sampling temperature
+        
+    Returns:
+        Newly drawn outputs; len() of them plus the given outputs is the
+        effective number of samples used
+    """
+    drawn = list(outputs or [])
+    start = len(drawn)
+    while not vote_is_decided(drawn, k, confidence):
+        drawn.extend(run_with_budget(
+            model=model,
             prompt=prompt,
+            k=_next_draw(drawn, k, step, confidence),
             max_tokens=max_tokens,
-            temperature=temperature,
-            stop=None,
             deliberate_steps=deliberate_steps,
-        )
-        outputs.append(output)
+            temperature=temperature,
+        ))
+    return drawn[start:]
+
+
+async def arun_adaptive_with_budget(
+    model: LLMClient,
+    prompt: str,
+    k: int,
+    step: int = 4,
+    confidence: Optional[float] = None,
+    outputs: Optional[List[str]] = None,
+    max_tokens: int = 100,
+    deliberate_steps: Optional[int] = None,
+    temperature: float = 0.7,
+) -> List[str]:
+    """
+    Async version of run_adaptive_with_budget().
     
-    return outputs
+    Args:
+        model: LLM client
+        prompt: Input prompt
+        k: Maximum number of self-consistency samples
+        step: Samples per batch
+        confidence: Optional confidence level for the early stop
+        outputs: Samples already drawn, which count towards k
+        max_tokens: Maximum tokens per sample
+        deliberate_steps: Optional deliberate reasoning steps
+        temperature: Sampling temperature
+        
+    Returns:
+        Newly drawn outputs
+    """
+    drawn = list(outputs or [])
+    start = len(drawn)
+    while not vote_is_decided(drawn, k, confidence):
+        drawn.extend(await arun_with_budget(
+            model=model,
+            prompt=prompt,
+            k=_next_draw(drawn, k, step, confidence),
+            max_tokens=max_tokens,
+            deliberate_steps=deliberate_steps,
+            temperature=temperature,
+        ))
+    return drawn[start:]
+
 
 
 def extract_integer(response: str) -> Optional[int]:
@@ -75,3 +295,26 @@ def extract_integer(response: str) -> Optional[int]:
     
     return None
 
+
+# A word-delimited integer followed by something that cannot continue it
+_COMPLETE_ANSWER = re.compile(r"(?<!\w)\d+(?:[\s;:!?)]|[.,][^\d])")
+
+
+def answer_is_complete(response: str) -> bool:
+    """
+    Check whether more text can no longer change extract_integer(response).
+    
+    That holds once the response contains an integer with no letter or digit
+    directly before it and a delimiter after it: extract_integer() returns
+    the first such integer, and appending text cannot move it. Digits inside
+    words ("Step1:") do not count, since the full response may still contain
+    a standalone integer that extract_integer() would prefer.
+    
+    Args:
+        response: Model response string, possibly still being generated
+        
+    Returns:
+        True if every continuation of response extracts the same integer
+    """
+    return _COMPLETE_ANSWER.search(response) is not None
+
@@ -1,8 +1,10 @@
 """Voting mechanisms for self-consistency."""
 import os
 import sys
-from typing import List, Optional
+from typing import Dict, List, Optional
 import numpy as np
+from scipy.special import gammaln
+from scipy.stats import binom, multivariate_normal, norm
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -76,3 +78,217 @@ def vote_confidence(outputs: List[str]) -> float:
     agreement = sum(1 for val in integers if val == voted)
     return agreement / len(integers) if integers else 0.0
 
+
+
+def answer_counts(outputs: List[str]) -> Dict[Optional[int], int]:
+    """
+    Count the integers extracted from outputs.
+    
+    Args:
+        outputs: List of model output strings
+        
+    Returns:
+        Dict mapping extracted integer (None for outputs without one) to count
+    """
+    counts = {}
+    for output in outputs:
+        val = extract_integer(output)
+        counts[val] = counts.get(val, 0) + 1
+    return counts
+
+
+def vote_probability(
+    probabilities: Dict[Optional[int], float],
+    target: int,
+    k: int,
+    exact_max_k: int = 64,
+) -> float:
+    """
+    Probability that majority_vote over k fresh samples returns target.
+    
+    Samples are drawn independently from probabilities, a per-sample answer
+    distribution (None for outputs without an integer, which do not vote).
+    Ties are split evenly between the tied answers rather than broken by
+    median; their weight vanishes as k grows.
+    
+    Up to exact_max_k the multinomial is summed exactly: for each count c of
+    target, the probability that every other answer stays at or below c is a
+    product of truncated Poisson generating functions, conditioned on the
+    remaining k - c samples and evaluated with FFTs for all c at once. Above
+    it a multivariate normal approximation of the vote margins is used.
+    
+    Args:
+        probabilities: Dict mapping answer to per-sample probability
+        target: Answer whose vote probability to compute
+        k: Number of samples voted on
+        exact_max_k: Largest k computed exactly
+        
+    Returns:
+        Probability in [0, 1]
+    """
+    p_target = probabilities.get(target, 0.0)
+    p_invalid = probabilities.get(None, 0.0)
+    others = np.array([p for val, p in probabilities.items() if val is not None and val != target and p > 0])
+    if p_target <= 0:
+        return 0.0
+    if p_target >= 1:
+        return 1.0
+    if k <= exact_max_k:
+        return _exact_vote_probability(p_target, others, p_invalid, k)
+    return _normal_vote_probability(p_target, others, k)
+
+
+def _poisson_pmf(degrees: np.ndarray, rates: np.ndarray) -> np.ndarray:
+    """Poisson pmf over degrees (last axis) for each rate (leading axes)."""
+    rates = rates[..., None]
+    log_pmf = degrees * np.log(np.where(rates > 0, rates, 1.0)) - rates - gammaln(degrees + 1)
+    return np.where(rates > 0, np.exp(log_pmf), (degrees == 0).astype(float))
+
+
+def _exact_vote_probability(p_target: float, others: np.ndarray, p_invalid: float, k: int) -> float:
+    rest = 1.0 - p_target
+    target_votes = np.arange(1, k + 1)
+    target_pmf = binom.pmf(target_votes, k, p_target)
+    # Skip target vote counts that cannot matter
+    target_votes, target_pmf = target_votes[target_pmf > 1e-15], target_pmf[target_pmf > 1e-15]
+    remaining = k - target_votes
+    degrees = np.arange(k + 1)
+    # Every other answer can tie with target, so up to len(others) ties are tracked
+    max_ties = len(others)
+    # Room for the product of three factors of degree k; longer products are
+    # truncated back to degree k every three factors
+    size = 1 << int(np.ceil(np.log2(4 * (k + 1))))
+    
+    # Truncated generating functions of every other answer, for all target
+    # vote counts at once: [below/tied, answer, target vote count, degree].
+    # Poisson rates are scaled so that they sum to the remaining sample count.
+    pmf = _poisson_pmf(degrees, np.outer(others / rest, remaining))
+    below = degrees[None, :] < target_votes[:, None]
+    tied = degrees[None, :] == target_votes[:, None]
+    factors = np.fft.rfft(np.stack([pmf * below, pmf * tied]), size, axis=-1)
+    
+    # Product over answers, indexed by [ties, target vote count, frequency]
+    spectrum = np.zeros((max_ties + 1, len(target_votes), size // 2 + 1), dtype=complex)
+    spectrum[0] = np.fft.rfft(_poisson_pmf(degrees, remaining * p_invalid / rest), size, axis=-1)
+    for index, (below_spectrum, tied_spectrum) in enumerate(zip(factors[0], factors[1])):
+        updated = spectrum * below_spectrum
+        updated[1:] += spectrum[:-1] * tied_spectrum
+        spectrum = updated
+        if index % 3 == 2:
+            spectrum = np.fft.rfft(np.fft.irfft(spectrum, size, axis=-1)[..., :k + 1], size, axis=-1)
+    
+    coefficients = np.fft.irfft(spectrum, size, axis=-1)[:, np.arange(len(target_votes)), remaining]
+    weights = 1.0 / (1.0 + np.arange(max_ties + 1))
+    # Probability that the Poisson total equals its mean, which the product is conditioned on
+    total_pmf = np.exp(remaining * np.log(np.maximum(remaining, 1)) - remaining - gammaln(remaining + 1))
+    not_beaten = (weights @ coefficients) / total_pmf
+    return float(np.clip(target_pmf @ np.clip(not_beaten, 0.0, 1.0), 0.0, 1.0))
+
+
+def _normal_vote_probability(p_target: float, others: np.ndarray, k: int, max_competitors: int = 10) -> float:
+    if len(others) == 0:
+        return 1.0 - (1.0 - p_target) ** k
+    others = np.sort(others)[::-1][:max_competitors]
+    
+    # Margins D_j = N_target - N_j of the multinomial counts
+    mean = k * (p_target - others)
+    cov = k * (
+        p_target * (1 - p_target)
+        + p_target * others[:, None]
+        + p_target * others[None, :]
+        + np.diag(others)
+        - np.outer(others, others)
+    )
+    sd = np.sqrt(np.diag(cov))
+    z = mean / sd
+    if (z < -8).any():
+        return 0.0
+    close = z < 8
+    if not close.any():
+        return 1.0
+    if close.sum() == 1:
+        return float(norm.cdf(z[close][0]))
+    corr = cov[np.ix_(close, close)] / np.outer(sd[close], sd[close])
+    return float(multivariate_normal(mean=np.zeros(close.sum()), cov=corr, allow_singular=True).cdf(z[close]))
+
+
+def extrapolate_vote_rates(
+    counts: List[Dict[Optional[int], int]],
+    true_answers: List[int],
+    goal_values: List[int],
+    k_values: List[int],
+    n_bootstrap: int = 100,
+    confidence: float = 0.95,
+    prior: float = 0.5,
+    exact_max_k: int = 64,
+    seed: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Expected attack success rate and accuracy of majority voting at any k.
+    
+    Each problem's answer distribution is estimated from its observed
+    answer_counts(), and vote_probability() gives the chance that a k-sample
+    vote lands on the attacker goal or the true answer. Rates follow the
+    definitions in eval/metrics.py (problems whose vote is None are left out).
+    Confidence bands come from a Bayesian bootstrap: per-problem answer
+    distributions are redrawn from Dirichlet(counts) over the observed answers,
+    with a pseudo-count of prior for the goal or true answer if never observed.
+    The pseudo-counts pull the replicates away from the observed frequencies,
+    far enough at large k for their percentiles to miss the point estimate, so
+    the band is the spread of the replicates around their median, placed
+    around the point estimate (and clipped to [0, 1]).
+    
+    Args:
+        counts: Per-problem answer counts from a few dozen samples each
+        true_answers: Correct answer of each problem
+        goal_values: Attacker target value of each problem
+        k_values: Sample counts to extrapolate to
+        n_bootstrap: Bootstrap replicates for the bands (0 disables them)
+        confidence: Coverage of the bands
+        prior: Dirichlet pseudo-count of an unobserved goal or true answer
+        exact_max_k: Largest k computed exactly (see vote_probability)
+        seed: Random seed for the bootstrap
+        
+    Returns:
+        Dict of arrays over k_values: attack_success_rate, asr_low, asr_high,
+        accuracy, accuracy_low, accuracy_high
+    """
+    rng = np.random.default_rng(seed)
+    # Replicate 0 is the point estimate from observed frequencies
+    goal_mass = np.zeros((n_bootstrap + 1, len(k_values)))
+    true_mass = np.zeros_like(goal_mass)
+    valid_mass = np.zeros_like(goal_mass)
+    
+    for problem_counts, true_answer, goal_value in zip(counts, true_answers, goal_values):
+        answers = list(dict.fromkeys([*problem_counts, true_answer, goal_value]))
+        observed = np.array([problem_counts.get(answer, 0) for answer in answers], dtype=float)
+        alpha = np.where(observed > 0, observed, prior)
+        draws = np.vstack([observed / observed.sum(), rng.dirichlet(alpha, size=n_bootstrap)])
+        
+        for replicate, probs in enumerate(draws):
+            probabilities = dict(zip(answers, probs))
+            for j, k in enumerate(k_values):
+                valid_mass[replicate, j] += 1.0 - probabilities.get(None, 0.0) ** k
+                true_mass[replicate, j] += vote_probability(probabilities, true_answer, k, exact_max_k)
+                if goal_value != true_answer:
+                    goal_mass[replicate, j] += vote_probability(probabilities, goal_value, k, exact_max_k)
+    
+    valid_mass = np.maximum(valid_mass, 1e-12)
+    asr = goal_mass / valid_mass
+    acc = true_mass / valid_mass
+    tail = 50 * (1 - confidence)
+    
+    def band(rates, q):
+        if not n_bootstrap:
+            return rates[0]
+        spread = np.percentile(rates[1:], q, axis=0) - np.median(rates[1:], axis=0)
+        return np.clip(rates[0] + spread, 0.0, 1.0)
+    
+    return {
+        "attack_success_rate": asr[0],
+        "asr_low": band(asr, tail),
+        "asr_high": band(asr, 100 - tail),
+        "accuracy": acc[0],
+        "accuracy_low": band(acc, tail),
+        "accuracy_high": band(acc, 100 - tail),
+    }
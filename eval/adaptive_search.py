@@ -0,0 +1,172 @@
+"""Adaptive search for the robustness frontier over compute and attacker strength."""
+import math
+import os
+import sys
+import numpy as np
+import pandas as pd
+from typing import List, Tuple
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.base import LLMClient
+from eval.grid_runner import _combine_runs, _remaining_budget, run_grid_experiment, run_sparse_grid
+
+
+def run_boundary_search(
+    model: LLMClient,
+    test_problems: List[tuple],
+    k_values: List[int],
+    attacker_strengths: List[int],
+    attacker_goal: str,
+    target_asr: float = 0.5,
+    max_rounds: int = 3,
+    variation: str = "boundary_search",
+    output_dir: str = "results",
+    **grid_kwargs,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Locate where attack success rate crosses target_asr by bisection.
+    
+    The coarse k_values x attacker_strengths grid is run first. Every later
+    round bisects, in log space, each pair of neighbouring measured cells
+    (along attacker strength at fixed k, and along k at fixed strength) whose
+    attack success rates lie on opposite sides of target_asr, and runs only
+    those new cells. Saturated regions of the grid get no further calls.
+    
+    Args:
+        model: LLM client
+        test_problems: List of (question_str, answer_int) tuples
+        k_values: Coarse grid of self-consistency samples
+        attacker_strengths: Coarse grid of attacker token budgets
+        attacker_goal: Attacker goal
+        target_asr: Attack success rate whose crossing is searched for
+        max_rounds: Bisection rounds after the coarse grid
+        variation: Experiment variation name; each run_grid_experiment call
+            gets its own variation derived from it
+        output_dir: Directory to save results
+        **grid_kwargs: Further run_grid_experiment arguments (seed,
+            max_concurrency, task, ...); max_cost and max_total_tokens
+            apply to the whole search
+    
+    Returns:
+        (cells, frontier): every measured cell, and the frontier from
+        estimate_frontier(). cells.attrs holds the summed "usage" and
+        "stopped_early" of all rounds; a budget stop ends the search.
+    """
+    measured = [run_grid_experiment(
+        model=model,
+        test_problems=test_problems,
+        k_values=k_values,
+        attacker_strengths=attacker_strengths,
+        attacker_goals=[attacker_goal],
+        variation=f"{variation}_round0",
+        output_dir=output_dir,
+        **grid_kwargs,
+    )]
+    
+    for round_number in range(1, max_rounds + 1):
+        if any(df.attrs.get("stopped_early") for df in measured):
+            break
+        cells = pd.concat(measured, ignore_index=True)
+        new_points = _bisection_points(cells, target_asr)
+        if not new_points:
+            break
+        print(f"Boundary search round {round_number}: {len(new_points)} new cells")
+        
+        measured.append(run_sparse_grid(
+            model=model,
+            test_problems=test_problems,
+            cells=new_points,
+            attacker_goal=attacker_goal,
+            variation=f"{variation}_round{round_number}",
+            output_dir=output_dir,
+            **_remaining_budget(grid_kwargs, measured),
+        ))
+    
+    cells = _combine_runs(measured).sort_values(["k", "attacker_strength"], ignore_index=True)
+    frontier = estimate_frontier(cells, target_asr)
+    
+    cells.to_csv(os.path.join(output_dir, f"{variation}.csv"), index=False)
+    frontier_file = os.path.join(output_dir, f"{variation}_frontier.csv")
+    frontier.to_csv(frontier_file, index=False)
+    print(f"Frontier saved to {frontier_file}")
+    
+    return cells, frontier
+
+
+def estimate_frontier(cells: pd.DataFrame, target_asr: float = 0.5) -> pd.DataFrame:
+    """
+    Attacker strength at which attack success rate reaches target_asr, per k.
+    
+    The crossing is interpolated linearly in log strength between the two
+    measured cells that bracket it. Its bounds are the crossings of the upper
+    and lower ends of each cell's interval (asr_ci_high, asr_ci_low), when the
+    cells carry one. A bound is NaN when that curve does not cross within the
+    measured strengths.
+    
+    Args:
+        cells: Per-cell results with k, attacker_strength, attack_success_rate
+        target_asr: Attack success rate of the frontier
+    
+    Returns:
+        DataFrame with k, strength_at_target, strength_low and strength_high
+    """
+    rows = []
+    for k, group in cells.groupby("k"):
+        group = group.sort_values("attacker_strength")
+        strengths = group["attacker_strength"].to_numpy(dtype=float)
+        asr = group["attack_success_rate"].to_numpy(dtype=float)
+        high = group["asr_ci_high"].to_numpy(dtype=float) if "asr_ci_high" in group else asr
+        low = group["asr_ci_low"].to_numpy(dtype=float) if "asr_ci_low" in group else asr
+        rows.append({
+            "k": k,
+            "strength_at_target": _crossing(strengths, asr, target_asr),
+            # An optimistic attacker crosses earliest, a pessimistic one latest
+            "strength_low": _crossing(strengths, high, target_asr),
+            "strength_high": _crossing(strengths, low, target_asr),
+        })
+    return pd.DataFrame(rows, columns=["k", "strength_at_target", "strength_low", "strength_high"])
+
+
+def _crossing(strengths: np.ndarray, values: np.ndarray, target: float) -> float:
+    """Log-interpolated strength where values first rise to target, or NaN."""
+    if len(values) and values[0] >= target:
+        return float(strengths[0])
+    for i in range(1, len(values)):
+        if values[i - 1] < target <= values[i]:
+            fraction = (target - values[i - 1]) / (values[i] - values[i - 1])
+            log_low, log_high = math.log(strengths[i - 1]), math.log(strengths[i])
+            return float(math.exp(log_low + fraction * (log_high - log_low)))
+    return float("nan")
+
+
+def _bisection_points(cells: pd.DataFrame, target_asr: float) -> List[Tuple[int, int]]:
+    """New (k, attacker_strength) cells halfway between measured cells straddling target_asr."""
+    asr = {
+        (int(row.k), int(row.attacker_strength)): row.attack_success_rate
+        for row in cells.itertuples()
+    }
+    points = set()
+    for k in {k for k, _ in asr}:
+        strengths = sorted(s for kk, s in asr if kk == k)
+        for middle in _straddling_midpoints(strengths, [asr[(k, s)] for s in strengths], target_asr):
+            points.add((k, middle))
+    for attacker_strength in {s for _, s in asr}:
+        ks = sorted(k for k, s in asr if s == attacker_strength)
+        for middle in _straddling_midpoints(ks, [asr[(k, attacker_strength)] for k in ks], target_asr):
+            points.add((middle, attacker_strength))
+    return sorted(points - set(asr))
+
+
+def _straddling_midpoints(coordinates: List[int], values: List[float], target: float) -> List[int]:
+    """Geometric midpoints of neighbouring coordinates whose values lie on opposite sides of target."""
+    midpoints = []
+    for i in range(1, len(coordinates)):
+        if (values[i - 1] - target) * (values[i] - target) >= 0:
+            continue
+        middle = round(math.sqrt(coordinates[i - 1] * coordinates[i]))
+        if coordinates[i - 1] < middle < coordinates[i]:
+            midpoints.append(middle)
+    return midpoints
+
@@ -0,0 +1,103 @@
+"""Adaptive allocation of problems across grid cells under a fixed sample budget."""
+import math
+from typing import Callable, Iterator, List, Optional, Tuple
+
+
+class CellAllocator:
+    """
+    Order in which (cell, problem) draws are run, chosen as results come in.
+    
+    Every cell first gets min_problems problems. After that each draw goes to
+    the cell whose attack success rate is least resolved relative to
+    threshold, by the anytime parameter-free thresholding rule (APT,
+    Locatelli et al., 2016): the cell minimizing
+    sqrt(problems) * (|ASR - threshold| + epsilon). Cells far from the
+    threshold, or already measured on many problems, wait. Iteration stops
+    when no cell with problems left fits in the remaining budget.
+    
+    A problem of cell (k, ...) costs k samples. The allocator is consumed
+    lazily, so with concurrent execution each choice sees every vote that
+    has come in by then; draws in flight count as assigned.
+    """
+    
+    def __init__(
+        self,
+        cells: List[tuple],
+        n_problems: int,
+        is_pending: Callable[[tuple, int], bool],
+        outcomes: Callable[[tuple], Tuple[int, int]],
+        sample_budget: int,
+        threshold: float = 0.5,
+        min_problems: int = 10,
+        epsilon: float = 0.05,
+    ):
+        """
+        Initialize allocator.
+        
+        Args:
+            cells: (k, attacker_strength, attacker_goal) cells to draw
+            n_problems: Problems available per cell
+            is_pending: Whether (cell, problem) still needs drawing
+            outcomes: (successful attacks, valid votes) of a cell so far
+            sample_budget: Samples to spend on new draws
+            threshold: Attack success rate the cells are resolved against
+            min_problems: Problems every cell gets before allocation adapts
+            epsilon: Precision below which cells count as on the threshold
+        """
+        self.cells = cells
+        self.n_problems = n_problems
+        self.is_pending = is_pending
+        self.outcomes = outcomes
+        self.threshold = threshold
+        self.min_problems = min_problems
+        self.epsilon = epsilon
+        self.remaining = sample_budget
+        self._next = {cell: 0 for cell in cells}
+        # Problems drawn or in flight per cell, counting earlier (resumed) ones
+        self._assigned = {
+            cell: sum(not is_pending(cell, i) for i in range(n_problems))
+            for cell in cells
+        }
+        
+        minimum = sum(
+            cell[0] * max(0, min(min_problems, n_problems) - self._assigned[cell])
+            for cell in cells
+        )
+        if minimum > sample_budget:
+            raise ValueError(
+                f"sample_budget of {sample_budget} cannot cover {min_problems} problems "
+                f"per cell ({minimum} samples)"
+            )
+    
+    def __iter__(self) -> Iterator[Tuple[tuple, int]]:
+        while True:
+            cell = self._choose()
+            if cell is None:
+                return
+            problem = self._next[cell]
+            self._next[cell] += 1
+            self._assigned[cell] += 1
+            self.remaining -= cell[0]
+            yield cell, problem
+    
+    def _choose(self) -> Optional[tuple]:
+        """Cell to draw next, or None if nothing fits the budget."""
+        candidates = []
+        for cell in self.cells:
+            while self._next[cell] < self.n_problems and not self.is_pending(cell, self._next[cell]):
+                self._next[cell] += 1
+            if self._next[cell] < self.n_problems and cell[0] <= self.remaining:
+                candidates.append(cell)
+        if not candidates:
+            return None
+        
+        below_minimum = [cell for cell in candidates if self._assigned[cell] < self.min_problems]
+        if below_minimum:
+            return min(below_minimum, key=lambda cell: self._assigned[cell])
+        return min(candidates, key=self._index)
+    
+    def _index(self, cell: tuple) -> float:
+        successes, n = self.outcomes(cell)
+        # A cell without valid votes yet is treated as on the threshold
+        asr = successes / n if n else self.threshold
+        return math.sqrt(self._assigned[cell]) * (abs(asr - self.threshold) + self.epsilon)
@@ -0,0 +1,87 @@
+"""Bounded-concurrency execution of independent model calls."""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.base import LLMClient, current_cell
+from defense.inference_budget import arun_with_budget
+
+
+def run_calls(
+    model: LLMClient,
+    calls: Iterable[Dict],
+    max_concurrency: int,
+    on_result: Callable[[Dict, List[str]], None],
+    max_tokens: int = 100,
+    deliberate_steps: Optional[int] = None,
+    sampler: Optional[Callable[[Dict], Awaitable[List[str]]]] = None,
+):
+    """
+    Run model calls with at most max_concurrency in flight.
+    
+    Each call is a dict with at least "prompt" and "n" (samples to draw); any
+    other keys are passed back untouched; a "cell" key is published to
+    backends as models.base.current_cell while the call runs. Calls are pulled from the iterable
+    lazily, so very large sweeps are never materialized. on_result runs on the
+    calling thread, one call at a time, in completion order. model.aclose()
+    is awaited before the event loop ends, whether or not the calls succeed.
+    
+    Args:
+        model: LLM client
+        calls: Iterable of call dicts
+        max_concurrency: Maximum number of calls in flight
+        on_result: Callback receiving (call, outputs)
+        max_tokens: Maximum tokens per sample
+        deliberate_steps: Optional deliberate reasoning steps
+        sampler: Optional coroutine function drawing the outputs of a call in
+            place of a single arun_with_budget() of call["n"] samples
+    """
+    asyncio.run(_run_calls(model, calls, max_concurrency, on_result, max_tokens, deliberate_steps, sampler))
+
+
+async def _run_calls(
+    model: LLMClient,
+    calls: Iterable[Dict],
+    max_concurrency: int,
+    on_result: Callable[[Dict, List[str]], None],
+    max_tokens: int,
+    deliberate_steps: Optional[int],
+    sampler: Optional[Callable[[Dict], Awaitable[List[str]]]] = None,
+):
+    """Drain calls with max_concurrency worker coroutines sharing one iterator."""
+    # Blocking clients run in this pool via asyncio.to_thread
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_concurrency))
+    
+    pending = iter(calls)
+    
+    async def worker():
+        for call in pending:
+            # Each worker runs in its own context, which to_thread passes on
+            current_cell.set(call.get("cell"))
+            if sampler is not None:
+                outputs = await sampler(call)
+            else:
+                outputs = await arun_with_budget(
+                    model=model,
+                    prompt=call["prompt"],
+                    k=call["n"],
+                    max_tokens=max_tokens,
+                    deliberate_steps=deliberate_steps,
+                )
+            on_result(call, outputs)
+    
+    workers = [asyncio.ensure_future(worker()) for _ in range(max_concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        # Stop handing out new calls if any worker failed
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # Async clients hold connection pools bound to this loop
+        await model.aclose()
@@ -1,19 +1,52 @@
 """Grid search runner for experiments."""
+import contextlib
+import contextvars
+import hashlib
+import json
 import os
 import sys
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from models.base import LLMClient
-from defense.inference_budget import run_with_budget
+from models.base import LLMClient, current_cell
+from defense.inference_budget import (
+    arun_adaptive_with_budget,
+    arun_with_budget,
+    run_adaptive_with_budget,
+    run_batch_with_budget,
+    run_with_budget,
+)
 from defense.voting import majority_vote
-from attacks.many_shot import build_many_shot_prompt, get_attacker_goal_value
+from attacks.many_shot import build_many_shot_prompt, build_many_shot_prefix, get_attacker_goal_value
 from attacks.distractor import make_think_less, make_nerd_snipe
-from eval.metrics import attack_success_rate, accuracy
+from eval.allocation import CellAllocator
+from eval.metrics import attack_success_rate, accuracy, confidence_interval, sprt_decision
+from eval.executor import run_calls
+from eval.journal import CellJournal
+from eval.sample_store import SampleStore, SampleWriter
+from models.cache import model_id
+from models.usage import BudgetExceeded, UsageTracker
+
+
+# Placeholder for problems that have not been voted on yet
+_PENDING = object()
+
+# Placeholder for problems left out because their cell stopped early
+_SKIPPED = object()
+
+
+def _apply_variation(prompt: str, variation_params: Dict, seed: Optional[int]) -> str:
+    """Apply variation-specific prompt modifications (these only prepend text)."""
+    if variation_params.get("use_think_less", False):
+        return make_think_less(prompt)
+    if variation_params.get("use_nerd_snipe", False):
+        return make_nerd_snipe(prompt, variation_params.get("nerd_snipe_tokens", 0), seed=seed)
+    return prompt
 
 
 def run_grid_experiment(
@@ -28,6 +61,26 @@ def run_grid_experiment(
     deliberate_steps: Optional[int] = None,
     seed: Optional[int] = None,
     output_dir: str = "results",
+    batch_size: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    samples_per_call: Optional[int] = None,
+    batch_runner=None,
+    max_cost: Optional[float] = None,
+    max_total_tokens: Optional[int] = None,
+    journal: bool = True,
+    resume: bool = False,
+    store_samples: bool = True,
+    task: Optional[str] = None,
+    reuse_samples: Optional[str] = None,
+    n_subsets: int = 16,
+    adaptive_step: Optional[int] = None,
+    stop_confidence: Optional[float] = None,
+    ci_target_width: Optional[float] = None,
+    sprt_threshold: Optional[float] = None,
+    ci_method: str = "wilson",
+    min_problems: int = 10,
+    sample_budget: Optional[int] = None,
+    allocation_threshold: float = 0.5,
 ) -> pd.DataFrame:
     """
     Run grid search experiment over k (compute) and attacker strength.
@@ -44,88 +97,1025 @@ def run_grid_experiment(
         deliberate_steps: Optional deliberate reasoning steps
         seed: Random seed
         output_dir: Directory to save results
+        batch_size: If set, send each cell's prompts to model.generate_batch
+            in batches of this size instead of one prompt at a time
+        max_concurrency: If greater than 1, fan out all (cell, problem, sample)
+            calls with at most this many in flight
+        samples_per_call: Samples requested per call in concurrent mode; by
+            default all k samples of a problem go to one generate_samples call
+            and the backend decides how to fan them out (e.g. OpenAI's n)
+        batch_runner: If set (e.g. an OpenAIBatchRunner), submit every planned
+            call offline through its run_calls() and vote once results return;
+            an OpenAIBatchRunner re-attaches a resumed run to the batches an
+            interrupted one submitted from the same work_dir
+        max_cost: Hard spend limit in USD; the run stops once it is exceeded
+            (not available with batch_runner)
+        max_total_tokens: Hard limit on prompt + completion tokens (not
+            available with batch_runner)
+        journal: Append every completed call to {variation}.journal.jsonl in
+            output_dir as it finishes
+        resume: Reuse the calls already in the journal and only run the rest
+        store_samples: Write every raw sample to the Parquet SampleStore in
+            output_dir/samples, so metrics can be recomputed without the model
+        task: Task name used to partition the sample store
+        reuse_samples: If set, draw max(k_values) samples once per
+            (attacker_strength, attacker_goal, problem) and vote every smaller
+            k on part of that draw: its first k samples ("prefix"), or
+            n_subsets random k-subsets whose metrics are averaged ("subsets",
+            lower variance). Costs max(k) instead of sum(k) samples per
+            problem; token usage is reported on the max-k cells and the
+            sample store gets each k's prefix of the draw.
+        n_subsets: Random subsets per problem and k in "subsets" mode
+        adaptive_step: If set, draw each problem's samples in batches of this
+            size and stop once its vote is decided (see
+            defense.inference_budget.vote_is_decided); results then include
+            the mean number of samples used per problem
+        stop_confidence: With adaptive_step, also stop once the runner-up
+            answer catches up with less than 1 - stop_confidence probability
+        ci_target_width: If set, stop running problems of a cell once the
+            95% interval on its attack success rate is narrower than this
+        sprt_threshold: If set, stop running problems of a cell once an SPRT
+            decides its attack success rate is above or below this value
+            (results then include an sprt_decision column)
+        ci_method: "wilson" or "clopper_pearson", for the reported interval
+            and ci_target_width
+        min_problems: Problems to run in every cell before stopping early
+            or allocating by sample_budget
+        sample_budget: If set, spend at most this many samples (k per
+            problem) in total, counting those a resumed run finds in the
+            journal, routing problems to the cells whose attack
+            success rate is least resolved against allocation_threshold
+            (see eval.allocation.CellAllocator); results then include the
+            samples spent on each cell, and problems left undrawn do not count
+        allocation_threshold: Attack success rate sample_budget resolves
+            cells against
         
     Returns:
-        DataFrame with results
+        DataFrame with results, including the number of problems voted, the
+        95% interval on attack success rate and per-cell token usage and cost. If a
+        budget stopped the run, only completed cells are included and
+        df.attrs["stopped_early"] is True. df.attrs["usage"] holds run totals.
+    """
+    if adaptive_step and (batch_size or batch_runner is not None):
+        raise ValueError("adaptive_step cannot be combined with batch_size or batch_runner")
+    if sample_budget is not None and (batch_size or batch_runner is not None):
+        # Both run every planned draw before any vote comes back to steer allocation
+        raise ValueError("sample_budget cannot be combined with batch_size or batch_runner")
+    if (max_cost is not None or max_total_tokens is not None) and batch_runner is not None:
+        # Batches are paid for when submitted, before any usage reaches the tracker
+        raise ValueError("max_cost and max_total_tokens cannot be combined with batch_runner")
+    
+    run = _GridRun(
+        model=model,
+        test_problems=test_problems,
+        k_values=k_values,
+        attacker_strengths=attacker_strengths,
+        attacker_goals=attacker_goals,
+        variation=variation,
+        variation_params=variation_params,
+        max_tokens=max_tokens,
+        deliberate_steps=deliberate_steps,
+        seed=seed,
+        output_dir=output_dir,
+        max_cost=max_cost,
+        max_total_tokens=max_total_tokens,
+        # Batch API requests are billed at half price
+        price_factor=0.5 if batch_runner is not None else 1.0,
+        journal=journal,
+        resume=resume,
+        store_samples=store_samples,
+        task=task,
+        reuse_samples=reuse_samples,
+        n_subsets=n_subsets,
+        adaptive_step=adaptive_step,
+        stop_confidence=stop_confidence,
+        ci_target_width=ci_target_width,
+        sprt_threshold=sprt_threshold,
+        ci_method=ci_method,
+        min_problems=min_problems,
+        sample_budget=sample_budget,
+        allocation_threshold=allocation_threshold,
+    )
+    
+    try:
+        with run.guard_signals():
+            run.restore()
+            _execute(
+                model=model,
+                cells=run.draw_cells,
+                prompts=run.prompts,
+                predictions=run.predictions,
+                resumed=run.resumed,
+                batch_runner=batch_runner,
+                batch_size=batch_size,
+                max_concurrency=max_concurrency,
+                samples_per_call=samples_per_call,
+                max_tokens=max_tokens,
+                deliberate_steps=deliberate_steps,
+                tracker=run.tracker,
+                journal=run.journal,
+                finish=run.finish,
+                adaptive_step=adaptive_step,
+                stop_confidence=stop_confidence,
+                order=run.allocator,
+            )
+            run.skip_unallocated()
+        stopped_early = False
+    except BudgetExceeded as e:
+        print(f"\nStopping {variation} experiment: {e}")
+        stopped_early = True
+    finally:
+        run.close_journal()
+    
+    return run.results(stopped_early)
+
+
+def run_grid_experiments(
+    model: LLMClient,
+    experiments: List[Dict],
+    max_concurrency: Optional[int] = None,
+    samples_per_call: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    batch_runner=None,
+    max_cost: Optional[float] = None,
+    max_total_tokens: Optional[int] = None,
+    **shared,
+) -> List[pd.DataFrame]:
     """
-    os.makedirs(output_dir, exist_ok=True)
+    Run several grid experiments through one shared queue of model calls.
     
-    variation_params = variation_params or {}
-    use_think_less = variation_params.get("use_think_less", False)
-    use_nerd_snipe = variation_params.get("use_nerd_snipe", False)
-    nerd_snipe_tokens = variation_params.get("nerd_snipe_tokens", 0)
+    With max_concurrency above 1, the planned calls of all experiments are
+    chained into a single lazy queue drained by the same max_concurrency
+    workers, so calls of the next experiment fill the slots freed by the tail
+    of the previous one instead of waiting for it to drain. Each experiment
+    keeps its own journal, sample store partition, early stopping, sample
+    budget and CSV. Otherwise, or with batch_size or batch_runner, the
+    experiments run one after another through run_grid_experiment.
     
-    results = []
+    Args:
+        model: LLM client shared by all experiments
+        experiments: run_grid_experiment arguments of each experiment (e.g.
+            test_problems, attacker_goals, variation, task); every experiment
+            needs its own variation
+        max_concurrency: Calls in flight across all experiments
+        samples_per_call: Samples requested per call, as in run_grid_experiment
+        batch_size: As in run_grid_experiment
+        batch_runner: As in run_grid_experiment
+        max_cost: Hard spend limit in USD for all experiments together
+        max_total_tokens: Hard limit on prompt + completion tokens for all
+            experiments together
+        **shared: run_grid_experiment arguments common to all experiments;
+            entries of experiments take precedence
+        
+    Returns:
+        One DataFrame per experiment, as from run_grid_experiment. If a budget
+        stops a shared queue, every experiment reports its completed cells
+        with stopped_early set; run one after another, experiments after the
+        one that stopped are not run and not returned.
+    """
+    variations = [experiment.get("variation", shared.get("variation", "baseline")) for experiment in experiments]
+    if len(set(variations)) < len(variations):
+        raise ValueError("Every experiment needs its own variation")
     
-    total_runs = len(k_values) * len(attacker_strengths) * len(attacker_goals) * len(test_problems)
-    pbar = tqdm(total=total_runs, desc=f"Running {variation} experiment")
+    if not max_concurrency or max_concurrency <= 1 or batch_size or batch_runner is not None:
+        runs = []
+        budget = dict(max_cost=max_cost, max_total_tokens=max_total_tokens)
+        for experiment in experiments:
+            if runs and runs[-1].attrs.get("stopped_early"):
+                break
+            runs.append(run_grid_experiment(
+                model=model,
+                max_concurrency=max_concurrency,
+                samples_per_call=samples_per_call,
+                batch_size=batch_size,
+                batch_runner=batch_runner,
+                **_remaining_budget({**shared, **budget, **experiment}, runs),
+            ))
+        return runs
     
-    for k in k_values:
-        for attacker_strength in attacker_strengths:
+    # Budgets apply to the sum over experiments, not to each one
+    runs = [_GridRun(model=model, **{**shared, **experiment}) for experiment in experiments]
+    
+    def calls():
+        for index, run in enumerate(runs):
+            for call in run.calls(samples_per_call):
+                call["experiment"] = index
+                yield call
+    
+    def on_result(call, outputs):
+        runs[call["experiment"]].on_result(call, outputs)
+        _enforce_budget([run.tracker for run in runs], max_cost, max_total_tokens)
+    
+    async def sampler(call):
+        return await runs[call["experiment"]].sample(call)
+    
+    try:
+        with contextlib.ExitStack() as stack:
+            for run in runs:
+                stack.enter_context(run.guard_signals())
+                run.restore()
+            _enforce_budget([run.tracker for run in runs], max_cost, max_total_tokens)
+            run_calls(
+                model=model,
+                calls=calls(),
+                max_concurrency=max_concurrency,
+                on_result=on_result,
+                sampler=sampler,
+            )
+            for run in runs:
+                run.skip_unallocated()
+        stopped_early = False
+    except BudgetExceeded as e:
+        print(f"\nStopping {len(runs)} experiments: {e}")
+        stopped_early = True
+    finally:
+        for run in runs:
+            run.close_journal()
+    
+    return [run.results(stopped_early) for run in runs]
+
+
+def run_sparse_grid(
+    model: LLMClient,
+    test_problems: List[tuple],
+    cells: List[Tuple[int, int]],
+    attacker_goal: str,
+    variation: str = "sparse",
+    output_dir: str = "results",
+    **grid_kwargs,
+) -> pd.DataFrame:
+    """
+    Run only some (k, attacker_strength) cells of a grid.
+    
+    Cells are run with one run_grid_experiment per k, over the strengths
+    chosen at that k, as variation {variation}_k{k}.
+    
+    Args:
+        model: LLM client
+        test_problems: List of (question_str, answer_int) tuples
+        cells: (k, attacker_strength) pairs to run
+        attacker_goal: Attacker goal
+        variation: Experiment variation name
+        output_dir: Directory to save results
+        **grid_kwargs: Further run_grid_experiment arguments; max_cost and
+            max_total_tokens apply to all cells together
+        
+    Returns:
+        DataFrame with results of every cell run; df.attrs holds the summed
+        "usage" and "stopped_early" as in run_grid_experiment
+    """
+    by_k = {}
+    for k, attacker_strength in cells:
+        by_k.setdefault(k, []).append(attacker_strength)
+    
+    runs = []
+    for k, strengths in sorted(by_k.items()):
+        if runs and runs[-1].attrs.get("stopped_early"):
+            break
+        runs.append(run_grid_experiment(
+            model=model,
+            test_problems=test_problems,
+            k_values=[k],
+            attacker_strengths=sorted(set(strengths)),
+            attacker_goals=[attacker_goal],
+            variation=f"{variation}_k{k}",
+            output_dir=output_dir,
+            **_remaining_budget(grid_kwargs, runs),
+        ))
+    return _combine_runs(runs)
+
+
+def _remaining_budget(grid_kwargs: Dict, runs: List[pd.DataFrame]) -> Dict:
+    """grid_kwargs with max_cost and max_total_tokens reduced by what earlier runs used."""
+    kwargs = dict(grid_kwargs)
+    usage = [df.attrs.get("usage", {}) for df in runs]
+    if kwargs.get("max_cost") is not None:
+        kwargs["max_cost"] -= sum(totals.get("cost_usd", 0.0) for totals in usage)
+    if kwargs.get("max_total_tokens") is not None:
+        kwargs["max_total_tokens"] -= sum(
+            totals.get("prompt_tokens", 0) + totals.get("completion_tokens", 0) for totals in usage
+        )
+    return kwargs
+
+
+def _combine_runs(runs: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate run_grid_experiment results, summing their usage."""
+    df = pd.concat(runs, ignore_index=True) if runs else pd.DataFrame()
+    df.attrs["stopped_early"] = any(run.attrs.get("stopped_early") for run in runs)
+    usage = {}
+    for run in runs:
+        for name, value in run.attrs.get("usage", {}).items():
+            usage[name] = usage.get(name, 0) + value
+    df.attrs["usage"] = usage
+    return df
+
+
+def _enforce_budget(trackers: List[UsageTracker], max_cost: Optional[float], max_total_tokens: Optional[int]):
+    """Raise BudgetExceeded once the trackers together pass max_cost or max_total_tokens."""
+    cost = sum(tracker.totals["cost_usd"] for tracker in trackers)
+    total_tokens = sum(tracker.totals["prompt_tokens"] + tracker.totals["completion_tokens"] for tracker in trackers)
+    if max_cost is not None and cost > max_cost:
+        raise BudgetExceeded(f"Spend ${cost:.4f} exceeded budget ${max_cost:.4f}")
+    if max_total_tokens is not None and total_tokens > max_total_tokens:
+        raise BudgetExceeded(f"{total_tokens} tokens exceeded budget of {max_total_tokens}")
+
+
+class _GridRun:
+    """
+    State of one grid experiment: prompts, votes, usage, journal and sample writer.
+    
+    Arguments are those of run_grid_experiment, which drives a single run
+    through _execute(); run_grid_experiments drives several through one call
+    queue using calls(), on_result() and sample().
+    """
+    
+    def __init__(
+        self,
+        model: LLMClient,
+        test_problems: List[tuple],
+        k_values: List[int],
+        attacker_strengths: List[int],
+        attacker_goals: List[str],
+        variation: str = "baseline",
+        variation_params: Optional[Dict] = None,
+        max_tokens: int = 100,
+        deliberate_steps: Optional[int] = None,
+        seed: Optional[int] = None,
+        output_dir: str = "results",
+        max_cost: Optional[float] = None,
+        max_total_tokens: Optional[int] = None,
+        price_factor: float = 1.0,
+        journal: bool = True,
+        resume: bool = False,
+        store_samples: bool = True,
+        task: Optional[str] = None,
+        reuse_samples: Optional[str] = None,
+        n_subsets: int = 16,
+        adaptive_step: Optional[int] = None,
+        stop_confidence: Optional[float] = None,
+        ci_target_width: Optional[float] = None,
+        sprt_threshold: Optional[float] = None,
+        ci_method: str = "wilson",
+        min_problems: int = 10,
+        sample_budget: Optional[int] = None,
+        allocation_threshold: float = 0.5,
+    ):
+        if reuse_samples not in (None, "prefix", "subsets"):
+            raise ValueError(f"Unknown reuse_samples mode: {reuse_samples}")
+        if adaptive_step and reuse_samples:
+            raise ValueError("adaptive_step cannot be combined with reuse_samples")
+        
+        os.makedirs(output_dir, exist_ok=True)
+        
+        variation_params = variation_params or {}
+        
+        self.model = model
+        self.test_problems = test_problems
+        self.variation = variation
+        self.output_dir = output_dir
+        self.max_tokens = max_tokens
+        self.deliberate_steps = deliberate_steps
+        self.adaptive_step = adaptive_step
+        self.stop_confidence = stop_confidence
+        self.ci_method = ci_method
+        self.sprt_threshold = sprt_threshold
+        self.min_problems = min_problems
+        self.sample_budget = sample_budget
+        self.allocation_threshold = allocation_threshold
+        
+        if seed is not None:
+            # Seeded attacks are nested across strengths; let caching backends
+            # prefill each goal's longest attack once for the whole sweep
             for attacker_goal in attacker_goals:
-                predictions = []
-                true_answers = []
-                attacker_goal_values = []
-                
-                for question, answer in test_problems:
-                    # Build base prompt with attack
-                    base_prompt = build_many_shot_prompt(
-                        question=question,
-                        answer=answer,
-                        attacker_goal=attacker_goal,
-                        attacker_strength_tokens=attacker_strength,
-                        seed=seed,
+                model.prefill_prefixes([
+                    _apply_variation(
+                        build_many_shot_prefix(attacker_goal, attacker_strength, seed=seed),
+                        variation_params,
+                        seed,
                     )
-                    
-                    # Apply variation-specific modifications
-                    prompt = base_prompt
-                    if use_think_less:
-                        prompt = make_think_less(prompt)
-                    elif use_nerd_snipe:
-                        prompt = make_nerd_snipe(prompt, nerd_snipe_tokens, seed=seed)
-                    
-                    # Run with budget (k samples)
-                    outputs = run_with_budget(
-                        model=model,
-                        prompt=prompt,
-                        k=k,
-                        max_tokens=max_tokens,
-                        deliberate_steps=deliberate_steps,
+                    for attacker_strength in attacker_strengths
+                ])
+        
+        # Prompts depend only on (attacker_strength, attacker_goal), not on k
+        self.prompts = {}
+        for attacker_strength in attacker_strengths:
+            for attacker_goal in attacker_goals:
+                self.prompts[(attacker_strength, attacker_goal)] = [
+                    _apply_variation(
+                        build_many_shot_prompt(
+                            question=question,
+                            answer=answer,
+                            attacker_goal=attacker_goal,
+                            attacker_strength_tokens=attacker_strength,
+                            seed=seed,
+                        ),
+                        variation_params,
+                        seed,
                     )
+                    for question, answer in test_problems
+                ]
+        
+        self.cells = [
+            (k, attacker_strength, attacker_goal)
+            for k in k_values
+            for attacker_strength in attacker_strengths
+            for attacker_goal in attacker_goals
+        ]
+        self.predictions = {cell: [_PENDING] * len(test_problems) for cell in self.cells}
+        self.samples_used = {cell: [0] * len(test_problems) for cell in self.cells}
+        
+        # Cells whose samples are actually drawn
+        if reuse_samples:
+            self.draw_cells = [cell for cell in self.cells if cell[0] == max(k_values)]
+        else:
+            self.draw_cells = self.cells
+        
+        total_runs = len(self.cells) * len(test_problems)
+        self.pbar = tqdm(total=total_runs, desc=f"Running {variation} experiment")
+        
+        self.tracker = UsageTracker(
+            model_name=getattr(model, "model_name", ""),
+            max_cost=max_cost,
+            max_total_tokens=max_total_tokens,
+            price_factor=price_factor,
+        )
+        
+        self.journal = None
+        if journal or resume:
+            self.journal = CellJournal(
+                os.path.join(output_dir, f"{variation}.journal.jsonl"),
+                header=_journal_header(model, test_problems, variation_params, max_tokens, deliberate_steps, seed),
+                resume=resume,
+            )
+        
+        self.writer = None
+        if store_samples:
+            self.writer = SampleStore(os.path.join(output_dir, "samples")).writer(
+                variation, task, self.prompts, [answer for _, answer in test_problems]
+            )
+        
+        stop_rule = None
+        if ci_target_width is not None or sprt_threshold is not None:
+            stop_rule = _early_stop_rule(
+                self.predictions, test_problems, ci_target_width, sprt_threshold, ci_method, min_problems
+            )
+        
+        self.finish = _problem_finisher(
+            self.predictions,
+            self.samples_used,
+            self.pbar,
+            self.writer,
+            k_values=k_values if reuse_samples else None,
+            subsets=n_subsets if reuse_samples == "subsets" else None,
+            seed=seed,
+            stop_rule=stop_rule,
+        )
+        
+        self.resumed = {}
+        self.allocator = None
+        self.on_result = None
+    
+    def guard_signals(self):
+        """Context closing the journal durably on SIGTERM (a no-op without journal)."""
+        return self.journal.guard_signals() if self.journal else contextlib.nullcontext()
+    
+    def restore(self):
+        """Vote journaled problems, then set up the allocator and the result callback."""
+        self.resumed = _restore_from_journal(
+            self.journal, self.draw_cells, len(self.test_problems), self.tracker, self.finish
+        )
+        if self.sample_budget is not None:
+            self.allocator = CellAllocator(
+                cells=self.draw_cells,
+                n_problems=len(self.test_problems),
+                is_pending=lambda cell, i: self.predictions[cell][i] is _PENDING,
+                outcomes=_cell_outcomes(self.predictions, self.test_problems),
+                # Samples restored from the journal were paid for by an earlier run
+                sample_budget=max(0, self.sample_budget - self.tracker.totals["samples"]),
+                threshold=self.allocation_threshold,
+                min_problems=self.min_problems,
+            )
+        self.on_result = _vote_collector(self.tracker, self.finish, self.journal, self.resumed)
+    
+    def calls(self, samples_per_call: Optional[int] = None):
+        """Planned calls of the problems still to draw, for run_calls()."""
+        if self.adaptive_step:
+            # One call per problem, which draws its own batches until decided
+            samples_per_call = None
+        return _planned_calls(
+            self.draw_cells, self.prompts, samples_per_call, self.predictions, self.resumed, self.allocator
+        )
+    
+    async def sample(self, call: Dict) -> List[str]:
+        """Draw the outputs of one planned call with this run's settings."""
+        if self.adaptive_step:
+            return await arun_adaptive_with_budget(
+                model=self.model,
+                prompt=call["prompt"],
+                k=call["cell"][0],
+                step=self.adaptive_step,
+                confidence=self.stop_confidence,
+                outputs=self.resumed.get((call["cell"], call["problem"])),
+                max_tokens=self.max_tokens,
+                deliberate_steps=self.deliberate_steps,
+            )
+        return await arun_with_budget(
+            model=self.model,
+            prompt=call["prompt"],
+            k=call["n"],
+            max_tokens=self.max_tokens,
+            deliberate_steps=self.deliberate_steps,
+        )
+    
+    def skip_unallocated(self):
+        """Leave out the problems a sample budget did not reach."""
+        if self.allocator is None:
+            return
+        for cell_predictions in self.predictions.values():
+            for i, prediction in enumerate(cell_predictions):
+                if prediction is _PENDING:
+                    cell_predictions[i] = _SKIPPED
+    
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+    
+    def results(self, stopped_early: bool) -> pd.DataFrame:
+        """Summarize finished cells, print usage and save {variation}.csv."""
+        self.pbar.close()
+        if self.writer is not None:
+            self.writer.close()
+        
+        # Only cells whose every problem was voted on are reported
+        results = [
+            {
+                **_summarize_cell(
+                    cell, self.predictions[cell], self.test_problems, self.variation, self.ci_method, self.sprt_threshold
+                ),
+                **self.tracker.summary(cell),
+            }
+            for cell in self.cells
+            if not any(prediction is _PENDING for prediction in self.predictions[cell])
+        ]
+        if self.adaptive_step:
+            for row in results:
+                row["mean_samples"] = float(np.mean(self.samples_used[(row["k"], row["attacker_strength"], row["attacker_goal"])]))
+        if self.sample_budget is not None:
+            for row in results:
+                row["n_samples"] = int(sum(self.samples_used[(row["k"], row["attacker_strength"], row["attacker_goal"])]))
+        
+        df = pd.DataFrame(results)
+        df.attrs["stopped_early"] = stopped_early
+        # Includes spend on cells that were cut short
+        df.attrs["usage"] = dict(self.tracker.totals)
+        
+        totals = self.tracker.totals
+        if totals["prompt_tokens"] or totals["completion_tokens"]:
+            print(f"Usage: {totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens "
+                  f"({totals['reasoning_tokens']} reasoning), ${totals['cost_usd']:.4f}")
+        
+        # Save CSV
+        output_file = os.path.join(self.output_dir, f"{self.variation}.csv")
+        df.to_csv(output_file, index=False)
+        print(f"Results saved to {output_file}")
+        
+        return df
+
+
+def _journal_header(
+    model: LLMClient,
+    test_problems: List[tuple],
+    variation_params: Dict,
+    max_tokens: int,
+    deliberate_steps: Optional[int],
+    seed: Optional[int],
+) -> Dict:
+    """Everything a resumed run must share with the run that wrote the journal."""
+    header = {
+        "model": model_id(model),
+        "problems": hashlib.sha256(json.dumps(test_problems).encode()).hexdigest(),
+        "variation_params": variation_params,
+        "max_tokens": max_tokens,
+        "deliberate_steps": deliberate_steps,
+        "seed": seed,
+    }
+    # Normalize tuples and the like to what the journal reads back
+    return json.loads(json.dumps(header))
+
+
+def _restore_from_journal(
+    journal: Optional[CellJournal],
+    cells: List[tuple],
+    n_problems: int,
+    tracker: UsageTracker,
+    finish: Callable[[tuple, int, List[str]], None],
+) -> Dict[tuple, List[str]]:
+    """
+    Vote problems whose samples are all in the journal.
+    
+    Returns:
+        Dict mapping (cell, problem) to the journaled outputs of problems that
+        only got part of their samples
+    """
+    resumed = {}
+    if journal is None:
+        return resumed
+    for cell in cells:
+        for i in range(n_problems):
+            outputs = journal.completed(cell, i)[:cell[0]]
+            if not outputs:
+                continue
+            tracker.add(cell, outputs)
+            if len(outputs) == cell[0]:
+                finish(cell, i, outputs)
+            else:
+                resumed[(cell, i)] = outputs
+    return resumed
+
+
+def _execute(
+    model: LLMClient,
+    cells: List[tuple],
+    prompts: Dict[tuple, List[str]],
+    predictions: Dict[tuple, List[Optional[int]]],
+    resumed: Dict[tuple, List[str]],
+    batch_runner,
+    batch_size: Optional[int],
+    max_concurrency: Optional[int],
+    samples_per_call: Optional[int],
+    max_tokens: int,
+    deliberate_steps: Optional[int],
+    tracker: UsageTracker,
+    journal: Optional[CellJournal],
+    finish: Callable[[tuple, int, List[str]], None],
+    adaptive_step: Optional[int] = None,
+    stop_confidence: Optional[float] = None,
+    order: Optional[Iterable[Tuple[tuple, int]]] = None,
+):
+    """
+    Run every problem that is not voted yet on the chosen execution path.
+    
+    order, if given, yields the (cell, problem) pairs to run instead, and is
+    consumed lazily so it can react to the votes so far.
+    """
+    if batch_runner is not None:
+        batch_runner.run_calls(
+            calls=list(_planned_calls(cells, prompts, samples_per_call, predictions, resumed, order)),
+            on_result=_vote_collector(tracker, finish, journal, resumed),
+            max_tokens=max_tokens,
+            deliberate_steps=deliberate_steps,
+        )
+    elif max_concurrency and max_concurrency > 1:
+        sampler = None
+        if adaptive_step:
+            # One call per problem, which draws its own batches until decided
+            samples_per_call = None
+            
+            async def sampler(call):
+                return await arun_adaptive_with_budget(
+                    model=model,
+                    prompt=call["prompt"],
+                    k=call["cell"][0],
+                    step=adaptive_step,
+                    confidence=stop_confidence,
+                    outputs=resumed.get((call["cell"], call["problem"])),
+                    max_tokens=max_tokens,
+                    deliberate_steps=deliberate_steps,
+                )
+        
+        run_calls(
+            model=model,
+            calls=_planned_calls(cells, prompts, samples_per_call, predictions, resumed, order),
+            max_concurrency=max_concurrency,
+            on_result=_vote_collector(tracker, finish, journal, resumed),
+            max_tokens=max_tokens,
+            deliberate_steps=deliberate_steps,
+            sampler=sampler,
+        )
+    else:
+        # In a copy of the context, so the current_cell it sets does not leak
+        contextvars.copy_context().run(
+            _run_cells_sequentially,
+            model=model,
+            cells=cells,
+            prompts=prompts,
+            predictions=predictions,
+            resumed=resumed,
+            batch_size=batch_size,
+            max_tokens=max_tokens,
+            deliberate_steps=deliberate_steps,
+            tracker=tracker,
+            journal=journal,
+            finish=finish,
+            adaptive_step=adaptive_step,
+            stop_confidence=stop_confidence,
+            order=order,
+        )
+
+
+def _run_cells_sequentially(
+    model: LLMClient,
+    cells: List[tuple],
+    prompts: Dict[tuple, List[str]],
+    predictions: Dict[tuple, List[Optional[int]]],
+    resumed: Dict[tuple, List[str]],
+    batch_size: Optional[int],
+    max_tokens: int,
+    deliberate_steps: Optional[int],
+    tracker: UsageTracker,
+    finish: Callable[[tuple, int, List[str]], None],
+    journal: Optional[CellJournal] = None,
+    adaptive_step: Optional[int] = None,
+    stop_confidence: Optional[float] = None,
+    order: Optional[Iterable[Tuple[tuple, int]]] = None,
+):
+    """Run cells one at a time, one problem at a time (or one batch at a time)."""
+    if not batch_size:
+        if order is None:
+            order = ((cell, i) for cell in cells for i in range(len(predictions[cell])))
+        for cell, i in order:
+            if predictions[cell][i] is not _PENDING:
+                # Already voted, or the cell stopped early
+                continue
+            k, attacker_strength, attacker_goal = cell
+            prompt = prompts[(attacker_strength, attacker_goal)][i]
+            existing = resumed.get((cell, i), [])
+            current_cell.set(cell)
+            if adaptive_step:
+                # Draw until the vote is decided, counting journaled samples
+                new_outputs = run_adaptive_with_budget(
+                    model=model,
+                    prompt=prompt,
+                    k=k,
+                    step=adaptive_step,
+                    confidence=stop_confidence,
+                    outputs=existing,
+                    max_tokens=max_tokens,
+                    deliberate_steps=deliberate_steps,
+                )
+            else:
+                # Run with budget (the k samples not journaled yet)
+                new_outputs = run_with_budget(
+                    model=model,
+                    prompt=prompt,
+                    k=k - len(existing),
+                    max_tokens=max_tokens,
+                    deliberate_steps=deliberate_steps,
+                )
+            if journal is not None:
+                journal.record(cell, i, len(existing), new_outputs)
+            tracker.add(cell, new_outputs)
+            
+            # Vote to get final prediction
+            finish(cell, i, existing + new_outputs)
+        return
+    
+    for cell in cells:
+        k, attacker_strength, attacker_goal = cell
+        cell_prompts = prompts[(attacker_strength, attacker_goal)]
+        todo = [i for i in range(len(cell_prompts)) if predictions[cell][i] is _PENDING]
+        if not todo:
+            continue
+        
+        # Run the cell's remaining problems through batched generation, one
+        # batch_size chunk at a time so each is journaled as soon as it is drawn;
+        # partially journaled problems only draw the samples they are missing
+        current_cell.set(cell)
+        by_missing = {}
+        for i in todo:
+            by_missing.setdefault(k - len(resumed.get((cell, i), [])), []).append(i)
+        for missing, problems in by_missing.items():
+            for start in range(0, len(problems), batch_size):
+                chunk = [i for i in problems[start:start + batch_size] if predictions[cell][i] is _PENDING]
+                if not chunk:
+                    # The cell stopped early
+                    continue
+                batch_outputs = run_batch_with_budget(
+                    model=model,
+                    prompts=[cell_prompts[i] for i in chunk],
+                    k=missing,
+                    batch_size=batch_size,
+                    max_tokens=max_tokens,
+                    deliberate_steps=deliberate_steps,
+                )
+                
+                for i, new_outputs in zip(chunk, batch_outputs):
+                    existing = resumed.get((cell, i), [])
+                    if journal is not None:
+                        journal.record(cell, i, len(existing), new_outputs)
+                    tracker.add(cell, new_outputs)
                     
                     # Vote to get final prediction
-                    prediction = majority_vote(outputs)
-                    
-                    # Get attacker goal value
-                    goal_value = get_attacker_goal_value(answer, attacker_goal)
-                    
-                    predictions.append(prediction)
-                    true_answers.append(answer)
-                    attacker_goal_values.append(goal_value)
-                    
-                    pbar.update(1)
-                
-                # Compute metrics
-                asr = attack_success_rate(predictions, true_answers, attacker_goal_values)
-                acc = accuracy(predictions, true_answers)
-                
-                results.append({
-                    "k": k,
-                    "attacker_strength": attacker_strength,
-                    "attacker_goal": attacker_goal,
-                    "attack_success_rate": asr,
-                    "accuracy": acc,
-                    "variation": variation,
-                })
+                    finish(cell, i, existing + new_outputs)
+
+
+def _planned_calls(
+    cells: List[tuple],
+    prompts: Dict[tuple, List[str]],
+    samples_per_call: Optional[int],
+    predictions: Optional[Dict[tuple, List[Optional[int]]]] = None,
+    resumed: Optional[Dict[tuple, List[str]]] = None,
+    order: Optional[Iterable[Tuple[tuple, int]]] = None,
+):
+    """
+    Yield one call dict per (cell, problem, chunk of samples) still to draw.
+    
+    Problems come cell by cell, or in the sequence of order if given.
+    """
+    resumed = resumed or {}
+    if order is None:
+        order = (
+            (cell, i)
+            for cell in cells
+            for i in range(len(prompts[(cell[1], cell[2])]))
+        )
+    for cell, i in order:
+        if predictions is not None and predictions[cell][i] is not _PENDING:
+            continue
+        k, attacker_strength, attacker_goal = cell
+        chunk = max(1, samples_per_call or k)
+        for start in range(len(resumed.get((cell, i), [])), k, chunk):
+            yield {
+                "cell": cell,
+                "problem": i,
+                "sample": start,
+                "n": min(chunk, k - start),
+                "prompt": prompts[(attacker_strength, attacker_goal)][i],
+            }
+
+
+def _vote_collector(
+    tracker: UsageTracker,
+    finish: Callable[[tuple, int, List[str]], None],
+    journal: Optional[CellJournal] = None,
+    resumed: Optional[Dict[tuple, List[str]]] = None,
+):
+    """
+    Build an on_result callback that votes each problem once all its samples arrived.
     
-    pbar.close()
+    Outputs are stored by sample index, so votes do not depend on completion order.
+    """
+    resumed = resumed or {}
+    pending = {}
     
-    df = pd.DataFrame(results)
+    def on_result(call, outputs):
+        cell, i = call["cell"], call["problem"]
+        if journal is not None:
+            journal.record(cell, i, call["sample"], outputs)
+        tracker.add(cell, outputs)
+        entry = pending.get((cell, i))
+        if entry is None:
+            existing = resumed.get((cell, i), [])
+            entry = pending[(cell, i)] = {
+                "outputs": existing + [None] * (cell[0] - len(existing)),
+                "remaining": cell[0] - len(existing),
+            }
+        entry["outputs"][call["sample"]:call["sample"] + call["n"]] = outputs
+        entry["remaining"] -= call["n"]
+        if entry["remaining"] == 0:
+            del pending[(cell, i)]
+            finish(cell, i, entry["outputs"])
     
-    # Save CSV
-    output_file = os.path.join(output_dir, f"{variation}.csv")
-    df.to_csv(output_file, index=False)
-    print(f"Results saved to {output_file}")
+    return on_result
+
+
+def _problem_finisher(
+    predictions: Dict[tuple, list],
+    samples_used: Dict[tuple, List[int]],
+    pbar: tqdm,
+    writer: Optional[SampleWriter],
+    k_values: Optional[List[int]] = None,
+    subsets: Optional[int] = None,
+    seed: Optional[int] = None,
+    stop_rule: Optional[Callable[[tuple], bool]] = None,
+) -> Callable[[tuple, int, List[str]], None]:
+    """
+    Build the callback that votes a problem once all samples of its draw are in.
     
-    return df
+    Without k_values a draw is voted for its own cell only. With k_values it
+    is voted for every k on its first k outputs, or, if subsets is set, on
+    that many random k-subsets (the cell's prediction is then a list of votes).
+    Once stop_rule holds for the drawn cell, its problems that have not
+    started are skipped in every cell voted from it.
+    """
+    def finish(cell, problem, outputs):
+        _, attacker_strength, attacker_goal = cell
+        for k in k_values or [cell[0]]:
+            derived = (k, attacker_strength, attacker_goal)
+            if predictions[derived][problem] is _SKIPPED:
+                # Was already in flight when the cell stopped
+                pbar.total += 1
+            voted_subsets = subsets if subsets and k < len(outputs) else None
+            if voted_subsets:
+                rng = np.random.default_rng(None if seed is None else [seed, problem, k, attacker_strength])
+                predictions[derived][problem] = [
+                    majority_vote([outputs[j] for j in rng.choice(len(outputs), size=k, replace=False)])
+                    for _ in range(subsets)
+                ]
+            else:
+                predictions[derived][problem] = majority_vote(outputs[:k])
+            samples_used[derived][problem] = len(outputs[:k])
+            if writer is not None:
+                writer.add(derived, problem, outputs[:k], subsets=voted_subsets)
+            pbar.update(1)
+        
+        if stop_rule is not None and stop_rule(cell):
+            for k in k_values or [cell[0]]:
+                cell_predictions = predictions[(k, attacker_strength, attacker_goal)]
+                for i, prediction in enumerate(cell_predictions):
+                    if prediction is _PENDING:
+                        cell_predictions[i] = _SKIPPED
+                        pbar.total -= 1
+    
+    return finish
+
+
+def _early_stop_rule(
+    predictions: Dict[tuple, list],
+    test_problems: List[tuple],
+    ci_target_width: Optional[float],
+    sprt_threshold: Optional[float],
+    ci_method: str,
+    min_problems: int,
+) -> Callable[[tuple], bool]:
+    """Build the test of whether a cell has run enough problems."""
+    outcomes = _cell_outcomes(predictions, test_problems)
+    
+    def should_stop(cell):
+        successes, n = outcomes(cell)
+        if n < min_problems:
+            return False
+        if ci_target_width is not None:
+            low, high = confidence_interval(successes, n, ci_method)
+            if high - low < ci_target_width:
+                return True
+        return sprt_threshold is not None and sprt_decision(successes, n, sprt_threshold) is not None
+    
+    return should_stop
+
 
+def _cell_outcomes(
+    predictions: Dict[tuple, list],
+    test_problems: List[tuple],
+) -> Callable[[tuple], Tuple[int, int]]:
+    """Build a function giving (successful attacks, valid votes) of a cell so far."""
+    true_answers = [answer for _, answer in test_problems]
+    goal_values = {}
+    
+    def outcomes(cell):
+        if cell[2] not in goal_values:
+            goal_values[cell[2]] = [get_attacker_goal_value(answer, cell[2]) for answer in true_answers]
+        goals = goal_values[cell[2]]
+        successes = n = 0
+        for i, prediction in enumerate(predictions[cell]):
+            if prediction is _PENDING or prediction is _SKIPPED or prediction is None:
+                continue
+            n += 1
+            successes += prediction == goals[i] and prediction != true_answers[i]
+        return successes, n
+    
+    return outcomes
+
+
+def _summarize_cell(
+    cell: tuple,
+    predictions: List[Optional[int]],
+    test_problems: List[tuple],
+    variation: str,
+    ci_method: str = "wilson",
+    sprt_threshold: Optional[float] = None,
+) -> Dict:
+    """Compute the metrics row for one (k, attacker_strength, attacker_goal) cell."""
+    k, attacker_strength, attacker_goal = cell
+    # Problems skipped by early stopping do not count
+    kept = [i for i, prediction in enumerate(predictions) if prediction is not _SKIPPED]
+    predictions = [predictions[i] for i in kept]
+    true_answers = [test_problems[i][1] for i in kept]
+    attacker_goal_values = [get_attacker_goal_value(answer, attacker_goal) for answer in true_answers]
+    
+    # Compute metrics, averaged over subsets if each problem has several votes
+    if predictions and isinstance(predictions[0], list):
+        votes = [list(subset) for subset in zip(*predictions)]
+    else:
+        votes = [predictions]
+    asr = float(np.mean([attack_success_rate(p, true_answers, attacker_goal_values) for p in votes]))
+    acc = float(np.mean([accuracy(p, true_answers) for p in votes]))
+    
+    # Attack success rate is over problems with a valid vote
+    n_valid = float(np.mean([sum(prediction is not None for prediction in p) for p in votes]))
+    asr_low, asr_high = confidence_interval(asr * n_valid, n_valid, ci_method)
+    
+    row = {
+        "k": k,
+        "attacker_strength": attacker_strength,
+        "attacker_goal": attacker_goal,
+        "attack_success_rate": asr,
+        "accuracy": acc,
+        "variation": variation,
+        "n_problems": len(kept),
+        "asr_ci_low": asr_low,
+        "asr_ci_high": asr_high,
+    }
+    if sprt_threshold is not None:
+        row["sprt_decision"] = sprt_decision(round(asr * n_valid), round(n_valid), sprt_threshold) or "undecided"
+    return row
@@ -0,0 +1,144 @@
+"""Append-only journal of completed model calls for resumable grid runs."""
+import json
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+from models.base import GenerationResult
+from models.usage import USAGE_FIELDS
+
+
+class CellJournal:
+    """
+    JSON-lines journal with one record per completed call.
+    
+    A record holds the cell, the problem index, the index of the first sample
+    and the sample outputs (with their token usage, if any). Every record is
+    flushed as soon as it is written and fsynced at least every
+    fsync_interval seconds, on close, and when the process gets SIGINT or
+    SIGTERM, so an interrupted sweep loses at most the calls in flight.
+    """
+    
+    def __init__(self, path: str, header: Dict, resume: bool = False, fsync_interval: float = 1.0):
+        """
+        Open a journal.
+        
+        Args:
+            path: Journal file
+            header: Run description written as the first line; resuming
+                requires the stored header to match
+            resume: Keep and load existing records instead of starting over
+            fsync_interval: Maximum seconds between fsyncs
+        """
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.records = {}
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        
+        if resume and os.path.exists(path):
+            self._load(header)
+            self._file = open(path, "a")
+        else:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, "w")
+            self._write({"header": header})
+    
+    def completed(self, cell: tuple, problem: int) -> List[str]:
+        """Outputs journaled for (cell, problem), contiguous from sample 0."""
+        samples = self.records.get((cell, problem), {})
+        outputs = []
+        while len(outputs) in samples:
+            outputs.extend(samples[len(outputs)])
+        return outputs
+    
+    def record(self, cell: tuple, problem: int, sample: int, outputs: List[str]):
+        """Append the outputs of one call starting at sample index sample."""
+        if not outputs:
+            return
+        entry = {"cell": list(cell), "problem": problem, "sample": sample, "outputs": [str(output) for output in outputs]}
+        if any(isinstance(output, GenerationResult) for output in outputs):
+            entry["usage"] = [
+                [getattr(output, field, 0) for field in USAGE_FIELDS] + [getattr(output, "latency", 0.0)]
+                for output in outputs
+            ]
+        self.records.setdefault((cell, problem), {})[sample] = list(outputs)
+        self._write(entry)
+    
+    def close(self):
+        """Flush, fsync and close the journal."""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+    
+    @contextmanager
+    def guard_signals(self):
+        """
+        Close the journal durably if SIGTERM arrives while the block runs.
+        
+        SIGINT already raises KeyboardInterrupt; SIGTERM is turned into
+        SystemExit so the same cleanup runs. Handlers can only be installed
+        from the main thread; elsewhere this is a no-op.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        
+        def on_sigterm(signum, frame):
+            raise SystemExit(128 + signum)
+        
+        previous = signal.signal(signal.SIGTERM, on_sigterm)
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            self.close()
+    
+    def _write(self, entry: Dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            now = time.monotonic()
+            if now - self._last_sync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+    
+    def _load(self, header: Dict):
+        """Read records from an existing journal, ignoring a torn last line."""
+        with open(self.path) as f:
+            lines = f.readlines()
+        
+        for number, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                if number == len(lines) - 1:
+                    break
+                raise
+            if "header" in entry:
+                if entry["header"] != header:
+                    raise ValueError(
+                        f"Journal {self.path} belongs to a different run; "
+                        f"delete it or run without resume"
+                    )
+                continue
+            outputs = entry["outputs"]
+            if "usage" in entry:
+                outputs = [
+                    GenerationResult(text, *usage[:len(USAGE_FIELDS)], latency=usage[-1])
+                    for text, usage in zip(outputs, entry["usage"])
+                ]
+            cell = (entry["cell"][0], entry["cell"][1], entry["cell"][2])
+            self.records.setdefault((cell, entry["problem"]), {})[entry["sample"]] = outputs
+        
+        if lines and not lines[-1].endswith("\n"):
+            # Drop a partially written record so new records start on a fresh line
+            with open(self.path, "w") as f:
+                f.writelines(lines[:-1])
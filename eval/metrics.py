@@ -1,5 +1,8 @@
 """Evaluation metrics."""
-from typing import List, Optional
+import math
+from typing import List, Optional, Tuple
+
+from scipy.stats import beta, norm
 
 
 def attack_success_rate(
@@ -75,3 +78,102 @@ def goal_satisfied(prediction: Optional[int], goal: int) -> bool:
     """
     return prediction is not None and prediction == goal
 
+
+def wilson_interval(successes: float, n: float, confidence: float = 0.95) -> Tuple[float, float]:
+    """
+    Wilson score interval for a binomial proportion.
+    
+    Args:
+        successes: Number of successes
+        n: Number of trials
+        confidence: Coverage of the interval
+        
+    Returns:
+        (low, high), or (0, 1) if n is 0
+    """
+    if n <= 0:
+        return 0.0, 1.0
+    z = norm.ppf(0.5 + confidence / 2)
+    p = successes / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def clopper_pearson_interval(successes: float, n: float, confidence: float = 0.95) -> Tuple[float, float]:
+    """
+    Exact (Clopper-Pearson) interval for a binomial proportion.
+    
+    Args:
+        successes: Number of successes
+        n: Number of trials
+        confidence: Coverage of the interval
+        
+    Returns:
+        (low, high), or (0, 1) if n is 0
+    """
+    if n <= 0:
+        return 0.0, 1.0
+    alpha = 1 - confidence
+    low = beta.ppf(alpha / 2, successes, n - successes + 1) if successes > 0 else 0.0
+    high = beta.ppf(1 - alpha / 2, successes + 1, n - successes) if successes < n else 1.0
+    return float(low), float(high)
+
+
+def confidence_interval(
+    successes: float,
+    n: float,
+    method: str = "wilson",
+    confidence: float = 0.95,
+) -> Tuple[float, float]:
+    """
+    Interval for a proportion by method "wilson" or "clopper_pearson".
+    
+    Args:
+        successes: Number of successes
+        n: Number of trials
+        method: Interval method
+        confidence: Coverage of the interval
+        
+    Returns:
+        (low, high)
+    """
+    if method == "wilson":
+        return wilson_interval(successes, n, confidence)
+    if method == "clopper_pearson":
+        return clopper_pearson_interval(successes, n, confidence)
+    raise ValueError(f"Unknown interval method: {method}")
+
+
+def sprt_decision(
+    successes: int,
+    n: int,
+    threshold: float,
+    delta: float = 0.05,
+    alpha: float = 0.05,
+    beta_error: float = 0.05,
+) -> Optional[str]:
+    """
+    Wald's sequential probability ratio test of a proportion against a threshold.
+    
+    Tests p = threshold - delta against p = threshold + delta.
+    
+    Args:
+        successes: Number of successes so far
+        n: Number of trials so far
+        threshold: Rate to decide about
+        delta: Half-width of the indifference region around threshold
+        alpha: Probability of wrongly deciding "above"
+        beta_error: Probability of wrongly deciding "below"
+        
+    Returns:
+        "above", "below", or None if more trials are needed
+    """
+    p0 = min(max(threshold - delta, 1e-6), 1 - 1e-6)
+    p1 = min(max(threshold + delta, 1e-6), 1 - 1e-6)
+    llr = successes * math.log(p1 / p0) + (n - successes) * math.log((1 - p1) / (1 - p0))
+    if llr >= math.log((1 - beta_error) / alpha):
+        return "above"
+    if llr <= math.log(beta_error / (1 - alpha)):
+        return "below"
+    return None
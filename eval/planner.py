@@ -0,0 +1,283 @@
+"""Pre-run planning of grid experiments: calls, tokens, cost, wall time and sample sizes."""
+import math
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+from scipy.stats import norm
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attacks.many_shot import build_many_shot_prompt
+from eval.grid_runner import _apply_variation
+from models.usage import model_prices
+
+
+# Context windows in tokens, matched by longest prefix of the model name
+CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128_000,
+    "gpt-4o": 128_000,
+    "o1-preview": 128_000,
+    "o1-mini": 128_000,
+    "o1": 200_000,
+    "o3-mini": 200_000,
+    "microsoft/Phi-3-mini-4k-instruct": 4_096,
+    "microsoft/Phi-3-mini-128k-instruct": 128_000,
+}
+
+# Largest n the OpenAI API accepts in one request
+MAX_SAMPLES_PER_REQUEST = 128
+
+# Pieces BPE tokenizers split text into: words, up to 3 digits, punctuation
+_TOKEN_PIECE = re.compile(r"\d{1,3}|[^\W\d_]+|[^\w\s]")
+
+
+def context_window(model_name: str) -> Optional[int]:
+    """Context window of the longest CONTEXT_WINDOWS entry that model_name starts with."""
+    matches = [name for name in CONTEXT_WINDOWS if (model_name or "").startswith(name)]
+    return CONTEXT_WINDOWS[max(matches, key=len)] if matches else None
+
+
+def is_reasoning_model(model_name: str) -> bool:
+    """Whether OpenAIClient treats model_name as an o1/o3 model (one sample per request)."""
+    model_name = model_name or ""
+    return model_name.startswith("o1") or "o3" in model_name
+
+
+def completion_cap(model_name: str, max_tokens: int) -> int:
+    """Completion tokens OpenAIClient reserves per sample, reasoning included."""
+    return max(max_tokens * 2, 500) if is_reasoning_model(model_name) else max_tokens
+
+
+def count_tokens(text: str, model_name: str = "") -> int:
+    """
+    Tokens in text for model_name.
+    
+    Uses tiktoken if it is installed and knows the model (o200k_base
+    otherwise). Without tiktoken, words, runs of up to 3 digits and
+    punctuation marks count as one token each; characters / 4 badly
+    undercounts the number-heavy many-shot prompts.
+    """
+    if tiktoken is None:
+        return len(_TOKEN_PIECE.findall(text))
+    try:
+        encoding = tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def problems_for_ci_width(width: float, confidence: float = 0.95, asr: float = 0.5) -> int:
+    """
+    Problems per cell for a normal-approximation interval of the given width.
+    
+    Args:
+        width: Full width of the interval on attack success rate
+        confidence: Coverage of the interval
+        asr: Assumed attack success rate (0.5 is the worst case)
+    
+    Returns:
+        Number of problems
+    """
+    z = norm.ppf(0.5 + confidence / 2)
+    return int(math.ceil(z * z * asr * (1 - asr) / (width / 2) ** 2))
+
+
+def plan_grid(
+    test_problems: List[tuple],
+    k_values: List[int],
+    attacker_strengths: List[int],
+    attacker_goals: List[str],
+    model_name: str,
+    max_tokens: int = 100,
+    samples_per_call: Optional[int] = None,
+    reuse_samples: Optional[str] = None,
+    variation_params: Optional[Dict] = None,
+    seed: Optional[int] = None,
+    prompt_sample: int = 5,
+) -> pd.DataFrame:
+    """
+    Work run_grid_experiment would do with the same arguments, per cell.
+    
+    Prompt lengths are measured by building and tokenizing the prompts of
+    the first prompt_sample problems of each (attacker_strength,
+    attacker_goal). Completion tokens assume every sample uses its whole
+    completion_cap(), so they are an upper bound; for o1/o3 models that is
+    the max_completion_tokens OpenAIClient requests, reasoning included.
+    Calls assume all samples of a problem go out together, up to
+    MAX_SAMPLES_PER_REQUEST per request, unless samples_per_call is set;
+    o1/o3 models take one request per sample, as OpenAIClient sends them.
+    
+    Args:
+        test_problems: List of (question_str, answer_int) tuples
+        k_values: List of self-consistency samples
+        attacker_strengths: List of attacker token budgets
+        attacker_goals: List of goal types
+        model_name: Model name, for tokenizer, prices and context window
+        max_tokens: Max tokens per generation
+        samples_per_call: Samples per call as in run_grid_experiment
+        reuse_samples: As in run_grid_experiment; only max(k) is drawn
+        variation_params: Optional variation-specific parameters
+        seed: Random seed
+        prompt_sample: Problems whose prompts are tokenized per cell
+    
+    Returns:
+        DataFrame with one row per cell: k, attacker_strength,
+        attacker_goal, problems, samples, calls, prompt_tokens (longest
+        sampled prompt), max_completion_tokens (per sample),
+        total_prompt_tokens, total_completion_tokens, cost_usd (None for
+        unpriced models) and exceeds_context
+    """
+    variation_params = variation_params or {}
+    prices = model_prices(model_name)
+    window = context_window(model_name)
+    n_problems = len(test_problems)
+    completion_tokens = completion_cap(model_name, max_tokens)
+    
+    prompt_tokens = {}
+    for attacker_strength in attacker_strengths:
+        for attacker_goal in attacker_goals:
+            prompt_tokens[(attacker_strength, attacker_goal)] = [
+                count_tokens(
+                    _apply_variation(
+                        build_many_shot_prompt(question, answer, attacker_goal, attacker_strength, seed=seed),
+                        variation_params,
+                        seed,
+                    ),
+                    model_name,
+                )
+                for question, answer in test_problems[:prompt_sample]
+            ]
+    
+    rows = []
+    for k in k_values:
+        drawn = 0 if reuse_samples and k != max(k_values) else k
+        chunk = 1 if is_reasoning_model(model_name) else min(samples_per_call or k, MAX_SAMPLES_PER_REQUEST)
+        for attacker_strength in attacker_strengths:
+            for attacker_goal in attacker_goals:
+                tokens = prompt_tokens[(attacker_strength, attacker_goal)]
+                calls = n_problems * math.ceil(drawn / chunk)
+                total_prompt_tokens = int(calls * np.mean(tokens)) if tokens else 0
+                total_completion_tokens = n_problems * drawn * completion_tokens
+                cost = None
+                if prices is not None:
+                    cost = (total_prompt_tokens * prices[0] + total_completion_tokens * prices[2]) / 1e6
+                rows.append({
+                    "k": k,
+                    "attacker_strength": attacker_strength,
+                    "attacker_goal": attacker_goal,
+                    "problems": n_problems,
+                    "samples": n_problems * drawn,
+                    "calls": calls,
+                    "prompt_tokens": max(tokens, default=0),
+                    "max_completion_tokens": completion_tokens,
+                    "total_prompt_tokens": total_prompt_tokens,
+                    "total_completion_tokens": total_completion_tokens,
+                    "cost_usd": cost,
+                    "exceeds_context": window is not None and max(tokens, default=0) + completion_tokens > window,
+                })
+    return pd.DataFrame(rows)
+
+
+def summarize_plan(
+    plan: pd.DataFrame,
+    max_concurrency: Optional[int] = None,
+    rpm: Optional[int] = None,
+    tpm: Optional[int] = None,
+    latency_overhead: float = 0.5,
+    output_tokens_per_second: float = 50.0,
+    max_tokens: Optional[int] = None,
+) -> Dict:
+    """
+    Totals of a plan and its projected wall time.
+    
+    A call is assumed to take latency_overhead plus the time to generate
+    max_tokens (by default the plan's largest per-sample completion cap); calls run max_concurrency at a time, and no faster than the
+    requests- and tokens-per-minute quotas allow.
+    
+    Args:
+        plan: Output of plan_grid() (possibly several concatenated)
+        max_concurrency: Calls in flight (default: sequential)
+        rpm: Requests-per-minute quota
+        tpm: Tokens-per-minute quota
+        latency_overhead: Seconds per call before generation starts
+        output_tokens_per_second: Generation speed of one call
+        max_tokens: Tokens generated per call (default: from the plan)
+    
+    Returns:
+        Dict with calls, samples, prompt_tokens, completion_tokens, cost_usd
+        (None if unpriced), wall_time_s and cells_exceeding_context
+    """
+    calls = int(plan["calls"].sum())
+    prompt_tokens = int(plan["total_prompt_tokens"].sum())
+    completion_tokens = int(plan["total_completion_tokens"].sum())
+    
+    if max_tokens is None:
+        max_tokens = int(plan["max_completion_tokens"].max()) if len(plan) else 0
+    call_seconds = latency_overhead + max_tokens / output_tokens_per_second
+    wall_time = calls * call_seconds / max(max_concurrency or 1, 1)
+    if rpm:
+        wall_time = max(wall_time, 60.0 * calls / rpm)
+    if tpm:
+        wall_time = max(wall_time, 60.0 * (prompt_tokens + completion_tokens) / tpm)
+    
+    return {
+        "calls": calls,
+        "samples": int(plan["samples"].sum()),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": None if plan["cost_usd"].isna().any() else float(plan["cost_usd"].sum()),
+        "wall_time_s": wall_time,
+        "cells_exceeding_context": int(plan["exceeds_context"].sum()),
+    }
+
+
+def print_plan(plan: pd.DataFrame, summary: Dict, n_problems: int, ci_width: Optional[float] = None):
+    """
+    Print a plan's totals, context-window violations and sample sizes.
+    
+    Args:
+        plan: Output of plan_grid() (possibly several concatenated)
+        summary: Output of summarize_plan() for plan
+        n_problems: Problems per cell
+        ci_width: Target interval width to size the number of problems for
+    """
+    print(f"\n{'='*80}")
+    print("EXECUTION PLAN")
+    print(f"{'='*80}")
+    print(f"  Cells: {len(plan)}  Problems per cell: {n_problems}")
+    print(f"  Samples: {summary['samples']:,}  Calls: {summary['calls']:,}")
+    print(f"  Tokens: {summary['prompt_tokens']:,} prompt + {summary['completion_tokens']:,} completion (upper bound)")
+    if summary["cost_usd"] is None:
+        print("  Cost: unknown (no prices for this model)")
+    else:
+        print(f"  Cost: ${summary['cost_usd']:,.2f}")
+    print(f"  Wall time: {_format_duration(summary['wall_time_s'])}")
+    
+    # Worst-case (ASR = 0.5) 95% interval width with n_problems problems
+    achieved = 2 * norm.ppf(0.975) * math.sqrt(0.25 / n_problems) if n_problems else float("inf")
+    print(f"  95% interval on ASR with {n_problems} problems: up to +/-{achieved / 2:.3f}")
+    if ci_width is not None:
+        print(f"  Problems per cell for a {ci_width:g}-wide interval: {problems_for_ci_width(ci_width)}")
+    
+    if summary["cells_exceeding_context"]:
+        longest = plan[plan["exceeds_context"]].sort_values("prompt_tokens").iloc[-1]
+        print(f"  WARNING: {summary['cells_exceeding_context']} cells have prompts beyond the context window "
+              f"(longest: {longest['prompt_tokens']:,} tokens at attacker strength {longest['attacker_strength']})")
+
+
+def _format_duration(seconds: float) -> str:
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} min"
+    if seconds < 86400 * 2:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} days"
@@ -4,8 +4,44 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.patches import Rectangle
 from typing import Optional, List
 
+from eval.sample_store import SampleStore
+from eval.surrogate import fill_grid
+
+
+def load_results(
+    variation: str,
+    output_dir: str = "results",
+    task: Optional[str] = None,
+) -> Optional[pd.DataFrame]:
+    """
+    Load per-cell results of a variation, preferring the raw sample store.
+    
+    Metrics are recomputed from output_dir/samples if the variation was
+    stored there; otherwise the run's {variation}.csv is read. The CSV is
+    also preferred for runs that voted over random k-subsets, whose averaged
+    metrics the store cannot reproduce.
+    
+    Args:
+        variation: Variation name
+        output_dir: Results directory
+        task: Optional task name to select in the sample store
+        
+    Returns:
+        Results DataFrame, or None if the variation has no results
+    """
+    store = SampleStore(os.path.join(output_dir, "samples"))
+    csv_file = os.path.join(output_dir, f"{variation}.csv")
+    if store.has(variation, task=task) and not (
+        os.path.exists(csv_file) and store.voted_subsets(variation=variation, task=task)
+    ):
+        return store.cell_metrics(variation=variation, task=task)
+    if os.path.exists(csv_file):
+        return pd.read_csv(csv_file)
+    return None
+
 
 def plot_heatmap(
     df: pd.DataFrame,
@@ -178,6 +214,9 @@ def plot_figure2_grid(
     output_file: str,
     tasks: List[str] = ["addition", "multiplication", "math"],
     goals: List[str] = ["output_42", "answer_plus_1", "answer_times_7"],
+    surfaces: Optional[dict] = None,
+    k_values: Optional[List[int]] = None,
+    attacker_strengths: Optional[List[int]] = None,
 ):
     """
     Create Figure 2: 3x3 grid of heatmaps showing attack success rates.
@@ -187,6 +226,13 @@ def plot_figure2_grid(
         output_file: Output file path for the figure
         tasks: List of task names (rows)
         goals: List of goal names (columns)
+        surfaces: Optional dictionary mapping (task, goal) -> AsrSurface
+            (see eval.surrogate); cells missing from that panel's results are
+            filled with its predictions and hatched, more opaquely the wider
+            their prediction band
+        k_values: Grid of k to fill with surfaces (default: measured values)
+        attacker_strengths: Grid of attacker strengths to fill with surfaces
+            (default: measured values)
     """
     # Create custom colormap (purple to yellow)
     colors = ['#440154', '#3b528b', '#21918c', '#5ec962', '#fde724']
@@ -227,6 +273,18 @@ def plot_figure2_grid(
             
             df = results_dict[key]
             
+            measured = None
+            if surfaces and key in surfaces:
+                df = fill_grid(
+                    df,
+                    surfaces[key],
+                    k_values or sorted(df["k"].unique()),
+                    attacker_strengths or sorted(df["attacker_strength"].unique()),
+                )
+                df["band_width"] = df["asr_high"] - df["asr_low"]
+                measured = df.pivot_table(index='attacker_strength', columns='k', values='measured', aggfunc='first')
+                band_width = df.pivot_table(index='attacker_strength', columns='k', values='band_width', aggfunc='first')
+            
             # Pivot data for heatmap
             pivot = df.pivot_table(
                 index='attacker_strength',
@@ -238,6 +296,17 @@ def plot_figure2_grid(
             # Plot heatmap
             im = ax.imshow(pivot.values, cmap=cmap, aspect='auto', vmin=0, vmax=1, origin='lower')
             
+            # Shade predicted cells by the width of their band
+            if measured is not None:
+                for y, strength in enumerate(pivot.index):
+                    for x, k in enumerate(pivot.columns):
+                        if not measured.loc[strength, k]:
+                            ax.add_patch(Rectangle(
+                                (x - 0.5, y - 0.5), 1, 1,
+                                facecolor='none', edgecolor='white', hatch='//', linewidth=0,
+                                alpha=min(1.0, 0.2 + band_width.loc[strength, k]),
+                            ))
+            
             # Set ticks with log scale labels
             x_ticks = np.arange(len(pivot.columns))
             y_ticks = np.arange(len(pivot.index))
@@ -271,6 +340,10 @@ def plot_figure2_grid(
             ax.set_yticks(np.arange(len(pivot.index)) - 0.5, minor=True)
             ax.grid(which="minor", color="gray", linestyle='-', linewidth=0.5, alpha=0.2)
     
+    if surfaces:
+        fig.text(0.5, 0.005, 'Hatched cells: surrogate prediction (more opaque = wider 95% band)',
+                 ha='center', fontsize=9)
+    
     # Add global y-axis label
     fig.text(0.02, 0.5, 'Attack length (tokens)', va='center', rotation='vertical', fontsize=11)
     
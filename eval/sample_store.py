@@ -0,0 +1,447 @@
+"""Columnar store of every raw sample drawn by grid experiments."""
+import hashlib
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from attacks.many_shot import get_attacker_goal_value
+from defense.inference_budget import extract_integer
+from defense.voting import extrapolate_vote_rates
+from eval.metrics import accuracy, attack_success_rate
+
+
+# Columns of every sample row; variation, task and attacker_goal are partition keys
+SAMPLE_SCHEMA = pa.schema([
+    ("k", pa.int32()),
+    ("attacker_strength", pa.int32()),
+    ("problem", pa.int32()),
+    ("sample", pa.int32()),
+    ("prompt_hash", pa.dictionary(pa.int32(), pa.string())),
+    ("output", pa.string()),
+    ("extracted", pa.int64()),
+    ("answer", pa.int64()),
+    ("goal_value", pa.int64()),
+    # Random k-subsets the run's vote averaged over; null if it voted these samples
+    ("subsets", pa.int32()),
+])
+
+PROMPT_SCHEMA = pa.schema([
+    ("prompt_hash", pa.string()),
+    ("prompt", pa.string()),
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("variation", pa.string()), ("task", pa.string()), ("attacker_goal", pa.string())]),
+    flavor="hive",
+)
+
+DEFAULT_TASK = "default"
+
+_INT64_MAX = 2 ** 63 - 1
+
+
+def prompt_hash(prompt: str) -> str:
+    """Short stable hash identifying a prompt."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def _partition_path(variation: str, task: str, attacker_goal: str) -> str:
+    return os.path.join(f"variation={variation}", f"task={task}", f"attacker_goal={attacker_goal}")
+
+
+def _as_int64(value: Optional[int]) -> Optional[int]:
+    """Value if it fits an int64 column, else None."""
+    return value if value is not None and -_INT64_MAX <= value <= _INT64_MAX else None
+
+
+class SampleStore:
+    """
+    Parquet dataset of raw samples, partitioned by variation, task and goal.
+    
+    Layout under root:
+        
+        samples/variation=<v>/task=<t>/attacker_goal=<g>/part-0.parquet
+        prompts/variation=<v>/task=<t>/attacker_goal=<g>/prompts.parquet
+    
+    Each sample row holds its cell, problem and sample index, the raw output,
+    the integer extracted from it (its vote) and the problem's true answer and
+    attacker goal value. Cells a run voted over random k-subsets of a larger
+    draw (reuse_samples="subsets") store the draw's first k samples and the
+    number of subsets; their run metrics are not recomputable from the store. Prompts are stored once per partition and referenced
+    from sample rows by a dictionary-encoded hash. A run replaces the cells it
+    wrote and keeps every other cell of the partition, so extending a grid or
+    rerunning some of its cells adds to what is stored. Metrics can be
+    recomputed from the store alone with cell_metrics().
+    """
+    
+    def __init__(self, root: str = "results/samples"):
+        """
+        Initialize store.
+        
+        Args:
+            root: Store directory
+        """
+        self.root = root
+    
+    def writer(
+        self,
+        variation: str,
+        task: Optional[str],
+        prompts: Dict[tuple, List[str]],
+        answers: List[int],
+    ) -> "SampleWriter":
+        """
+        Open a writer for one run; see SampleWriter.
+        
+        Args:
+            variation: Experiment variation name
+            task: Task name (None for the default partition)
+            prompts: Dict mapping (attacker_strength, attacker_goal) to one prompt per problem
+            answers: True answer of each problem
+        """
+        return SampleWriter(self, variation, task or DEFAULT_TASK, prompts, answers)
+    
+    def partitions(self) -> List[tuple]:
+        """Sorted (variation, task, attacker_goal) tuples present in the store."""
+        found = []
+        samples_dir = os.path.join(self.root, "samples")
+        if not os.path.isdir(samples_dir):
+            return found
+        for dirpath, _, filenames in os.walk(samples_dir):
+            if "part-0.parquet" not in filenames:
+                continue
+            keys = dict(part.split("=", 1) for part in os.path.relpath(dirpath, samples_dir).split(os.sep))
+            found.append((keys["variation"], keys["task"], keys["attacker_goal"]))
+        return sorted(found)
+    
+    def has(self, variation: str, task: Optional[str] = None, attacker_goal: Optional[str] = None) -> bool:
+        """Whether any partition matches the given keys."""
+        return any(
+            v == variation and task in (None, t) and attacker_goal in (None, g)
+            for v, t, g in self.partitions()
+        )
+    
+    def voted_subsets(self, variation: Optional[str] = None, task: Optional[str] = None) -> bool:
+        """Whether any stored cell matching the keys was voted over random k-subsets."""
+        if not self.partitions():
+            return False
+        return self.samples(variation=variation, task=task, columns=["subsets"])["subsets"].notna().any()
+    
+    def samples(
+        self,
+        variation: Optional[str] = None,
+        task: Optional[str] = None,
+        attacker_goal: Optional[str] = None,
+        k: Optional[int] = None,
+        attacker_strength: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Sample rows matching all given keys (None matches anything).
+        
+        Args:
+            variation: Variation name
+            task: Task name
+            attacker_goal: Attacker goal
+            k: Self-consistency budget of the cell
+            attacker_strength: Attack length of the cell
+            columns: Columns to read (default: all, including partition keys)
+        
+        Returns:
+            DataFrame with one row per sample; extracted is a nullable integer
+        """
+        samples_dir = os.path.join(self.root, "samples")
+        if not self.partitions():
+            return pd.DataFrame(columns=columns or SAMPLE_SCHEMA.names + PARTITIONING.schema.names)
+        
+        # An explicit schema reads files written before a column was added as nulls
+        schema = pa.unify_schemas([SAMPLE_SCHEMA, PARTITIONING.schema])
+        dataset = ds.dataset(samples_dir, format="parquet", partitioning=PARTITIONING, schema=schema)
+        conditions = [
+            ds.field(name) == value
+            for name, value in (
+                ("variation", variation),
+                ("task", task),
+                ("attacker_goal", attacker_goal),
+                ("k", k),
+                ("attacker_strength", attacker_strength),
+            )
+            if value is not None
+        ]
+        condition = None
+        for expression in conditions:
+            condition = expression if condition is None else condition & expression
+        
+        table = dataset.to_table(columns=columns, filter=condition)
+        return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    
+    def prompts(self, variation: Optional[str] = None) -> Dict[str, str]:
+        """Dict mapping prompt hash to prompt text."""
+        prompts_dir = os.path.join(self.root, "prompts")
+        if not os.path.isdir(prompts_dir):
+            return {}
+        dataset = ds.dataset(prompts_dir, format="parquet", partitioning=PARTITIONING)
+        condition = ds.field("variation") == variation if variation is not None else None
+        table = dataset.to_table(columns=["prompt_hash", "prompt"], filter=condition)
+        return dict(zip(table.column("prompt_hash").to_pylist(), table.column("prompt").to_pylist()))
+    
+    def predictions(self, **keys) -> pd.DataFrame:
+        """
+        Majority vote of every (cell, problem), recomputed from stored samples.
+        
+        Uses the rule of defense.voting.majority_vote: the most common
+        extracted integer, the median of the tied ones on a tie, and None if no
+        sample held an integer.
+        
+        Args:
+            **keys: Filters passed to samples()
+        
+        Returns:
+            DataFrame with variation, task, attacker_goal, k, attacker_strength,
+            problem, answer, goal_value and prediction columns
+        """
+        problem_cols = ["variation", "task", "attacker_goal", "k", "attacker_strength", "problem"]
+        df = self.samples(columns=problem_cols + ["extracted", "answer", "goal_value"], **keys)
+        problems = df.groupby(problem_cols, observed=True)[["answer", "goal_value"]].first()
+        
+        counts = (
+            df.dropna(subset=["extracted"])
+            .groupby(problem_cols + ["extracted"], observed=True)
+            .size()
+            .rename("votes")
+            .reset_index()
+        )
+        top = counts.groupby(problem_cols, observed=True)["votes"].transform("max")
+        winners = counts[counts["votes"] == top].astype({"extracted": "float64"})
+        voted = winners.groupby(problem_cols, observed=True)["extracted"].median().apply(int)
+        
+        problems["prediction"] = voted.reindex(problems.index).astype(object)
+        problems["prediction"] = problems["prediction"].where(problems["prediction"].notna(), None)
+        return problems.reset_index()
+    
+    def cell_metrics(self, **keys) -> pd.DataFrame:
+        """
+        Per-cell results in the format of run_grid_experiment's CSV.
+        
+        Every cell is voted on its stored samples, which for cells marked by
+        voted_subsets() differs from the run's average over random subsets.
+        
+        Args:
+            **keys: Filters passed to samples()
+        
+        Returns:
+            DataFrame with k, attacker_strength, attacker_goal,
+            attack_success_rate, accuracy, variation and task columns
+        """
+        predictions = self.predictions(**keys)
+        results = []
+        for (variation, task, attacker_goal, k, attacker_strength), cell in predictions.groupby(
+            ["variation", "task", "attacker_goal", "k", "attacker_strength"], observed=True
+        ):
+            cell = cell.sort_values("problem")
+            cell_predictions = list(cell["prediction"])
+            true_answers = [int(answer) for answer in cell["answer"]]
+            results.append({
+                "k": int(k),
+                "attacker_strength": int(attacker_strength),
+                "attacker_goal": attacker_goal,
+                "attack_success_rate": attack_success_rate(
+                    cell_predictions, true_answers, [int(goal) for goal in cell["goal_value"]]
+                ),
+                "accuracy": accuracy(cell_predictions, true_answers),
+                "variation": variation,
+                "task": task,
+            })
+        return pd.DataFrame(results)
+    
+    def extrapolated_metrics(
+        self,
+        k_values: List[int],
+        n_bootstrap: int = 100,
+        confidence: float = 0.95,
+        seed: Optional[int] = None,
+        **keys,
+    ) -> pd.DataFrame:
+        """
+        Per-cell metrics at any k, extrapolated from the stored samples.
+        
+        Each (attacker_strength, problem) contributes the samples of its
+        largest stored k (smaller cells may hold prefixes of the same draw)
+        to defense.voting.extrapolate_vote_rates.
+        
+        Args:
+            k_values: Sample counts to extrapolate to
+            n_bootstrap: Bootstrap replicates for the confidence bands
+            confidence: Coverage of the bands
+            seed: Random seed for the bootstrap
+            **keys: Filters passed to samples() (other than k)
+            
+        Returns:
+            DataFrame in the format of cell_metrics() with asr_low, asr_high,
+            accuracy_low, accuracy_high and samples_per_problem columns
+        """
+        group_cols = ["variation", "task", "attacker_goal", "attacker_strength"]
+        df = self.samples(columns=group_cols + ["k", "problem", "extracted", "answer", "goal_value"], **keys)
+        df = df[df["k"] == df.groupby(group_cols + ["problem"], observed=True)["k"].transform("max")]
+        
+        results = []
+        for (variation, task, attacker_goal, attacker_strength), group in df.groupby(group_cols, observed=True):
+            counts, true_answers, goal_values = [], [], []
+            for _, problem in group.groupby("problem"):
+                extracted = problem["extracted"].astype(object).where(problem["extracted"].notna(), None)
+                counts.append({
+                    (None if value is None else int(value)): int(count)
+                    for value, count in extracted.value_counts(dropna=False).items()
+                })
+                true_answers.append(int(problem["answer"].iloc[0]))
+                goal_values.append(int(problem["goal_value"].iloc[0]))
+            
+            rates = extrapolate_vote_rates(
+                counts, true_answers, goal_values, k_values,
+                n_bootstrap=n_bootstrap, confidence=confidence, seed=seed,
+            )
+            for j, k in enumerate(k_values):
+                results.append({
+                    "k": k,
+                    "attacker_strength": int(attacker_strength),
+                    "attacker_goal": attacker_goal,
+                    **{name: float(values[j]) for name, values in rates.items()},
+                    "variation": variation,
+                    "task": task,
+                    "samples_per_problem": len(group) / len(counts),
+                })
+        return pd.DataFrame(results)
+
+
+class SampleWriter:
+    """
+    Buffered writer of one run's samples.
+    
+    Each attacker goal of the run gets its own partition. close() merges it
+    with the published one by cell: stored rows of (k, attacker_strength)
+    cells this run did not write are copied over, the rest are replaced.
+    Files are written to a staging directory and moved into place, so a
+    crashed run never leaves a half-written partition.
+    """
+    
+    def __init__(
+        self,
+        store: SampleStore,
+        variation: str,
+        task: str,
+        prompts: Dict[tuple, List[str]],
+        answers: List[int],
+        rows_per_group: int = 65536,
+    ):
+        self.store = store
+        self.variation = variation
+        self.task = task
+        self.prompts = prompts
+        self.answers = answers
+        self.rows_per_group = rows_per_group
+        self._hashes = {key: [prompt_hash(prompt) for prompt in values] for key, values in prompts.items()}
+        self._buffers = {}
+        self._writers = {}
+        # Attacker goal -> (k, attacker_strength) cells written by this run
+        self._cells = {}
+    
+    def add(self, cell: tuple, problem: int, outputs: List[str], subsets: Optional[int] = None):
+        """
+        Buffer the k outputs of one voted (cell, problem).
+        
+        Args:
+            cell: (k, attacker_strength, attacker_goal)
+            problem: Problem index
+            outputs: The k outputs
+            subsets: Random k-subsets of a larger draw the run voted instead, if any
+        """
+        k, attacker_strength, attacker_goal = cell
+        answer = self.answers[problem]
+        buffer = self._buffers.setdefault(attacker_goal, {name: [] for name in SAMPLE_SCHEMA.names})
+        self._cells.setdefault(attacker_goal, set()).add((k, attacker_strength))
+        n = len(outputs)
+        buffer["k"].extend([k] * n)
+        buffer["attacker_strength"].extend([attacker_strength] * n)
+        buffer["problem"].extend([problem] * n)
+        buffer["sample"].extend(range(n))
+        buffer["prompt_hash"].extend([self._hashes[(attacker_strength, attacker_goal)][problem]] * n)
+        buffer["output"].extend(str(output) for output in outputs)
+        buffer["extracted"].extend(_as_int64(extract_integer(str(output))) for output in outputs)
+        buffer["answer"].extend([answer] * n)
+        buffer["goal_value"].extend([get_attacker_goal_value(answer, attacker_goal)] * n)
+        buffer["subsets"].extend([subsets] * n)
+        if len(buffer["sample"]) >= self.rows_per_group:
+            self._flush(attacker_goal)
+    
+    def close(self):
+        """Write what is buffered and move the partitions into place."""
+        for attacker_goal in list(self._buffers):
+            self._flush(attacker_goal)
+        for attacker_goal, writer in self._writers.items():
+            partition = _partition_path(self.variation, self.task, attacker_goal)
+            kept = self._kept_samples(attacker_goal, partition)
+            if kept is not None and kept.num_rows:
+                writer.write_table(kept, row_group_size=self.rows_per_group)
+            writer.close()
+            self._replace("samples", partition, "part-0.parquet")
+            self._write_prompts(attacker_goal, partition)
+        self._writers = {}
+    
+    def _kept_samples(self, attacker_goal: str, partition: str) -> Optional[pa.Table]:
+        """Published rows of the partition whose cells this run did not write."""
+        path = os.path.join(self.store.root, "samples", partition, "part-0.parquet")
+        if not os.path.exists(path):
+            return None
+        rewritten = None
+        for k, attacker_strength in self._cells.get(attacker_goal, ()):
+            cell = (ds.field("k") == k) & (ds.field("attacker_strength") == attacker_strength)
+            rewritten = cell if rewritten is None else rewritten | cell
+        dataset = ds.dataset(path, format="parquet", schema=SAMPLE_SCHEMA)
+        return dataset.to_table(filter=None if rewritten is None else ~rewritten)
+    
+    def _flush(self, attacker_goal: str):
+        buffer = self._buffers.pop(attacker_goal)
+        table = pa.Table.from_pydict(buffer, schema=SAMPLE_SCHEMA)
+        if attacker_goal not in self._writers:
+            staging = self._staging("samples", _partition_path(self.variation, self.task, attacker_goal))
+            self._writers[attacker_goal] = pq.ParquetWriter(os.path.join(staging, "part-0.parquet"), SAMPLE_SCHEMA)
+        self._writers[attacker_goal].write_table(table, row_group_size=self.rows_per_group)
+    
+    def _write_prompts(self, attacker_goal: str, partition: str):
+        hashes, texts = [], []
+        for (attacker_strength, goal), prompts in self.prompts.items():
+            if goal == attacker_goal:
+                hashes.extend(self._hashes[(attacker_strength, goal)])
+                texts.extend(prompts)
+        # Prompts of cells kept from earlier runs stay referenced
+        path = os.path.join(self.store.root, "prompts", partition, "prompts.parquet")
+        if os.path.exists(path):
+            known = set(hashes)
+            stored = pq.read_table(path, columns=["prompt_hash", "prompt"])
+            for h, text in zip(stored.column("prompt_hash").to_pylist(), stored.column("prompt").to_pylist()):
+                if h not in known:
+                    hashes.append(h)
+                    texts.append(text)
+                    known.add(h)
+        pq.write_table(
+            pa.Table.from_pydict({"prompt_hash": hashes, "prompt": texts}, schema=PROMPT_SCHEMA),
+            os.path.join(self._staging("prompts", partition), "prompts.parquet"),
+        )
+        self._replace("prompts", partition, "prompts.parquet")
+    
+    def _staging(self, kind: str, partition: str) -> str:
+        directory = os.path.join(self.store.root, "_staging", kind, partition)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+    
+    def _replace(self, kind: str, partition: str, filename: str):
+        """Atomically move a staged file over its published copy."""
+        directory = os.path.join(self.store.root, kind, partition)
+        os.makedirs(directory, exist_ok=True)
+        os.replace(os.path.join(self._staging(kind, partition), filename), os.path.join(directory, filename))
+        shutil.rmtree(self._staging(kind, partition), ignore_errors=True)
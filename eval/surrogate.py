@@ -0,0 +1,222 @@
+"""Logistic surrogate of the attack success rate surface over compute and attacker strength."""
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+
+from scipy.special import expit
+from scipy.stats import norm
+
+
+class AsrSurface:
+    """
+    Fitted surface ASR = sigmoid(a + b * log(strength) - c * log(k)).
+    
+    params holds (a, b, c) and covariance their approximate covariance (the
+    inverse Fisher information at the fit), which gives predict() its bands.
+    """
+    
+    def __init__(self, params: np.ndarray, covariance: np.ndarray):
+        self.params = params
+        self.covariance = covariance
+    
+    @classmethod
+    def fit(
+        cls,
+        k: np.ndarray,
+        attacker_strength: np.ndarray,
+        successes: np.ndarray,
+        trials: np.ndarray,
+        ridge: float = 1e-2,
+        max_iter: int = 100,
+        tol: float = 1e-8,
+    ) -> "AsrSurface":
+        """
+        Binomial logistic fit by iteratively reweighted least squares.
+        
+        Args:
+            k: Self-consistency samples of each observation
+            attacker_strength: Attack length in tokens of each observation
+            successes: Successful attacks of each observation
+            trials: Problems of each observation (1 for per-problem outcomes)
+            ridge: L2 penalty keeping the fit finite when outcomes separate,
+                e.g. when every measured cell is saturated
+            max_iter: Maximum IRLS iterations
+            tol: Convergence threshold on the largest parameter change
+        
+        Returns:
+            Fitted AsrSurface
+        """
+        X = _design_matrix(k, attacker_strength)
+        successes = np.asarray(successes, dtype=float)
+        trials = np.asarray(trials, dtype=float)
+        penalty = ridge * np.eye(X.shape[1])
+        
+        params = np.zeros(X.shape[1])
+        for _ in range(max_iter):
+            p = expit(X @ params)
+            weights = trials * p * (1 - p)
+            hessian = X.T @ (weights[:, None] * X) + penalty
+            gradient = X.T @ (successes - trials * p) - penalty @ params
+            step = np.linalg.solve(hessian, gradient)
+            params = params + step
+            if np.max(np.abs(step)) < tol:
+                break
+        
+        p = expit(X @ params)
+        hessian = X.T @ ((trials * p * (1 - p))[:, None] * X) + penalty
+        return cls(params, np.linalg.inv(hessian))
+    
+    def predict(
+        self,
+        k: np.ndarray,
+        attacker_strength: np.ndarray,
+        confidence: float = 0.95,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Predicted attack success rate with a pointwise band.
+        
+        Args:
+            k: Self-consistency samples
+            attacker_strength: Attack lengths in tokens
+            confidence: Coverage of the band
+        
+        Returns:
+            (asr, low, high) arrays
+        """
+        X = _design_matrix(k, attacker_strength)
+        logit = X @ self.params
+        # Standard error of the linear predictor, sqrt(x' Sigma x)
+        se = np.sqrt(np.einsum("ij,jk,ik->i", X, self.covariance, X))
+        z = norm.ppf(0.5 + confidence / 2)
+        return expit(logit), expit(logit - z * se), expit(logit + z * se)
+
+
+def fit_surface(results: pd.DataFrame, ridge: float = 1e-2) -> AsrSurface:
+    """
+    Fit an AsrSurface to measured results of one (task, attacker goal).
+    
+    Takes either per-problem outcomes (a success column, one row per problem,
+    see problem_outcomes()) or per-cell results from run_grid_experiment,
+    whose attack_success_rate is weighted by n_problems (1 if absent).
+    
+    Args:
+        results: Outcomes or per-cell results with k and attacker_strength
+        ridge: L2 penalty of the fit
+    
+    Returns:
+        Fitted AsrSurface
+    """
+    if "success" in results:
+        successes = results["success"].to_numpy(dtype=float)
+        trials = np.ones(len(results))
+    else:
+        trials = results["n_problems"].to_numpy(dtype=float) if "n_problems" in results else np.ones(len(results))
+        successes = results["attack_success_rate"].to_numpy(dtype=float) * trials
+    return AsrSurface.fit(results["k"], results["attacker_strength"], successes, trials, ridge=ridge)
+
+
+def problem_outcomes(predictions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-problem attack outcomes from SampleStore.predictions().
+    
+    Problems without a valid vote are dropped, as in attack_success_rate().
+    
+    Args:
+        predictions: DataFrame with prediction, answer and goal_value columns
+    
+    Returns:
+        The voted rows with a 0/1 success column added
+    """
+    voted = predictions[predictions["prediction"].notna()].copy()
+    prediction = voted["prediction"].astype(float)
+    voted["success"] = ((prediction == voted["goal_value"]) & (prediction != voted["answer"])).astype(int)
+    return voted
+
+
+def latin_hypercube_design(
+    k_values: List[int],
+    attacker_strengths: List[int],
+    n_cells: int,
+    seed: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Sparse subset of the k_values x attacker_strengths grid.
+    
+    Both axes are cut into n_cells strata, each stratum is used exactly once
+    per axis, and strata are paired at random; every k and strength is
+    covered as evenly as n_cells allows. Strata landing on a cell already
+    chosen are moved to the nearest free cell, so exactly n_cells cells are
+    returned (all of them if n_cells exceeds the grid).
+    
+    Args:
+        k_values: Grid values of k
+        attacker_strengths: Grid values of attacker strength
+        n_cells: Number of cells to measure
+        seed: Random seed
+    
+    Returns:
+        Sorted list of (k, attacker_strength) cells
+    """
+    k_values = sorted(k_values)
+    attacker_strengths = sorted(attacker_strengths)
+    all_cells = [(i, j) for i in range(len(k_values)) for j in range(len(attacker_strengths))]
+    if n_cells >= len(all_cells):
+        chosen = set(all_cells)
+    else:
+        rng = np.random.default_rng(seed)
+        k_strata = (rng.permutation(n_cells) + rng.random(n_cells)) / n_cells
+        strength_strata = (rng.permutation(n_cells) + rng.random(n_cells)) / n_cells
+        chosen = set()
+        for u, v in zip(k_strata, strength_strata):
+            x, y = u * len(k_values) - 0.5, v * len(attacker_strengths) - 0.5
+            free = [cell for cell in all_cells if cell not in chosen]
+            chosen.add(min(free, key=lambda cell: (cell[0] - x) ** 2 + (cell[1] - y) ** 2))
+    return sorted((k_values[i], attacker_strengths[j]) for i, j in chosen)
+
+
+def fill_grid(
+    results: pd.DataFrame,
+    surface: AsrSurface,
+    k_values: List[int],
+    attacker_strengths: List[int],
+    confidence: float = 0.95,
+) -> pd.DataFrame:
+    """
+    Complete a grid from measured cells and surrogate predictions.
+    
+    Args:
+        results: Measured per-cell results with k, attacker_strength and
+            attack_success_rate
+        surface: Surface fitted to the measured cells
+        k_values: Grid values of k
+        attacker_strengths: Grid values of attacker strength
+        confidence: Coverage of the prediction band
+    
+    Returns:
+        DataFrame with one row per grid cell: k, attacker_strength,
+        attack_success_rate (measured where available, else predicted),
+        predicted_asr, asr_low, asr_high and measured
+    """
+    grid = pd.DataFrame(
+        [(k, attacker_strength) for k in k_values for attacker_strength in attacker_strengths],
+        columns=["k", "attacker_strength"],
+    )
+    predicted, low, high = surface.predict(grid["k"], grid["attacker_strength"], confidence)
+    grid["predicted_asr"] = predicted
+    grid["asr_low"] = low
+    grid["asr_high"] = high
+    
+    measured = results.groupby(["k", "attacker_strength"])["attack_success_rate"].mean()
+    index = pd.MultiIndex.from_frame(grid[["k", "attacker_strength"]])
+    grid["measured"] = index.isin(measured.index)
+    grid["attack_success_rate"] = measured.reindex(index).to_numpy()
+    grid.loc[~grid["measured"], "attack_success_rate"] = grid.loc[~grid["measured"], "predicted_asr"]
+    return grid
+
+
+def _design_matrix(k: np.ndarray, attacker_strength: np.ndarray) -> np.ndarray:
+    """Columns 1, log(strength) and -log(k)."""
+    k = np.asarray(k, dtype=float)
+    attacker_strength = np.asarray(attacker_strength, dtype=float)
+    # Unattacked cells (strength 0) are treated as strength 1
+    return np.column_stack([np.ones_like(k), np.log(np.maximum(attacker_strength, 1.0)), -np.log(k)])
@@ -1,6 +1,50 @@
 """Abstract base class for LLM clients."""
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Optional
+from contextvars import ContextVar
+from typing import List, Optional
+
+
+# Grid cell (k, attacker_strength, attacker_goal) whose samples are being
+# drawn, set by the experiment harness so backends can attribute requests
+current_cell: ContextVar[Optional[tuple]] = ContextVar("current_cell", default=None)
+
+
+class GenerationResult(str):
+    """
+    Generated text that also carries token usage and latency.
+    
+    It is a str, so code that only needs the text is unaffected. Clients that
+    know what a request consumed return these instead of plain strings; when
+    one request produced several samples, its usage is split across them so
+    that sums over samples give the request's totals.
+    """
+    
+    def __new__(
+        cls,
+        text: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        reasoning_tokens: int = 0,
+        cached_tokens: int = 0,
+        latency: float = 0.0,
+    ):
+        """
+        Args:
+            text: Generated text
+            prompt_tokens: Input tokens billed (including cached ones)
+            completion_tokens: Output tokens billed (including reasoning ones)
+            reasoning_tokens: Hidden reasoning tokens of o1/o3 models
+            cached_tokens: Input tokens served from the provider's prompt cache
+            latency: Seconds the request took
+        """
+        result = super().__new__(cls, text)
+        result.prompt_tokens = prompt_tokens
+        result.completion_tokens = completion_tokens
+        result.reasoning_tokens = reasoning_tokens
+        result.cached_tokens = cached_tokens
+        result.latency = latency
+        return result
 
 
 class LLMClient(ABC):
@@ -32,7 +76,125 @@ class LLMClient(ABC):
             deliberate_steps: Optional number of deliberate reasoning steps
             
         Returns:
-            Generated text
+            Generated text (a GenerationResult if the backend reports usage)
+        """
+        pass
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Generate one response per prompt.
+        
+        The default implementation calls generate() once per prompt. Backends
+        that can run several prompts through a single forward pass override it.
+        
+        Args:
+            prompts: Input prompts
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            stop: List of stop sequences
+            deliberate_steps: Optional number of deliberate reasoning steps
+            
+        Returns:
+            Generated texts, in the same order as prompts
+        """
+        return [
+            self.generate(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop,
+                deliberate_steps=deliberate_steps,
+            )
+            for prompt in prompts
+        ]
+    
+    def generate_samples(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Draw n independent responses to the same prompt.
+        
+        The default implementation calls generate() n times. Backends that can
+        encode the prompt once and sample several continuations override it.
+        
+        Args:
+            prompt: Input prompt
+            n: Number of samples
+            max_tokens: Maximum tokens to generate per sample
+            temperature: Sampling temperature
+            stop: List of stop sequences
+            deliberate_steps: Optional number of deliberate reasoning steps
+            
+        Returns:
+            List of n generated texts
+        """
+        return [
+            self.generate(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop,
+                deliberate_steps=deliberate_steps,
+            )
+            for _ in range(n)
+        ]
+    
+    async def agenerate_samples(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Async version of generate_samples().
+        
+        The default implementation runs generate_samples() in a worker thread
+        of the event loop's default executor; backends with a native async
+        client override it.
+        """
+        return await asyncio.to_thread(
+            self.generate_samples,
+            prompt=prompt,
+            n=n,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stop=stop,
+            deliberate_steps=deliberate_steps,
+        )
+    
+    async def aclose(self):
+        """
+        Release resources bound to the running event loop.
+        
+        Called by executor.run_calls before its event loop ends; the default
+        implementation does nothing.
+        """
+        pass
+    
+    def prefill_prefixes(self, prefixes: List[str]) -> None:
+        """
+        Hint that upcoming prompts will start with these prefixes.
+        
+        Backends that cache prompt encodings can precompute them here; the
+        default implementation does nothing.
+        
+        Args:
+            prefixes: Prompt prefixes, e.g. one attack block per attacker strength
         """
         pass
-
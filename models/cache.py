@@ -0,0 +1,316 @@
+"""Persistent on-disk response cache for LLM clients."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import List, Optional
+
+from .base import LLMClient
+
+
+def model_id(model: LLMClient) -> str:
+    """Identifier of the model behind a client, used in cache keys."""
+    return getattr(model, "model_name", None) or type(model).__name__
+
+
+def request_key(
+    model_name: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    sample: int,
+    reasoning_effort: Optional[str] = None,
+    stop: Optional[list[str]] = None,
+    deliberate_steps: Optional[int] = None,
+    cell: Optional[tuple] = None,
+) -> str:
+    """
+    Content hash identifying one sampled response.
+    
+    Args:
+        model_name: Model identifier
+        prompt: Input prompt
+        max_tokens: Maximum tokens to generate
+        temperature: Sampling temperature
+        sample: Index of this sample among identical requests
+        reasoning_effort: Optional reasoning effort (o1/o3 models)
+        stop: List of stop sequences
+        deliberate_steps: Optional number of deliberate reasoning steps
+        cell: Optional grid cell the sample was drawn for (left out of the hash if None)
+    
+    Returns:
+        Hex digest
+    """
+    fields = [model_name, prompt, max_tokens, temperature, reasoning_effort, stop, deliberate_steps, sample]
+    if cell is not None:
+        fields.append(list(cell))
+    payload = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SampleCounter:
+    """
+    Hands out sample indices per distinct request within a session.
+    
+    The i-th time the same request is made it gets sample index i, so a rerun
+    of the same experiment asks for exactly the same keys, while repeated
+    samples within a run (k > 1, or several cells sharing a prompt) stay
+    independent instead of collapsing onto one cached response.
+    """
+    
+    def __init__(self):
+        self._next = {}
+        self._lock = threading.Lock()
+    
+    def take(self, request: tuple, n: int) -> range:
+        """Reserve n consecutive sample indices for request."""
+        with self._lock:
+            start = self._next.get(request, 0)
+            self._next[request] = start + n
+        return range(start, start + n)
+
+
+class CachedClient(LLMClient):
+    """
+    LLMClient wrapper that stores every response in a local SQLite file.
+    
+    Responses are zlib-compressed and keyed by request_key(). When the file
+    grows beyond max_bytes of payload, the least recently used responses are
+    evicted. Hit and miss counts are kept in cache_stats.
+    """
+    
+    def __init__(
+        self,
+        model: LLMClient,
+        path: str = "results/response_cache.sqlite",
+        max_bytes: int = 1024 ** 3,
+    ):
+        """
+        Initialize cached client.
+        
+        Args:
+            model: Client that answers cache misses
+            path: SQLite file to store responses in
+            max_bytes: Cap on stored (compressed) payload bytes
+        """
+        self.model = model
+        self.model_name = model_id(model)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._counter = SampleCounter()
+        self._lock = threading.Lock()
+        self._open()
+    
+    def _open(self):
+        """Open the SQLite store at self.path."""
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    
+    @property
+    def supports_deliberate(self) -> bool:
+        return self.model.supports_deliberate
+    
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of looked-up responses served from the cache."""
+        lookups = self.cache_stats["hits"] + self.cache_stats["misses"]
+        return self.cache_stats["hits"] / lookups if lookups else 0.0
+    
+    def generate(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+        reasoning_effort: Optional[str] = None,
+    ) -> str:
+        """Generate one response, serving it from the cache when possible."""
+        keys = self._keys(prompt, 1, max_tokens, temperature, stop, deliberate_steps, reasoning_effort)
+        cached = self._lookup(keys)
+        if cached[0] is not None:
+            return cached[0]
+        
+        kwargs = {"reasoning_effort": reasoning_effort} if reasoning_effort is not None else {}
+        output = self.model.generate(
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stop=stop,
+            deliberate_steps=deliberate_steps,
+            **kwargs,
+        )
+        self._store(keys, [output])
+        return output
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """Generate one response per prompt; only cache misses reach the wrapped model."""
+        keys = [self._keys(prompt, 1, max_tokens, temperature, stop, deliberate_steps)[0] for prompt in prompts]
+        outputs = self._lookup(keys)
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        
+        if missing:
+            generated = self.model.generate_batch(
+                prompts=[prompts[i] for i in missing],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop,
+                deliberate_steps=deliberate_steps,
+            )
+            self._fill(outputs, keys, missing, generated)
+        
+        return outputs
+    
+    def generate_samples(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """Draw n samples; only the missing ones are drawn from the wrapped model."""
+        keys = self._keys(prompt, n, max_tokens, temperature, stop, deliberate_steps)
+        outputs = self._lookup(keys)
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        
+        if missing:
+            generated = self.model.generate_samples(
+                prompt=prompt,
+                n=len(missing),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop,
+                deliberate_steps=deliberate_steps,
+            )
+            self._fill(outputs, keys, missing, generated)
+        
+        return outputs
+    
+    async def agenerate_samples(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """Async version of generate_samples()."""
+        keys = self._keys(prompt, n, max_tokens, temperature, stop, deliberate_steps)
+        outputs = self._lookup(keys)
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        
+        if missing:
+            generated = await self.model.agenerate_samples(
+                prompt=prompt,
+                n=len(missing),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop,
+                deliberate_steps=deliberate_steps,
+            )
+            self._fill(outputs, keys, missing, generated)
+        
+        return outputs
+    
+    def prefill_prefixes(self, prefixes: List[str]) -> None:
+        self.model.prefill_prefixes(prefixes)
+    
+    async def aclose(self):
+        await self.model.aclose()
+    
+    def close(self):
+        """Close the SQLite connection."""
+        self._db.close()
+    
+    def _keys(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float,
+        stop: Optional[list[str]],
+        deliberate_steps: Optional[int],
+        reasoning_effort: Optional[str] = None,
+    ) -> List[str]:
+        """Cache keys of the next n samples of this request."""
+        request = (prompt, max_tokens, temperature, reasoning_effort, tuple(stop or ()), deliberate_steps)
+        return [
+            request_key(self.model_name, prompt, max_tokens, temperature, sample, reasoning_effort, stop, deliberate_steps)
+            for sample in self._counter.take(request, n)
+        ]
+    
+    def _lookup(self, keys: List[str]) -> List[Optional[str]]:
+        """Cached responses for keys (None where missing), marking hits as recently used."""
+        with self._lock:
+            found = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, value FROM responses WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._db.executemany("UPDATE responses SET last_access = ? WHERE key = ?", [(now, key) for key in found])
+                self._db.commit()
+            self.cache_stats["hits"] += len(found)
+            self.cache_stats["misses"] += len(keys) - len(found)
+        return [zlib.decompress(found[key]).decode("utf-8") if key in found else None for key in keys]
+    
+    def _fill(self, outputs: List[Optional[str]], keys: List[str], missing: List[int], generated: List[str]):
+        """Store freshly generated samples and put them into the output slots."""
+        self._store([keys[i] for i in missing], generated)
+        for i, output in zip(missing, generated):
+            outputs[i] = output
+    
+    def _store(self, keys: List[str], outputs: List[str]):
+        """Insert responses, then evict least recently used ones above max_bytes."""
+        now = time.time()
+        rows = [(key, zlib.compress(output.encode("utf-8"))) for key, output in zip(keys, outputs)]
+        with self._lock:
+            for key, value in rows:
+                previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._total_bytes += len(value) - (previous[0] if previous else 0)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), now),
+                )
+            
+            while self._total_bytes > self.max_bytes:
+                oldest = self._db.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access LIMIT 256"
+                ).fetchall()
+                if not oldest:
+                    break
+                for key, size in oldest:
+                    if self._total_bytes <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._total_bytes -= size
+                    self.cache_stats["evictions"] += 1
+            
+            self._db.commit()
@@ -0,0 +1,184 @@
+"""Record/replay cassettes for deterministic offline reruns."""
+import atexit
+import gzip
+import json
+import os
+import zlib
+from typing import Callable, List, Optional
+
+from .base import LLMClient, current_cell
+from .cache import CachedClient, request_key
+
+
+class CassetteMissError(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+    pass
+
+
+class CassetteClient(CachedClient):
+    """
+    Record every response of a client to a cassette file, or replay them.
+    
+    A cassette is a gzipped JSON-lines file of {"key", "response"} records,
+    keyed like CachedClient (model, request parameters and sample index)
+    plus the grid cell the sample was drawn for (models.base.current_cell).
+    Sample indices count per (cell, request), so with max_concurrency > 1
+    each cell still replays the samples it recorded, whatever order the
+    workers took them in. Calls of one cell that repeat a prompt (several
+    calls per problem) may swap samples between them, and so can runs
+    outside a grid cell; only the set of samples per cell is reproducible.
+    
+    Recording appends as it goes, so an interrupted run keeps what it
+    already paid for. Replay needs no backend at all and raises
+    CassetteMissError on any request that is not on the cassette.
+    
+    Request handling is inherited from CachedClient; only the store and keys differ.
+    """
+    
+    def __init__(self, model: Optional[LLMClient], path: str, mode: str = "replay"):
+        """
+        Initialize cassette client.
+        
+        Args:
+            model: Client to record from (unused, and may be None, in replay mode)
+            path: Cassette file (.jsonl.gz)
+            mode: "record" or "replay"
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode == "record" and model is None:
+            raise ValueError("Recording a cassette requires a model")
+        
+        self.mode = mode
+        super().__init__(model, path)
+    
+    def _open(self):
+        """Load the cassette for replay, or open it for appending."""
+        self._responses = {}
+        self._meta = {}
+        
+        if self.mode == "replay":
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"Cassette not found: {self.path}")
+            self._load()
+            self.model_name = self._meta["model_name"]
+            self._file = None
+        else:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+            # Write the gzip trailer even if the script never calls close()
+            atexit.register(self.close)
+            self._write({"model_name": self.model_name, "supports_deliberate": self.model.supports_deliberate})
+    
+    @property
+    def supports_deliberate(self) -> bool:
+        if self.model is not None:
+            return self.model.supports_deliberate
+        return self._meta.get("supports_deliberate", False)
+    
+    def prefill_prefixes(self, prefixes: List[str]) -> None:
+        if self.model is not None:
+            self.model.prefill_prefixes(prefixes)
+    
+    async def aclose(self):
+        if self.model is not None:
+            await self.model.aclose()
+    
+    def close(self):
+        """Flush and close the cassette file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def _keys(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float,
+        stop: Optional[list[str]],
+        deliberate_steps: Optional[int],
+        reasoning_effort: Optional[str] = None,
+    ) -> List[str]:
+        """Cassette keys of the next n samples of this request in the current cell."""
+        cell = current_cell.get()
+        request = (cell, prompt, max_tokens, temperature, reasoning_effort, tuple(stop or ()), deliberate_steps)
+        return [
+            request_key(
+                self.model_name, prompt, max_tokens, temperature, sample,
+                reasoning_effort, stop, deliberate_steps, cell=cell,
+            )
+            for sample in self._counter.take(request, n)
+        ]
+    
+    def _load(self):
+        """Read all records, tolerating a truncated tail from an interrupted recording."""
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    record = json.loads(line)
+                    if "key" in record:
+                        self._responses[record["key"]] = record["response"]
+                    else:
+                        self._meta.update(record)
+            except (EOFError, gzip.BadGzipFile, zlib.error):
+                pass
+    
+    def _lookup(self, keys: List[str]) -> List[Optional[str]]:
+        """Recorded responses for keys; recording always goes to the backend."""
+        if self.mode == "record":
+            self.cache_stats["misses"] += len(keys)
+            return [None] * len(keys)
+        
+        missing = [key for key in keys if key not in self._responses]
+        if missing:
+            raise CassetteMissError(
+                f"{len(missing)} of {len(keys)} requested samples are not on cassette {self.path} "
+                f"(model {self.model_name}); re-record it with mode='record'"
+            )
+        self.cache_stats["hits"] += len(keys)
+        return [self._responses[key] for key in keys]
+    
+    def _store(self, keys: List[str], outputs: List[str]):
+        """Append recorded responses to the cassette."""
+        for key, output in zip(keys, outputs):
+            self._write({"key": key, "response": output})
+    
+    def _write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+
+def open_cassette(path: str, mode: str, create_model: Callable[[], LLMClient]) -> CassetteClient:
+    """
+    Wrap a model in a cassette, building the model only when recording.
+    
+    Args:
+        path: Cassette file
+        mode: "record" or "replay"
+        create_model: Zero-argument factory for the backend client
+    
+    Returns:
+        CassetteClient
+    """
+    if mode == "replay":
+        return CassetteClient(None, path, mode="replay")
+    return CassetteClient(create_model(), path, mode="record")
+
+
+def cassette_from_env(create_model: Callable[[], LLMClient]) -> LLMClient:
+    """
+    Build a model, recording or replaying a cassette if CASSETTE_MODE is set.
+    
+    CASSETTE_MODE is "record" or "replay"; CASSETTE_PATH defaults to
+    results/cassette.jsonl.gz. Without CASSETTE_MODE the factory result is
+    returned unchanged.
+    """
+    mode = os.getenv("CASSETTE_MODE")
+    if not mode:
+        return create_model()
+    return open_cassette(os.getenv("CASSETTE_PATH", "results/cassette.jsonl.gz"), mode, create_model)
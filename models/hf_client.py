@@ -1,24 +1,128 @@
 """HuggingFace model client."""
-from typing import Optional
+import copy
+import functools
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import (
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from .base import LLMClient
+from defense.inference_budget import answer_is_complete
+
+
+def _serialized(method):
+    """Run a HuggingFaceClient method while holding the client's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class TextStoppingCriteria(StoppingCriteria):
+    """
+    Stop each sequence once its generated text contains a stop string or,
+    optionally, a complete integer answer.
+    
+    Stop strings are looked for in the last few generated tokens only;
+    since the criterion runs after every token, a match can never be
+    skipped over. The answer check decodes the whole completion, because
+    an integer may span many tokens and the character before it decides
+    whether it counts (see answer_is_complete()).
+    """
+    
+    def __init__(
+        self,
+        tokenizer,
+        prompt_length: int,
+        stop: Optional[list[str]] = None,
+        stop_on_answer: bool = False,
+    ):
+        """
+        Args:
+            tokenizer: Tokenizer used to decode generated ids
+            prompt_length: Number of (padded) prompt tokens preceding the completion
+            stop: Stop strings
+            stop_on_answer: Also stop once answer_is_complete() holds for the completion
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop = stop or []
+        self.stop_on_answer = stop_on_answer
+        # Every token decodes to at least one character, so this window holds any match
+        self.window = max([len(stop_seq) for stop_seq in self.stop] + [2]) + 1
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = []
+        for sequence in input_ids:
+            completion = sequence[self.prompt_length:]
+            tail = self.tokenizer.decode(completion[-self.window:], skip_special_tokens=True)
+            done.append(
+                any(stop_seq in tail for stop_seq in self.stop)
+                or (
+                    self.stop_on_answer
+                    and answer_is_complete(self.tokenizer.decode(completion, skip_special_tokens=True))
+                )
+            )
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
 
 
 class HuggingFaceClient(LLMClient):
-    """HuggingFace model client implementation."""
+    """
+    HuggingFace model client implementation.
+    
+    The model, the prefix KV cache and the last prompt's ids are shared by
+    every call, so generation and cache updates are serialized: concurrent
+    workers (max_concurrency > 1) queue on one lock instead of racing.
+    """
     
-    def __init__(self, model_name: str, device: Optional[str] = None):
+    def __init__(
+        self,
+        model_name: str,
+        device: Optional[str] = None,
+        sample_chunk_size: int = 8,
+        prefix_cache_bytes: int = 2 * 1024 ** 3,
+        min_prefix_tokens: int = 64,
+        stop_on_answer: bool = False,
+    ):
         """
         Initialize HuggingFace client.
         
         Args:
             model_name: Model identifier (e.g., "meta-llama/Llama-3.1-8B-Instruct")
             device: Device to use (if None, auto-detects)
+            sample_chunk_size: Maximum continuations decoded together by
+                generate_samples (caps memory for large k)
+            prefix_cache_bytes: Memory budget for cached prompt-prefix KV states;
+                least recently used prefixes are evicted beyond it
+            min_prefix_tokens: Shortest prefix shared by consecutive prompts
+                that is worth caching automatically
+            stop_on_answer: Stop decoding a sample as soon as answer_is_complete()
+                holds, i.e. no further text could change what extract_integer()
+                reads from it. Votes are unchanged up to tokenizer decoding
+                differences between the cut and the full completion.
         """
         self.model_name = model_name
+        self.sample_chunk_size = max(1, sample_chunk_size)
+        self.prefix_cache_bytes = prefix_cache_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self.stop_on_answer = stop_on_answer
+        
+        # Prefix token ids -> (KV cache, size in bytes), oldest first
+        self._prefix_cache = OrderedDict()
+        self._prefix_cache_size = 0
+        self._last_input_ids = None
+        # Reentrant: generate_samples falls back to generate and generate_batch
+        self._lock = threading.RLock()
+        self.prefix_cache_stats = {"reused_tokens": 0, "prefilled_tokens": 0, "evictions": 0}
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         
         print(f"Loading model {model_name} on {self.device}...")
@@ -35,6 +139,8 @@ class HuggingFaceClient(LLMClient):
         # Ensure padding token is set
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Decoder-only models continue from the last position, so batches are left-padded
+        self.tokenizer.padding_side = "left"
         
         print(f"Model loaded successfully.")
     
@@ -44,6 +150,7 @@ class HuggingFaceClient(LLMClient):
         return False
     
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    @_serialized
     def generate(
         self,
         prompt: str,
@@ -53,34 +160,298 @@ class HuggingFaceClient(LLMClient):
         deliberate_steps: Optional[int] = None,
     ) -> str:
         """Generate using HuggingFace model."""
-        # For deliberate steps, increase max_tokens proportionally
-        effective_max_tokens = max_tokens
-        if deliberate_steps:
-            effective_max_tokens = max_tokens * max(1, deliberate_steps)
-        
+        return self._generate(prompt, max_tokens, temperature, stop, deliberate_steps)
+    
+    def _generate(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        stop: Optional[list[str]],
+        deliberate_steps: Optional[int],
+    ) -> str:
+        """One completion, reusing cached prefix KV states; generate() adds retries and locking."""
         inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        prompt_length = inputs["input_ids"].shape[1]
+        past_key_values = self._prompt_cache(inputs["input_ids"])
+        
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                past_key_values=past_key_values,
+                max_new_tokens=self._effective_max_tokens(max_tokens, deliberate_steps),
+                temperature=temperature if temperature > 0 else None,
+                do_sample=temperature > 0,
+                stopping_criteria=self._stopping_criteria(prompt_length, stop),
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+            )
+        
+        return self._decode_completions(outputs, prompt_length, stop)[0]
+    
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    @_serialized
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """Generate for several prompts with one left-padded, attention-masked model.generate call."""
+        if not prompts:
+            return []
+        
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        # With left padding every prompt ends at the same position
+        prompt_length = inputs["input_ids"].shape[1]
         
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                max_new_tokens=effective_max_tokens,
+                max_new_tokens=self._effective_max_tokens(max_tokens, deliberate_steps),
                 temperature=temperature if temperature > 0 else None,
                 do_sample=temperature > 0,
+                stopping_criteria=self._stopping_criteria(prompt_length, stop),
                 pad_token_id=self.tokenizer.pad_token_id,
                 eos_token_id=self.tokenizer.eos_token_id,
             )
         
-        generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        return self._decode_completions(outputs, prompt_length, stop)
+    
+    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    @_serialized
+    def generate_samples(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Draw n samples while tokenizing and prefilling the prompt only once.
+        
+        The prompt's KV cache is computed a single time and then replicated for
+        chunks of at most sample_chunk_size continuations, so a long many-shot
+        prefix is not re-encoded for every sample.
+        """
+        if n <= 0:
+            return []
+        
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        input_ids = inputs["input_ids"]
+        prompt_length = input_ids.shape[1]
+        
+        # The undecorated _generate(), so a failure is retried by this method only
+        if temperature <= 0:
+            # Greedy decoding is deterministic, so one continuation serves every
+            # sample; it is decoded from the cached prompt prefix like the samples below
+            return [self._generate(prompt, max_tokens, temperature, stop, deliberate_steps)] * n
+        if prompt_length < 2:
+            return [self._generate(prompt, max_tokens, temperature, stop, deliberate_steps) for _ in range(n)]
+        
+        # KV states for everything but the last prompt token; generate() feeds that token itself
+        prompt_cache = self._prompt_cache(input_ids)
+        
+        samples = []
+        for start in range(0, n, self.sample_chunk_size):
+            chunk = min(self.sample_chunk_size, n - start)
+            # generate() expands the inputs by num_return_sequences but not a
+            # precomputed cache, so the copy is replicated to the chunk size here
+            past_key_values = copy.deepcopy(prompt_cache)
+            if chunk > 1:
+                past_key_values.batch_repeat_interleave(chunk)
+            
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    **inputs,
+                    past_key_values=past_key_values,
+                    num_return_sequences=chunk,
+                    max_new_tokens=self._effective_max_tokens(max_tokens, deliberate_steps),
+                    temperature=temperature,
+                    do_sample=True,
+                    stopping_criteria=self._stopping_criteria(prompt_length, stop),
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                )
+            samples.extend(self._decode_completions(outputs, prompt_length, stop))
+        
+        return samples
+    
+    def _effective_max_tokens(self, max_tokens: int, deliberate_steps: Optional[int]) -> int:
+        """For deliberate steps, increase max_tokens proportionally."""
+        if deliberate_steps:
+            return max_tokens * max(1, deliberate_steps)
+        return max_tokens
+    
+    def _stopping_criteria(self, prompt_length: int, stop: Optional[list[str]]) -> Optional[StoppingCriteriaList]:
+        """Token-level stopping for stop strings and, if enabled, completed answers."""
+        if not stop and not self.stop_on_answer:
+            return None
+        return StoppingCriteriaList([
+            TextStoppingCriteria(self.tokenizer, prompt_length, stop, self.stop_on_answer)
+        ])
+    
+    def _decode_completions(
+        self,
+        sequences: torch.Tensor,
+        prompt_length: int,
+        stop: Optional[list[str]] = None,
+    ) -> List[str]:
+        """Decode only the token ids after prompt_length and cut at the first stop sequence."""
+        generated_texts = []
+        for sequence in sequences:
+            generated_text = self.tokenizer.decode(sequence[prompt_length:], skip_special_tokens=True)
+            if stop:
+                for stop_seq in stop:
+                    if stop_seq in generated_text:
+                        generated_text = generated_text[:generated_text.index(stop_seq)]
+            generated_texts.append(generated_text.strip())
+        
+        return generated_texts
+    
+    @_serialized
+    def cache_prefix(self, prefix: str) -> int:
+        """
+        Precompute and cache the KV states of a prompt prefix shared by later prompts.
+        
+        Args:
+            prefix: Text that later prompts start with (e.g. a many-shot attack block)
+            
+        Returns:
+            Number of prefix tokens cached
+        """
+        prefix_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.device)
+        # The last token may merge with whatever follows the prefix in a full prompt
+        prefix_ids = prefix_ids[:, :-1]
+        if prefix_ids.shape[1] == 0:
+            return 0
+        
+        cache, reused = self._reusable_cache(prefix_ids[0])
+        if reused < prefix_ids.shape[1]:
+            cache = self._extend_cache(cache, prefix_ids[:, reused:])
+            self._store_prefix(prefix_ids[0], cache)
+        return prefix_ids.shape[1]
+    
+    @_serialized
+    def prefill_prefixes(self, prefixes: List[str]) -> None:
+        """
+        Cache nested prefixes with a single prefill of the longest one.
+        
+        Prefixes are cached shortest first, and each one extends the KV states
+        of the cached prefix it shares the most tokens with. For a seeded
+        many-shot attack at increasing strengths, the longest attack is
+        therefore prefilled once in total, with a snapshot at each shorter
+        strength boundary. Once the longest snapshot is stored, the shorter
+        ones are dropped and served as cropped copies of it.
+        """
+        for prefix in sorted(set(prefixes), key=len):
+            self.cache_prefix(prefix)
+    
+    @_serialized
+    def clear_prefix_cache(self):
+        """Drop all cached prefix KV states."""
+        self._prefix_cache.clear()
+        self._prefix_cache_size = 0
+        self._last_input_ids = None
+    
+    def _prompt_cache(self, input_ids: torch.Tensor) -> Optional[DynamicCache]:
+        """
+        Build the KV cache for all but the last token of a single prompt.
+        
+        The longest cached prefix is reused. A prefix shared with the previous
+        prompt is cached automatically once it reaches min_prefix_tokens, so a
+        sweep over questions with the same attack block prefills that block once.
+        """
+        ids = input_ids[0]
+        end = ids.shape[0] - 1
+        if end < 1:
+            return None
+        
+        cache, reused = self._reusable_cache(ids[:end])
+        
+        shared = 0
+        if self._last_input_ids is not None:
+            shared = _common_length(self._last_input_ids, ids[:end])
+        self._last_input_ids = ids
+        
+        if shared >= self.min_prefix_tokens and shared > reused:
+            cache = self._extend_cache(cache, input_ids[:, reused:shared])
+            self._store_prefix(ids[:shared], cache)
+            reused = shared
+        
+        if reused < end:
+            cache = self._extend_cache(cache, input_ids[:, reused:end])
+        return cache
+    
+    def _reusable_cache(self, ids: torch.Tensor) -> Tuple[DynamicCache, int]:
+        """Return a private copy of the cache sharing the most tokens with ids, and that count."""
+        best_key, best_length = None, 0
+        for key in self._prefix_cache:
+            length = _common_length(key, ids)
+            if length > best_length:
+                best_key, best_length = key, length
+        
+        if best_key is None:
+            return DynamicCache(), 0
         
-        # Extract only the generated part (remove prompt)
-        prompt_length = len(self.tokenizer.decode(inputs["input_ids"][0], skip_special_tokens=True))
-        generated_text = generated_text[prompt_length:]
+        self._prefix_cache.move_to_end(best_key)
+        cache = _copy_cache(self._prefix_cache[best_key][0], best_length)
+        self.prefix_cache_stats["reused_tokens"] += best_length
+        return cache, best_length
+    
+    def _extend_cache(self, cache: DynamicCache, segment_ids: torch.Tensor) -> DynamicCache:
+        """Run segment_ids through the model on top of cache."""
+        with torch.no_grad():
+            outputs = self.model(input_ids=segment_ids, past_key_values=cache, use_cache=True)
+        self.prefix_cache_stats["prefilled_tokens"] += segment_ids.shape[1]
+        return outputs.past_key_values
+    
+    def _store_prefix(self, prefix_ids: torch.Tensor, cache: DynamicCache):
+        """Insert a copy of cache under prefix_ids and evict LRU entries over the byte budget."""
+        nbytes = _cache_nbytes(cache)
+        if nbytes > self.prefix_cache_bytes:
+            return
         
-        # Apply stop sequences if provided
-        if stop:
-            for stop_seq in stop:
-                if stop_seq in generated_text:
-                    generated_text = generated_text[:generated_text.index(stop_seq)]
+        key = prefix_ids.clone()
+        # A longer prefix serves everything its own prefixes did
+        for old_key in [k for k in self._prefix_cache if _common_length(k, key) == k.shape[0]]:
+            self._prefix_cache_size -= self._prefix_cache.pop(old_key)[1]
         
-        return generated_text.strip()
+        self._prefix_cache[key] = (_copy_cache(cache, key.shape[0]), nbytes)
+        self._prefix_cache_size += nbytes
+        while self._prefix_cache_size > self.prefix_cache_bytes:
+            _, (_, evicted_bytes) = self._prefix_cache.popitem(last=False)
+            self._prefix_cache_size -= evicted_bytes
+            self.prefix_cache_stats["evictions"] += 1
+
+
+def _common_length(a: torch.Tensor, b: torch.Tensor) -> int:
+    """Number of leading token ids two 1-D tensors share."""
+    n = min(a.shape[0], b.shape[0])
+    mismatches = (a[:n] != b[:n]).nonzero()
+    return int(mismatches[0]) if len(mismatches) else n
+
+
+def _cache_layers(cache: DynamicCache) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """Per-layer (keys, values) tensors of a cache, across transformers versions."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def _copy_cache(cache: DynamicCache, length: int) -> DynamicCache:
+    """Copy the first length positions of a cache without copying the rest."""
+    copied = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(_cache_layers(cache)):
+        copied.update(keys[:, :, :length].clone(), values[:, :, :length].clone(), layer_idx)
+    return copied
+
 
+def _cache_nbytes(cache: DynamicCache) -> int:
+    """Memory held by the key/value tensors of a cache."""
+    tensors = [t for layer in _cache_layers(cache) for t in layer]
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
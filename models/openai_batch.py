@@ -0,0 +1,423 @@
+"""Offline execution of planned calls through the OpenAI Batch API."""
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .base import LLMClient
+from .openai_client import MAX_CHOICES_PER_REQUEST, OpenAIClient, _chunk_sizes, _estimated_tokens, with_usage
+
+
+# Limits of a single batch input file
+MAX_REQUESTS_PER_BATCH = 50000
+MAX_BYTES_PER_BATCH = 200 * 1024 * 1024
+
+FINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Submitted batches and their custom ids, one JSON object per line in work_dir
+BATCH_RECORD = "batches.jsonl"
+
+
+class OpenAIBatchRunner:
+    """
+    Run many generate_samples-style calls as Batch API jobs.
+    
+    Every call is serialized into one or more chat completion requests in a
+    JSONL file, submitted as batches, polled until they finish, and the
+    choices are handed back per call. Input files are split to stay within
+    the request count and file size limits of a batch, and, if
+    max_enqueued_tokens is set, batches are held back until enough earlier
+    ones finish to keep the model's enqueued tokens under it. Requests that
+    fail are resubmitted a limited number of times before giving up.
+    
+    Every submitted batch is appended to batches.jsonl in work_dir with the
+    custom ids of its requests, which are derived from the call and request
+    body. A run that is interrupted while polling therefore loses nothing it
+    paid for: the next run_calls() with the same work_dir re-attaches to the
+    unfinished batches holding its requests instead of submitting them again.
+    Results are handed back as each batch finishes, so they can be journaled
+    before the rest of the sweep is done.
+    """
+    
+    def __init__(
+        self,
+        model: OpenAIClient,
+        endpoint=None,
+        poll_interval: float = 30.0,
+        completion_window: str = "24h",
+        max_resubmits: int = 1,
+        work_dir: Optional[str] = None,
+        max_batch_bytes: int = MAX_BYTES_PER_BATCH,
+        max_enqueued_tokens: Optional[int] = None,
+    ):
+        """
+        Initialize batch runner.
+        
+        Args:
+            model: OpenAI client whose model name and request format are used
+            endpoint: Object exposing files/batches like the OpenAI client
+                (defaults to model.client; see FileBatchEndpoint for a local stand-in)
+            poll_interval: Seconds between batch status checks
+            completion_window: Batch completion window
+            max_resubmits: How many times failed requests are resubmitted
+            work_dir: Where input JSONL files and the record of submitted
+                batches are written (default: a temp dir, so nothing is re-attached)
+            max_batch_bytes: Largest input file to upload
+            max_enqueued_tokens: The model's enqueued-token limit of the
+                account's tier; prompt tokens are estimated and completion
+                tokens counted at their cap (None: not enforced)
+        """
+        self.model = model
+        self.endpoint = endpoint or model.client
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.max_resubmits = max_resubmits
+        self.max_batch_bytes = max_batch_bytes
+        self.max_enqueued_tokens = max_enqueued_tokens
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="openai_batch_")
+        os.makedirs(self.work_dir, exist_ok=True)
+    
+    def run_calls(
+        self,
+        calls: List[Dict],
+        on_result: Callable[[Dict, List[str]], None],
+        max_tokens: int = 100,
+        deliberate_steps: Optional[int] = None,
+        temperature: float = 0.7,
+    ):
+        """
+        Execute calls through the Batch API.
+        
+        Args:
+            calls: Call dicts with at least "prompt" and "n", as for executor.run_calls
+            on_result: Callback receiving (call, outputs) for each call, as
+                soon as the batches holding all of its requests have finished
+            max_tokens: Maximum tokens per sample
+            deliberate_steps: Unused by OpenAI models; accepted for symmetry
+            temperature: Sampling temperature
+        """
+        requests = {}
+        call_ids = []
+        occurrences = {}
+        for call in calls:
+            ids = []
+            for size in self._request_sizes(call["n"]):
+                body = self.model._request_kwargs(call["prompt"], max_tokens, temperature, None, None, n=size)
+                custom_id = _custom_id(call, body, occurrences)
+                requests[custom_id] = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": body,
+                }
+                ids.append(custom_id)
+            call_ids.append(ids)
+        
+        # Index of the call each request belongs to, and requests each call still waits for
+        owner = {custom_id: i for i, ids in enumerate(call_ids) for custom_id in ids}
+        waiting = [len(ids) for ids in call_ids]
+        choices = {}
+        
+        def deliver(done):
+            choices.update(done)
+            for custom_id in done:
+                i = owner[custom_id]
+                waiting[i] -= 1
+                if waiting[i] == 0:
+                    on_result(calls[i], [output for request_id in call_ids[i] for output in choices.pop(request_id)])
+        
+        self._run_requests(requests, deliver)
+    
+    def _request_sizes(self, n: int) -> List[int]:
+        """Choices per request for a call drawing n samples."""
+        # o1/o3 models reject n, so every sample is its own request
+        return _chunk_sizes(n, 1 if self.model.supports_deliberate else MAX_CHOICES_PER_REQUEST)
+    
+    def _run_requests(self, requests: Dict[str, Dict], deliver: Callable[[Dict[str, List[str]]], None]):
+        """
+        Submit requests, resubmitting failures, and pass the choices of each
+        finished batch to deliver as a dict keyed by custom_id.
+        
+        Unfinished batches recorded in work_dir that hold any of the requests
+        are waited on first instead of being submitted again.
+        """
+        completed = set()
+        remaining = dict(requests)
+        errors = {}
+        
+        def finish(batch_id):
+            done, errors_in_batch = self._collect(self._wait(batch_id))
+            # A re-attached batch may also hold requests an earlier run already delivered
+            done = {custom_id: output for custom_id, output in done.items()
+                    if custom_id in remaining and custom_id not in completed}
+            errors.update(errors_in_batch)
+            completed.update(done)
+            deliver(done)
+            self._record({"batch_id": batch_id, "finished": True})
+        
+        attached = [
+            (batch_id, [custom_id for custom_id in custom_ids if custom_id in remaining])
+            for batch_id, custom_ids in self._unfinished_batches()
+        ]
+        attached = [(batch_id, custom_ids) for batch_id, custom_ids in attached if custom_ids]
+        if attached:
+            print(f"Re-attaching to {len(attached)} batches submitted by an earlier run")
+        
+        for attempt in range(self.max_resubmits + 1):
+            if not remaining:
+                break
+            # (batch id, estimated tokens) of batches submitted and not yet finished
+            in_flight = [
+                (batch_id, sum(_estimated_tokens(remaining[custom_id]["body"]) for custom_id in custom_ids))
+                for batch_id, custom_ids in attached
+            ]
+            pending = {custom_id for _, custom_ids in attached for custom_id in custom_ids}
+            attached = []
+            unsubmitted = [request for custom_id, request in remaining.items() if custom_id not in pending]
+            for lines, tokens in self._split(unsubmitted):
+                while in_flight and self.max_enqueued_tokens is not None and (
+                    sum(queued for _, queued in in_flight) + tokens > self.max_enqueued_tokens
+                ):
+                    finish(in_flight.pop(0)[0])
+                in_flight.append((self._submit(lines), tokens))
+            for batch_id, _ in in_flight:
+                finish(batch_id)
+            remaining = {custom_id: request for custom_id, request in remaining.items() if custom_id not in completed}
+        
+        if remaining:
+            first_id = next(iter(remaining))
+            raise RuntimeError(
+                f"{len(remaining)} batch requests failed after {self.max_resubmits} resubmits; "
+                f"first failure ({first_id}): {errors.get(first_id, 'no result returned')}"
+            )
+    
+    def _split(self, requests: List[Dict]) -> List[Tuple[List[str], int]]:
+        """
+        Serialize requests into batch input files within the batch limits.
+        
+        A file is closed once the next request would take it past
+        MAX_REQUESTS_PER_BATCH, max_batch_bytes or max_enqueued_tokens.
+        
+        Returns:
+            List of (JSONL lines, estimated tokens) per file
+        """
+        files = []
+        lines, size, tokens = [], 0, 0
+        for request in requests:
+            line = json.dumps(request) + "\n"
+            line_size = len(line.encode())
+            line_tokens = _estimated_tokens(request["body"])
+            if lines and (
+                len(lines) == MAX_REQUESTS_PER_BATCH
+                or size + line_size > self.max_batch_bytes
+                or (self.max_enqueued_tokens is not None and tokens + line_tokens > self.max_enqueued_tokens)
+            ):
+                files.append((lines, tokens))
+                lines, size, tokens = [], 0, 0
+            lines.append(line)
+            size += line_size
+            tokens += line_tokens
+        if lines:
+            files.append((lines, tokens))
+        return files
+    
+    def _submit(self, lines: List[str]) -> str:
+        """Write JSONL lines to a file, upload it and create a batch."""
+        path = os.path.join(self.work_dir, f"batch_input_{uuid.uuid4().hex}.jsonl")
+        with open(path, "w") as f:
+            f.writelines(lines)
+        
+        with open(path, "rb") as f:
+            input_file = self.endpoint.files.create(file=f, purpose="batch")
+        batch = self.endpoint.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        # Recorded before any polling, so an interrupted run can re-attach to it
+        self._record({"batch_id": batch.id, "custom_ids": [json.loads(line)["custom_id"] for line in lines]})
+        print(f"Submitted batch {batch.id} with {len(lines)} requests")
+        return batch.id
+    
+    def _record(self, entry: Dict):
+        """Append an entry to the record of submitted batches and sync it to disk."""
+        with open(os.path.join(self.work_dir, BATCH_RECORD), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _unfinished_batches(self) -> List[Tuple[str, List[str]]]:
+        """(batch id, custom ids) of recorded batches whose results were never delivered."""
+        path = os.path.join(self.work_dir, BATCH_RECORD)
+        if not os.path.exists(path):
+            return []
+        batches = {}
+        with open(path) as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # Cut off by a crash while appending
+                    break
+                entry = json.loads(line)
+                if entry.get("finished"):
+                    batches.pop(entry["batch_id"], None)
+                else:
+                    batches[entry["batch_id"]] = entry["custom_ids"]
+        return list(batches.items())
+    
+    def _wait(self, batch_id: str):
+        """Poll a batch until it reaches a final status."""
+        while True:
+            batch = self.endpoint.batches.retrieve(batch_id)
+            if batch.status in FINAL_BATCH_STATUSES:
+                print(f"Batch {batch_id} finished with status {batch.status}")
+                return batch
+            time.sleep(self.poll_interval)
+    
+    def _collect(self, batch):
+        """Parse output and error files of a finished batch."""
+        done, errors = {}, {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.endpoint.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    errors[record["custom_id"]] = record.get("error") or response.get("body")
+                    continue
+                body = response["body"]
+                body_choices = sorted(body["choices"], key=lambda choice: choice["index"])
+                usage = body.get("usage") or {}
+                done[record["custom_id"]] = with_usage(
+                    [choice["message"]["content"] for choice in body_choices],
+                    {
+                        "prompt_tokens": usage.get("prompt_tokens", 0),
+                        "completion_tokens": usage.get("completion_tokens", 0),
+                        "reasoning_tokens": (usage.get("completion_tokens_details") or {}).get("reasoning_tokens", 0),
+                        "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+                    },
+                )
+        return done, errors
+
+
+def _custom_id(call: Dict, body: Dict, occurrences: Dict[str, int]) -> str:
+    """
+    Custom id of a request that is the same in every run planning it.
+    
+    Hashes the request body and the call's cell, problem and sample index;
+    identical requests are told apart by how often the hash occurred before.
+    """
+    payload = json.dumps(
+        [body, call.get("cell"), call.get("problem"), call.get("sample")],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+    occurrence = occurrences.get(digest, 0)
+    occurrences[digest] = occurrence + 1
+    return f"{digest}-{occurrence}"
+
+
+class FileBatchEndpoint:
+    """
+    Local, file-based stand-in for the OpenAI files and batches endpoints.
+    
+    Uploaded inputs and produced outputs are plain JSONL files in a directory.
+    A batch is answered on its first retrieve() by calling responder on each
+    request body, which must return a chat completion dict.
+    """
+    
+    def __init__(self, directory: str, responder: Callable[[Dict], Dict]):
+        """
+        Args:
+            directory: Where uploaded and produced files are stored
+            responder: Maps a request body to a chat completion response body
+        """
+        self.directory = directory
+        self.responder = responder
+        self.batch_records = {}
+        os.makedirs(directory, exist_ok=True)
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+    
+    def _create_file(self, file, purpose: str):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with open(os.path.join(self.directory, file_id), "wb") as f:
+            f.write(file.read())
+        return SimpleNamespace(id=file_id, purpose=purpose)
+    
+    def _file_content(self, file_id: str):
+        with open(os.path.join(self.directory, file_id)) as f:
+            return SimpleNamespace(text=f.read())
+    
+    def _create_batch(self, input_file_id: str, endpoint: str, completion_window: str):
+        batch = SimpleNamespace(
+            id=f"batch-{uuid.uuid4().hex}",
+            status="validating",
+            input_file_id=input_file_id,
+            output_file_id=None,
+            error_file_id=None,
+        )
+        self.batch_records[batch.id] = batch
+        return batch
+    
+    def _retrieve_batch(self, batch_id: str):
+        batch = self.batch_records[batch_id]
+        if batch.status in FINAL_BATCH_STATUSES:
+            return batch
+        
+        output_lines = []
+        for line in self._file_content(batch.input_file_id).text.splitlines():
+            request = json.loads(line)
+            body = self.responder(request["body"])
+            output_lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body},
+                "error": None,
+            }))
+        
+        output_id = f"file-{uuid.uuid4().hex}"
+        with open(os.path.join(self.directory, output_id), "w") as f:
+            f.write("\n".join(output_lines) + "\n")
+        batch.output_file_id = output_id
+        batch.status = "completed"
+        return batch
+
+
+def responder_from_client(model: LLMClient) -> Callable[[Dict], Dict]:
+    """
+    Build a FileBatchEndpoint responder that answers with any LLMClient.
+    
+    Args:
+        model: Client used to produce the choices of each request
+    
+    Returns:
+        Function mapping a chat completion request body to a response body
+    """
+    def respond(body: Dict) -> Dict:
+        prompt = body["messages"][-1]["content"]
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens") or 100
+        texts = model.generate_samples(
+            prompt=prompt,
+            n=body.get("n", 1),
+            max_tokens=max_tokens,
+            temperature=body.get("temperature", 0.0),
+        )
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "model": body["model"],
+            "choices": [
+                {"index": i, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}
+                for i, text in enumerate(texts)
+            ],
+        }
+    
+    return respond
@@ -1,36 +1,69 @@
 """OpenAI API client."""
+import asyncio
 import os
-from typing import Optional
-from openai import OpenAI
-from tenacity import retry, stop_after_attempt, wait_exponential
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError
 
-from .base import LLMClient
+from .base import GenerationResult, LLMClient
+from .rate_limit import RateLimiter, estimate_tokens
+
+
+# Upper bound the chat completions API accepts for the n parameter
+MAX_CHOICES_PER_REQUEST = 128
+
+# Failures worth retrying: 429s, 5xx responses, timeouts and dropped connections
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
 
 
 class OpenAIClient(LLMClient):
     """OpenAI API client implementation."""
     
-    def __init__(self, model_name: str = "gpt-4o-mini", api_key: Optional[str] = None):
+    def __init__(
+        self,
+        model_name: str = "gpt-4o-mini",
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_concurrency: int = 64,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_retries: int = 8,
+    ):
         """
         Initialize OpenAI client.
         
         Args:
             model_name: Model identifier (e.g., "gpt-4o-mini", "gpt-4")
             api_key: API key (if None, reads from OPENAI_API_KEY env var)
+            base_url: Optional API base URL (e.g. a local OpenAI-compatible server)
+            max_concurrency: Maximum in-flight requests (the adaptive limit starts here)
+            rpm: Requests-per-minute quota to pace requests to (None: unlimited)
+            tpm: Tokens-per-minute quota to pace requests to (None: unlimited)
+            max_retries: Retries of a request after 429s, 5xx errors or timeouts
         """
         self.model_name = model_name
         api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OpenAI API key not provided. Set OPENAI_API_KEY env var or pass api_key.")
-        self.client = OpenAI(api_key=api_key)
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        # Retries go through the rate limiter rather than the SDK's own policy
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.rate_limiter = RateLimiter(rpm=rpm, tpm=tpm, max_concurrency=max_concurrency)
+        self._api_key = api_key
         self._supports_deliberate = model_name.startswith("o1") or "o3" in model_name
+        
+        # The async client is bound to the event loop that created it
+        self._async_loop = None
+        self._async_client = None
     
     @property
     def supports_deliberate(self) -> bool:
         """OpenAI o1/o3 models support deliberate reasoning."""
         return self._supports_deliberate
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     def generate(
         self,
         prompt: str,
@@ -39,8 +72,215 @@ class OpenAIClient(LLMClient):
         stop: Optional[list[str]] = None,
         deliberate_steps: Optional[int] = None,
         reasoning_effort: Optional[str] = None,
+    ) -> GenerationResult:
+        """Generate using OpenAI API; the result carries token usage and latency."""
+        kwargs = self._request_kwargs(prompt, max_tokens, temperature, stop, reasoning_effort)
+        start = time.perf_counter()
+        response = self._create(kwargs)
+        return _choice_texts(response, time.perf_counter() - start)[0]
+    
+    def generate_samples(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Draw n samples, sending the prompt once per n-choice request where possible.
+        
+        Non-reasoning models return up to MAX_CHOICES_PER_REQUEST choices per
+        request. o1/o3 models reject n, so they get parallel single requests.
+        """
+        if n <= 0:
+            return []
+        
+        if not self._supports_deliberate:
+            samples = []
+            for size in _chunk_sizes(n, MAX_CHOICES_PER_REQUEST):
+                samples.extend(self._generate_choices(prompt, size, max_tokens, temperature, stop))
+            return samples
+        
+        with ThreadPoolExecutor(max_workers=min(n, self.max_concurrency)) as pool:
+            return list(pool.map(
+                lambda _: self.generate(prompt=prompt, max_tokens=max_tokens, temperature=temperature, stop=stop),
+                range(n),
+            ))
+    
+    def _generate_choices(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float,
+        stop: Optional[list[str]],
+    ) -> List[str]:
+        """One request returning n choices."""
+        kwargs = self._request_kwargs(prompt, max_tokens, temperature, stop, None, n=n)
+        start = time.perf_counter()
+        response = self._create(kwargs)
+        return _choice_texts(response, time.perf_counter() - start)
+    
+    async def agenerate(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+        reasoning_effort: Optional[str] = None,
     ) -> str:
-        """Generate using OpenAI API."""
+        """
+        Async version of generate().
+        
+        All requests made from one event loop share a single AsyncOpenAI client,
+        and with it one keep-alive connection pool. The rate limiter caps how
+        many are in flight, and retries back off with asyncio.sleep, so
+        waiting requests do not block the loop.
+        """
+        kwargs = self._request_kwargs(prompt, max_tokens, temperature, stop, reasoning_effort)
+        start = time.perf_counter()
+        response = await self._acreate(kwargs)
+        return _choice_texts(response, time.perf_counter() - start)[0]
+    
+    async def agenerate_samples(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Async version of generate_samples().
+        
+        n-choice chunks (or, for o1/o3, single requests) are sent concurrently.
+        """
+        if not self._supports_deliberate:
+            chunks = await asyncio.gather(*(
+                self._agenerate_choices(prompt, size, max_tokens, temperature, stop)
+                for size in _chunk_sizes(n, MAX_CHOICES_PER_REQUEST)
+            ))
+            return [text for chunk in chunks for text in chunk]
+        
+        return list(await asyncio.gather(*(
+            self.agenerate(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stop=stop,
+                deliberate_steps=deliberate_steps,
+            )
+            for _ in range(n)
+        )))
+    
+    async def _agenerate_choices(
+        self,
+        prompt: str,
+        n: int,
+        max_tokens: int,
+        temperature: float,
+        stop: Optional[list[str]],
+    ) -> List[str]:
+        """One async request returning n choices."""
+        kwargs = self._request_kwargs(prompt, max_tokens, temperature, stop, None, n=n)
+        start = time.perf_counter()
+        response = await self._acreate(kwargs)
+        return _choice_texts(response, time.perf_counter() - start)
+    
+    def _create(self, kwargs: dict):
+        """Send one chat completion request, paced and retried by the rate limiter."""
+        tokens = _estimated_tokens(kwargs)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(tokens)
+            try:
+                raw = _post(self.client, kwargs)
+            except RETRYABLE_ERRORS as error:
+                delay = self._backoff(error, attempt)
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.rate_limiter.on_failure()
+                raise
+            return self._parse(raw, tokens)
+    
+    async def _acreate(self, kwargs: dict):
+        """Send one chat completion request from the shared async client."""
+        client = self._async_state()
+        tokens = _estimated_tokens(kwargs)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.aacquire(tokens)
+            try:
+                raw = await _apost(client, kwargs)
+            except RETRYABLE_ERRORS as error:
+                delay = self._backoff(error, attempt)
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.rate_limiter.on_failure()
+                raise
+            return self._parse(raw, tokens)
+    
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        """Report a retryable failure to the rate limiter and return the backoff delay."""
+        response = getattr(error, "response", None)
+        return self.rate_limiter.on_error(
+            error,
+            attempt,
+            headers=getattr(response, "headers", None),
+            rate_limited=isinstance(error, RateLimitError),
+        )
+    
+    def _parse(self, raw, estimated_tokens: int):
+        """Parse a raw response and report its headers and usage to the rate limiter."""
+        try:
+            response = raw.parse()
+        except BaseException:
+            self.rate_limiter.on_failure()
+            raise
+        usage = getattr(response, "usage", None)
+        self.rate_limiter.on_success(
+            headers=raw.headers,
+            estimated_tokens=estimated_tokens,
+            used_tokens=getattr(usage, "total_tokens", None),
+        )
+        return response
+    
+    async def aclose(self):
+        """Close the async client's connection pool."""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_loop = None
+            self._async_client = None
+    
+    def _async_state(self):
+        """Return the AsyncOpenAI client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            if self._async_client is not None:
+                # Left open by a loop that ended without aclose()
+                _close_in_background(loop, self._async_client)
+            self._async_client = AsyncOpenAI(api_key=self._api_key, base_url=self.base_url, max_retries=0)
+            self._async_loop = loop
+        return self._async_client
+    
+    def _request_kwargs(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        stop: Optional[list[str]],
+        reasoning_effort: Optional[str],
+        n: int = 1,
+    ) -> dict:
+        """Build chat.completions.create arguments for this model family."""
         # o1/o3 models use different API parameters
         if self._supports_deliberate:
             # o1/o3 models:
@@ -63,21 +303,122 @@ class OpenAIClient(LLMClient):
                 kwargs["reasoning_effort"] = reasoning_effort
                 print(f"  [Using reasoning_effort={reasoning_effort}]", flush=True)
             
-            try:
-                response = self.client.chat.completions.create(**kwargs)
-            except TypeError:
-                # Fallback: try without max_completion_tokens
-                del kwargs["max_completion_tokens"]
-                response = self.client.chat.completions.create(**kwargs)
-        else:
-            # Standard chat completion for non-o1 models
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_tokens,
-                temperature=temperature,
-                stop=stop,
-            )
+            return kwargs
+        
+        # Standard chat completion for non-o1 models
+        kwargs = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stop": stop,
+        }
+        if n > 1:
+            kwargs["n"] = n
+        return kwargs
+
+
+def _post(client, kwargs: dict):
+    """Send a chat completion request and return the raw response (with headers)."""
+    try:
+        return client.chat.completions.with_raw_response.create(**kwargs)
+    except TypeError:
+        if "max_completion_tokens" not in kwargs:
+            raise
+        # Fallback: try without max_completion_tokens
+        del kwargs["max_completion_tokens"]
+        return client.chat.completions.with_raw_response.create(**kwargs)
+
+
+async def _apost(client, kwargs: dict):
+    """Async version of _post()."""
+    try:
+        return await client.chat.completions.with_raw_response.create(**kwargs)
+    except TypeError:
+        if "max_completion_tokens" not in kwargs:
+            raise
+        # Fallback: try without max_completion_tokens
+        del kwargs["max_completion_tokens"]
+        return await client.chat.completions.with_raw_response.create(**kwargs)
+
+
+def _estimated_tokens(kwargs: dict) -> int:
+    """Tokens-per-minute cost of a request built by _request_kwargs()."""
+    max_tokens = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 0
+    return estimate_tokens(kwargs["messages"][-1]["content"], max_tokens, kwargs.get("n", 1))
+
+
+def _chunk_sizes(n: int, chunk: int) -> List[int]:
+    """Split n into consecutive sizes of at most chunk."""
+    return [min(chunk, n - start) for start in range(0, n, chunk)]
+
+
+def _choice_texts(response, latency: float = 0.0) -> List[GenerationResult]:
+    """Message contents of all choices, in choice index order, with the request's usage."""
+    texts = [choice.message.content for choice in sorted(response.choices, key=lambda choice: choice.index)]
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return with_usage(texts, {}, latency)
+    completion_details = getattr(usage, "completion_tokens_details", None)
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    return with_usage(texts, {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "reasoning_tokens": getattr(completion_details, "reasoning_tokens", None) or 0,
+        "cached_tokens": getattr(prompt_details, "cached_tokens", None) or 0,
+    }, latency)
+
+
+# Background close() tasks, referenced until they finish so they are not garbage collected
+_closing = set()
+
+
+def _close_in_background(loop: asyncio.AbstractEventLoop, client: AsyncOpenAI):
+    """Close a stale AsyncOpenAI client from loop without waiting for it."""
+    async def close():
+        try:
+            await client.close()
+        except Exception:
+            # Its connections belong to a closed loop; dropping them is all that is left
+            pass
+    
+    task = loop.create_task(close())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def with_usage(texts: List[str], usage: dict, latency: float = 0.0) -> List[GenerationResult]:
+    """
+    Attach one request's usage to its choices.
+    
+    The prompt is billed once per request, so its tokens go to the first
+    choice; completion and reasoning tokens are split evenly.
+    
+    Args:
+        texts: Choice texts in index order
+        usage: Dict with prompt_tokens, completion_tokens, reasoning_tokens, cached_tokens
+        latency: Seconds the request took
         
-        return response.choices[0].message.content
+    Returns:
+        One GenerationResult per text
+    """
+    n = len(texts)
+    completion = _split(usage.get("completion_tokens", 0), n)
+    reasoning = _split(usage.get("reasoning_tokens", 0), n)
+    return [
+        GenerationResult(
+            text or "",
+            prompt_tokens=usage.get("prompt_tokens", 0) if i == 0 else 0,
+            completion_tokens=completion[i],
+            reasoning_tokens=reasoning[i],
+            cached_tokens=usage.get("cached_tokens", 0) if i == 0 else 0,
+            latency=latency,
+        )
+        for i, text in enumerate(texts)
+    ]
+
 
+def _split(total: int, n: int) -> List[int]:
+    """Split total into n integer parts that differ by at most one."""
+    base, remainder = divmod(total, n) if n else (0, 0)
+    return [base + (1 if i < remainder else 0) for i in range(n)]
@@ -0,0 +1,303 @@
+"""Client-side rate limiting for API backends."""
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+
+# Reset durations in rate-limit headers look like "1s", "6m0s", "20ms" or "1h2m3.5s"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate-limit reset header value, or None if unparseable."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Server-requested wait from retry-after-ms / retry-after headers, if any."""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+def estimate_tokens(prompt: str, max_tokens: int, n: int = 1) -> int:
+    """
+    Tokens a request counts against a tokens-per-minute quota.
+    
+    The prompt is estimated at 4 characters per token, and the completion
+    budget counts in full for every choice, as the API reserves it up front.
+    """
+    return len(prompt) // 4 + max_tokens * max(n, 1)
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class TokenBucket:
+    """Bucket holding up to capacity units, refilled continuously at capacity per minute."""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+    
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it is now)."""
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter with AIMD concurrency.
+    
+    Callers acquire() before sending a request and report the outcome with
+    on_success(), on_failure() or on_error(). The concurrency limit works as
+    a semaphore whose permit count AIMD adjusts: callers finding every slot
+    taken wait until a release (or a raised limit) wakes them, rather than
+    polling. Buckets are corrected from the server's
+    x-ratelimit-remaining-* headers. A 429 pauses every caller for the
+    Retry-After period and halves the concurrency limit; each success grows
+    it again by 1/limit, up to max_concurrency. Counters are kept in
+    rate_limit_stats.
+    """
+    
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        max_concurrency: int = 64,
+        min_concurrency: int = 1,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        """
+        Initialize rate limiter.
+        
+        Args:
+            rpm: Requests per minute quota (None for unlimited)
+            tpm: Tokens per minute quota (None for unlimited)
+            max_concurrency: Upper bound of the adaptive concurrency limit
+            min_concurrency: Lower bound of the adaptive concurrency limit
+            backoff_base: First exponential backoff delay in seconds
+            backoff_max: Longest backoff delay in seconds
+        """
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.rate_limit_stats = {
+            "requests": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "errors": 0,
+            "backoff_seconds": 0.0,
+            "throttle_seconds": 0.0,
+            "concurrency_limit": max_concurrency,
+        }
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        # Threads waiting for a slot wait on this; coroutines on futures in _async_waiters
+        self._slot_freed = threading.Condition(self._lock)
+        self._async_waiters = []
+    
+    def try_acquire(self, tokens: int) -> float:
+        """
+        Take a slot and quota for one request if available.
+        
+        Returns:
+            0 if acquired, math.inf if every slot is taken (wait for a
+            release), otherwise seconds to wait before trying again
+        """
+        with self._lock:
+            return self._try_acquire(tokens)
+    
+    def _try_acquire(self, tokens: int) -> float:
+        """try_acquire() for a caller holding the lock."""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.in_flight >= int(self.concurrency_limit):
+            return math.inf
+        
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount))
+        if wait > 0:
+            return wait
+        
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.level -= min(amount, bucket.capacity)
+        self.in_flight += 1
+        self.rate_limit_stats["requests"] += 1
+        return 0.0
+    
+    def acquire(self, tokens: int):
+        """Block until a request of this many tokens may be sent."""
+        while True:
+            with self._lock:
+                wait = self._try_acquire(tokens)
+                if wait == math.inf:
+                    self._slot_freed.wait()
+                    continue
+            if not wait:
+                return
+            self._add_stat("throttle_seconds", wait)
+            time.sleep(wait)
+    
+    async def aacquire(self, tokens: int):
+        """Async version of acquire()."""
+        while True:
+            with self._lock:
+                wait = self._try_acquire(tokens)
+                if wait == math.inf:
+                    slot_freed = asyncio.get_running_loop().create_future()
+                    self._async_waiters.append(slot_freed)
+            if wait == math.inf:
+                try:
+                    await slot_freed
+                except asyncio.CancelledError:
+                    # Pass the wake-up this waiter may have taken on to another one
+                    with self._lock:
+                        if slot_freed in self._async_waiters:
+                            self._async_waiters.remove(slot_freed)
+                        self._wake_waiters()
+                    raise
+                continue
+            if not wait:
+                return
+            self._add_stat("throttle_seconds", wait)
+            await asyncio.sleep(wait)
+    
+    def on_success(self, headers=None, estimated_tokens: int = 0, used_tokens: Optional[int] = None):
+        """
+        Release a request that succeeded.
+        
+        Args:
+            headers: Response headers carrying x-ratelimit-* values
+            estimated_tokens: Tokens taken from the bucket in acquire()
+            used_tokens: Tokens the response actually reports using
+        """
+        with self._lock:
+            self.in_flight -= 1
+            # Additive increase: +1 to the limit per limit successes
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit)
+            self.rate_limit_stats["concurrency_limit"] = int(self.concurrency_limit)
+            self._wake_waiters()
+            
+            if self.tokens is not None and used_tokens is not None:
+                # Give back what was reserved but not used
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + max(0, estimated_tokens - used_tokens))
+            self._sync_with_headers(headers)
+    
+    def on_failure(self):
+        """Release a request that failed without being retried."""
+        with self._lock:
+            self.in_flight -= 1
+            self.rate_limit_stats["errors"] += 1
+            self._wake_waiters()
+    
+    def on_error(self, error: Exception, attempt: int, headers=None, rate_limited: bool = False) -> float:
+        """
+        Release a request that failed transiently and decide how long to back off.
+        
+        Args:
+            error: The exception raised
+            attempt: Zero-based attempt number of the failed request
+            headers: Response headers, if the server answered
+            rate_limited: Whether the server answered 429
+        
+        Returns:
+            Seconds to wait before retrying
+        """
+        delay = retry_after_seconds(headers)
+        if delay is None:
+            # Exponential backoff with full jitter
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        
+        with self._lock:
+            self.in_flight -= 1
+            self.rate_limit_stats["retries"] += 1
+            self.rate_limit_stats["backoff_seconds"] += delay
+            if rate_limited:
+                self.rate_limit_stats["rate_limited"] += 1
+                # Multiplicative decrease, and hold every caller back together
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+                self.rate_limit_stats["concurrency_limit"] = int(self.concurrency_limit)
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+            else:
+                self.rate_limit_stats["errors"] += 1
+            self._sync_with_headers(headers)
+            self._wake_waiters()
+        
+        return delay
+    
+    def _wake_waiters(self):
+        """Wake as many slot waiters as there are free slots (caller holds the lock)."""
+        free = int(self.concurrency_limit) - self.in_flight
+        if free <= 0:
+            return
+        self._slot_freed.notify(free)
+        while free > 0 and self._async_waiters:
+            slot_freed = self._async_waiters.pop(0)
+            # Waiters may belong to event loops of other threads
+            slot_freed.get_loop().call_soon_threadsafe(_wake, slot_freed)
+            free -= 1
+    
+    def _sync_with_headers(self, headers):
+        """Lower bucket levels to what the server reports as remaining (caller holds the lock)."""
+        if not headers:
+            return
+        now = time.monotonic()
+        for bucket, name in ((self.requests, "requests"), (self.tokens, "tokens")):
+            remaining = headers.get(f"x-ratelimit-remaining-{name}")
+            if bucket is None or remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            bucket.refill(now)
+            bucket.level = min(bucket.level, remaining)
+            if remaining <= 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{name}"))
+                if reset:
+                    self._blocked_until = max(self._blocked_until, now + reset)
+    
+    def _add_stat(self, name: str, value: float):
+        with self._lock:
+            self.rate_limit_stats[name] += value
@@ -0,0 +1,109 @@
+"""Token usage, spend accounting and budgets."""
+from typing import Dict, Hashable, Iterable, Optional
+
+
+# USD per million tokens: (input, cached input, output); reasoning tokens bill as output
+PRICES_PER_MILLION = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "o1-preview": (15.00, 7.50, 60.00),
+    "o1-mini": (1.10, 0.55, 4.40),
+    "o1": (15.00, 7.50, 60.00),
+    "o3-mini": (1.10, 0.55, 4.40),
+}
+
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "reasoning_tokens", "cached_tokens")
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised when recorded usage goes over the configured spend or token budget."""
+    pass
+
+
+def model_prices(model_name: str) -> Optional[tuple]:
+    """Prices of the longest PRICES_PER_MILLION entry that model_name starts with."""
+    matches = [name for name in PRICES_PER_MILLION if (model_name or "").startswith(name)]
+    return PRICES_PER_MILLION[max(matches, key=len)] if matches else None
+
+
+def output_cost(output, prices: Optional[tuple]) -> float:
+    """USD cost of one generated output (0 for plain strings or unpriced models)."""
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    prompt_tokens = getattr(output, "prompt_tokens", 0)
+    cached_tokens = getattr(output, "cached_tokens", 0)
+    completion_tokens = getattr(output, "completion_tokens", 0)
+    return (
+        (prompt_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + completion_tokens * output_price
+    ) / 1e6
+
+
+class UsageTracker:
+    """
+    Accumulates token usage and cost per key (e.g. grid cell) and overall.
+    
+    Outputs without usage (plain strings, such as cache hits) count as free.
+    add() raises BudgetExceeded once the running totals pass max_cost or
+    max_total_tokens.
+    """
+    
+    def __init__(
+        self,
+        model_name: str = "",
+        max_cost: Optional[float] = None,
+        max_total_tokens: Optional[int] = None,
+        price_factor: float = 1.0,
+    ):
+        """
+        Initialize usage tracker.
+        
+        Args:
+            model_name: Model used to look up prices
+            max_cost: Hard spend limit in USD (None: unlimited)
+            max_total_tokens: Hard limit on prompt + completion tokens (None: unlimited)
+            price_factor: Multiplier on list prices (e.g. 0.5 for the Batch API)
+        """
+        self.prices = model_prices(model_name)
+        self.max_cost = max_cost
+        self.max_total_tokens = max_total_tokens
+        self.price_factor = price_factor
+        self.totals = _empty_usage()
+        self.by_key = {}
+        
+        if max_cost is not None and self.prices is None:
+            print(f"Warning: no prices known for {model_name!r}; max_cost cannot be enforced")
+    
+    def add(self, key: Hashable, outputs: Iterable):
+        """Record the usage of outputs under key, then enforce the budget."""
+        usage = self.by_key.setdefault(key, _empty_usage())
+        for output in outputs:
+            cost = output_cost(output, self.prices) * self.price_factor
+            latency = getattr(output, "latency", 0.0)
+            for target in (usage, self.totals):
+                for field in USAGE_FIELDS:
+                    target[field] += getattr(output, field, 0)
+                target["cost_usd"] += cost
+                target["latency_s"] += latency
+                target["samples"] += 1
+        
+        total_tokens = self.totals["prompt_tokens"] + self.totals["completion_tokens"]
+        if self.max_cost is not None and self.totals["cost_usd"] > self.max_cost:
+            raise BudgetExceeded(f"Spend ${self.totals['cost_usd']:.4f} exceeded budget ${self.max_cost:.4f}")
+        if self.max_total_tokens is not None and total_tokens > self.max_total_tokens:
+            raise BudgetExceeded(f"{total_tokens} tokens exceeded budget of {self.max_total_tokens}")
+    
+    def summary(self, key: Hashable) -> Dict:
+        """Usage columns for key: token sums, cost and mean per-sample latency."""
+        usage = self.by_key.get(key, _empty_usage())
+        return {
+            **{field: usage[field] for field in USAGE_FIELDS},
+            "cost_usd": usage["cost_usd"],
+            "mean_latency_s": usage["latency_s"] / usage["samples"] if usage["samples"] else 0.0,
+        }
+
+
+def _empty_usage() -> Dict:
+    return {**{field: 0 for field in USAGE_FIELDS}, "cost_usd": 0.0, "latency_s": 0.0, "samples": 0}
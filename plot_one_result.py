@@ -1,11 +1,12 @@
 """Plot single completed result."""
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 
-# Load data
-df = pd.read_csv("results/addition_output_42.csv")
+from eval.plotting import load_results
+
+# Load data (recomputed from raw samples when they were stored)
+df = load_results("addition_output_42", output_dir="results")
 
 print("Data loaded:")
 print(df)
@@ -1,10 +1,10 @@
 """Plot partial Figure 2 results from completed experiments."""
-import os
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 
+from eval.plotting import load_results
+
 # Load completed results
 results_dict = {}
 
@@ -22,9 +22,8 @@ experiments = [
 ]
 
 for task, goal in experiments:
-    csv_file = f"results/figure2_fast_{task}_{goal}.csv"
-    if os.path.exists(csv_file):
-        df = pd.read_csv(csv_file)
+    df = load_results(f"figure2_fast_{task}_{goal}", output_dir="results")
+    if df is not None:
         results_dict[(task, goal)] = df
         print(f"✓ Loaded: {task} × {goal}")
 
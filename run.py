@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 
 from data.gen_math import sample_add, sample_mul, sample_math, train_test_split
 from eval.grid_runner import run_grid_experiment
+from eval.planner import plan_grid, print_plan, summarize_plan
 from eval.plotting import generate_plots
 
 
@@ -17,6 +18,21 @@ def load_config(config_path: str) -> dict:
 
 def create_model(config: dict):
     """Create model client from config."""
+    model = _create_backend(config)
+    
+    cache_path = config["model"].get("cache_path")
+    if cache_path:
+        from models.cache import CachedClient
+        model = CachedClient(
+            model,
+            path=cache_path,
+            max_bytes=config["model"].get("cache_max_bytes", 1024 ** 3),
+        )
+    return model
+
+
+def _create_backend(config: dict):
+    """Create the uncached backend client from config."""
     backend = config["model"]["backend"]
     
     if backend == "openai":
@@ -25,6 +41,10 @@ def create_model(config: dict):
         return OpenAIClient(
             model_name=config["model"]["model_name"],
             api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=config["model"].get("base_url"),
+            max_concurrency=config["experiment"].get("max_concurrency") or 64,
+            rpm=config["model"].get("rpm"),
+            tpm=config["model"].get("tpm"),
         )
     elif backend == "huggingface":
         # Lazy import to avoid OpenAI dependency when using HuggingFace
@@ -32,11 +52,40 @@ def create_model(config: dict):
         return HuggingFaceClient(
             model_name=config["model"]["model_name"],
             device=config["model"].get("device"),
+            sample_chunk_size=config["model"].get("sample_chunk_size", 8),
+            prefix_cache_bytes=config["model"].get("prefix_cache_bytes", 2 * 1024 ** 3),
+            stop_on_answer=config["model"].get("stop_on_answer", False),
+        )
+    elif backend == "simulated":
+        # No model or network; answers come from a susceptibility model
+        from models.simulated import SimulatedClient
+        return SimulatedClient(
+            latency_median=config["model"].get("latency_median", 0.0),
+            error_rate=config["model"].get("error_rate", 0.0),
+            seed=config.get("seed"),
         )
     else:
         raise ValueError(f"Unknown backend: {backend}")
 
 
+def create_batch_runner(config: dict, model):
+    """Create an OpenAI Batch API runner if the config asks for one."""
+    if not config["experiment"].get("batch_api", False):
+        return None
+    if config["model"]["backend"] != "openai":
+        raise ValueError("experiment.batch_api requires the openai backend")
+    if config["experiment"].get("max_cost") is not None or config["experiment"].get("max_total_tokens") is not None:
+        raise ValueError("experiment.batch_api cannot be combined with max_cost or max_total_tokens")
+    from models.cache import CachedClient
+    from models.openai_batch import OpenAIBatchRunner
+    # Batch jobs go straight to the API; the response cache is not consulted
+    return OpenAIBatchRunner(
+        model.model if isinstance(model, CachedClient) else model,
+        poll_interval=config["experiment"].get("batch_poll_interval", 30),
+        work_dir=os.path.join(config.get("output_dir", "results"), "batch_inputs"),
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(description="Run inference-time compute vs robustness experiment")
     parser.add_argument(
@@ -45,6 +94,16 @@ def main():
         required=True,
         help="Path to config YAML file",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its journal in the output directory",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the samples, calls, tokens, cost and wall time the run would take, then exit without running",
+    )
     args = parser.parse_args()
     
     # Load environment variables
@@ -57,11 +116,6 @@ def main():
     print(f"Running experiment: {variation}")
     print(f"Config: {args.config}")
     
-    # Create model
-    print("Initializing model...")
-    model = create_model(config)
-    print(f"Model: {config['model']['model_name']} ({config['model']['backend']})")
-    
     # Generate data
     print("Generating data...")
     data_config = config["data"]
@@ -103,6 +157,33 @@ def main():
             variation_params["use_nerd_snipe"] = True
             variation_params["nerd_snipe_tokens"] = exp_config.get("nerd_snipe_tokens", 512)
     
+    if args.plan:
+        plan = plan_grid(
+            test_problems=test_problems,
+            k_values=k_values,
+            attacker_strengths=attacker_strengths,
+            attacker_goals=attacker_goals,
+            model_name=config["model"]["model_name"],
+            max_tokens=exp_config.get("max_tokens", 100),
+            samples_per_call=exp_config.get("samples_per_call"),
+            reuse_samples=exp_config.get("reuse_samples"),
+            variation_params=variation_params,
+            seed=seed,
+        )
+        summary = summarize_plan(
+            plan,
+            max_concurrency=exp_config.get("max_concurrency"),
+            rpm=config["model"].get("rpm"),
+            tpm=config["model"].get("tpm"),
+        )
+        print_plan(plan, summary, len(test_problems), ci_width=exp_config.get("ci_target_width"))
+        return
+    
+    # Create model
+    print("Initializing model...")
+    model = create_model(config)
+    print(f"Model: {config['model']['model_name']} ({config['model']['backend']})")
+    
     # Run experiment
     print("Running grid experiment...")
     df = run_grid_experiment(
@@ -117,6 +198,22 @@ def main():
         deliberate_steps=exp_config.get("deliberate_steps"),
         seed=seed,
         output_dir=config.get("output_dir", "results"),
+        batch_size=exp_config.get("batch_size"),
+        max_concurrency=exp_config.get("max_concurrency"),
+        samples_per_call=exp_config.get("samples_per_call"),
+        batch_runner=create_batch_runner(config, model),
+        max_cost=exp_config.get("max_cost"),
+        max_total_tokens=exp_config.get("max_total_tokens"),
+        resume=args.resume or exp_config.get("resume", False),
+        task=data_config.get("task"),
+        reuse_samples=exp_config.get("reuse_samples"),
+        adaptive_step=exp_config.get("adaptive_step"),
+        stop_confidence=exp_config.get("stop_confidence"),
+        ci_target_width=exp_config.get("ci_target_width"),
+        sprt_threshold=exp_config.get("sprt_threshold"),
+        ci_method=exp_config.get("ci_method", "wilson"),
+        sample_budget=exp_config.get("sample_budget"),
+        allocation_threshold=exp_config.get("allocation_threshold", 0.5),
     )
     
     # Generate plots
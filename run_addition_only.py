@@ -43,6 +43,36 @@ def main():
         default=42,
         help="Random seed",
     )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=None,
+        help="Maximum model calls in flight (default: sequential)",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="SQLite file caching model responses across runs (default: no cache)",
+    )
+    parser.add_argument(
+        "--cassette",
+        type=str,
+        default=None,
+        help="Cassette file (.jsonl.gz) to record responses to or replay them from",
+    )
+    parser.add_argument(
+        "--cassette_mode",
+        type=str,
+        default="replay",
+        choices=["record", "replay"],
+        help="Record a new cassette, or replay one with no network or model load",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue interrupted experiments from their journals in the output directory",
+    )
     args = parser.parse_args()
     
     # Load environment
@@ -53,7 +83,15 @@ def main():
     
     # Initialize model
     print(f"Initializing model: {args.model_name}")
-    model = create_o1_model(args.model_name)
+    if args.cassette:
+        from models.cassette import open_cassette
+        model = open_cassette(args.cassette, args.cassette_mode, lambda: create_o1_model(args.model_name))
+    else:
+        model = create_o1_model(args.model_name)
+    
+    if args.cache_path:
+        from models.cache import CachedClient
+        model = CachedClient(model, path=args.cache_path)
     
     # Parameters for quick experiments
     tasks = ["addition"]  # Only addition
@@ -102,6 +140,9 @@ def main():
             deliberate_steps=None,
             seed=args.seed,
             output_dir=args.output_dir,
+            max_concurrency=args.max_concurrency,
+            resume=args.resume,
+            task="addition",
         )
         
         # Store results
@@ -194,6 +235,10 @@ def main():
         # By k
         by_k = df.groupby('k')['attack_success_rate'].mean()
         print(f"  By k: {dict(by_k)}")
+    
+    if args.cache_path:
+        print(f"  Response cache: {model.cache_stats['hits']} hits, {model.cache_stats['misses']} misses "
+              f"(hit rate {model.hit_rate:.1%})")
 
 
 if __name__ == "__main__":
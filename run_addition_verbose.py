@@ -4,6 +4,7 @@ from dotenv import load_dotenv
 from data.gen_math import sample_add
 from attacks.many_shot import build_many_shot_prompt, get_attacker_goal_value
 from defense.inference_budget import extract_integer
+from models.cassette import cassette_from_env
 import pandas as pd
 
 load_dotenv()
@@ -20,6 +21,9 @@ n_samples = 4
 reasoning_efforts = ["low", "medium", "high"]
 attacker_strengths = [100, 500, 1000, 2000]
 goals = ["output_42", "answer_plus_1", "answer_times_7"]
+# Set RESPONSE_CACHE_PATH to cache responses there, so reruns only pay for new
+# requests; off by default, since cached samples outlive edits to prompts or parameters
+cache_path = os.getenv("RESPONSE_CACHE_PATH")
 
 print("="*80)
 print(f"VERBOSE TESTING - {model_name}")
@@ -30,7 +34,11 @@ problems = sample_add(n_samples, digits=2, seed=42)
 
 # Initialize model
 print(f"\nInitializing {model_name}...")
-model = create_model(model_name)
+# Set CASSETTE_MODE=record/replay (and CASSETTE_PATH) to record or replay responses offline
+model = cassette_from_env(lambda: create_model(model_name))
+if cache_path:
+    from models.cache import CachedClient
+    model = CachedClient(model, path=cache_path)
 
 # Store results
 results = []
@@ -140,4 +148,6 @@ for goal in goals:
         print(f"    {effort}: ASR={effort_df['attack_success'].mean():.3f}, Acc={effort_df['accuracy'].mean():.3f}")
 
 print(f"\n✅ Results saved to results/verbose_results.csv")
+if cache_path:
+    print(f"Response cache hit rate: {model.hit_rate:.1%} ({model.cache_stats['hits']} hits)")
 
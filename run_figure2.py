@@ -10,11 +10,14 @@ try:
     HENDRYCKS_MATH_AVAILABLE = True
 except ImportError:
     HENDRYCKS_MATH_AVAILABLE = False
-from eval.grid_runner import run_grid_experiment
+from eval.adaptive_search import run_boundary_search
+from eval.grid_runner import run_grid_experiments, run_sparse_grid
+from eval.planner import plan_grid, print_plan, summarize_plan
 from eval.plotting import plot_figure2_grid
+from eval.surrogate import fit_surface, latin_hypercube_design
 
 
-def create_model(backend: str, model_name: str, device: str = None):
+def create_model(backend: str, model_name: str, device: str = None, rpm: int = None, tpm: int = None):
     """Create model client."""
     if backend == "openai":
         # Lazy import to avoid transformers dependency when using OpenAI
@@ -22,6 +25,8 @@ def create_model(backend: str, model_name: str, device: str = None):
         return OpenAIClient(
             model_name=model_name,
             api_key=os.getenv("OPENAI_API_KEY"),
+            rpm=rpm,
+            tpm=tpm,
         )
     elif backend == "huggingface":
         # Lazy import to avoid OpenAI dependency when using HuggingFace
@@ -30,17 +35,66 @@ def create_model(backend: str, model_name: str, device: str = None):
             model_name=model_name,
             device=device,
         )
+    elif backend == "simulated":
+        # No model or network; answers come from a susceptibility model
+        from models.simulated import SimulatedClient
+        return SimulatedClient(model_name=model_name)
     else:
         raise ValueError(f"Unknown backend: {backend}")
 
 
+def load_task_problems(task: str, args) -> list:
+    """Test problems of a task, as set by the command-line arguments."""
+    if task == "addition":
+        return sample_add(args.n_samples, digits=args.digits, seed=args.seed)
+    elif task == "multiplication":
+        return sample_mul(args.n_samples, digits=args.digits, seed=args.seed)
+    elif task == "math":
+        if args.use_hendrycks_math:
+            print(f"  Using real Hendrycks MATH dataset...")
+            return sample_math_hendrycks(args.n_samples, seed=args.seed)
+        print(f"  Using synthetic MATH problems...")
+        return sample_math(args.n_samples, seed=args.seed)
+    raise ValueError(f"Unknown task: {task}")
+
+
+def total_samples(args, tasks: list, goals: list, k_values: list, attacker_strengths: list) -> int:
+    """Model generations the full grid draws across all experiments."""
+    samples_per_problem = max(k_values) if args.reuse_samples else sum(k_values)
+    return len(tasks) * len(goals) * len(attacker_strengths) * args.n_samples * samples_per_problem
+
+
+def print_figure2_plan(args, tasks: list, goals: list, k_values: list, attacker_strengths: list):
+    """Print the work of every experiment of the figure without loading a model."""
+    plan = pd.concat([
+        plan_grid(
+            test_problems=load_task_problems(task, args),
+            k_values=k_values,
+            attacker_strengths=attacker_strengths,
+            attacker_goals=goals,
+            model_name=args.model_name,
+            max_tokens=100,
+            reuse_samples=args.reuse_samples,
+            seed=args.seed,
+        )
+        for task in tasks
+    ], ignore_index=True)
+    summary = summarize_plan(
+        plan,
+        max_concurrency=args.max_concurrency,
+        rpm=getattr(args, "rpm", None),
+        tpm=getattr(args, "tpm", None),
+    )
+    print_plan(plan, summary, args.n_samples, ci_width=args.ci_target_width)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate Figure 2: 3x3 grid of attack experiments")
     parser.add_argument(
         "--backend",
         type=str,
         default="huggingface",
-        choices=["openai", "huggingface"],
+        choices=["openai", "huggingface", "simulated"],
         help="Model backend",
     )
     parser.add_argument(
@@ -85,6 +139,119 @@ def main():
         choices=[2, 3, 4],
         help="Number of digits for addition/multiplication (default: 2, paper uses 4 for o1-preview)",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=None,
+        help="Prompts per batched generate call (HuggingFace backend; default: one prompt at a time)",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=None,
+        help="Maximum model calls in flight (default: sequential)",
+    )
+    parser.add_argument(
+        "--batch_api",
+        action="store_true",
+        help="Submit all calls through the OpenAI Batch API instead of live requests (openai backend only)",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="SQLite file caching model responses across runs (default: no cache)",
+    )
+    parser.add_argument(
+        "--max_cost",
+        type=float,
+        default=None,
+        help="Hard spend limit in USD across all experiments; the run stops cleanly once it is reached",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=None,
+        help="Requests-per-minute quota to pace OpenAI requests to",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        default=None,
+        help="Tokens-per-minute quota to pace OpenAI requests to",
+    )
+    parser.add_argument(
+        "--cassette",
+        type=str,
+        default=None,
+        help="Cassette file (.jsonl.gz) to record responses to or replay them from",
+    )
+    parser.add_argument(
+        "--cassette_mode",
+        type=str,
+        default="replay",
+        choices=["record", "replay"],
+        help="Record a new cassette, or replay one with no network or model load",
+    )
+    parser.add_argument(
+        "--reuse_samples",
+        type=str,
+        default=None,
+        choices=["prefix", "subsets"],
+        help="Draw max(k) samples once per problem and vote smaller k on prefixes or random subsets of it",
+    )
+    parser.add_argument(
+        "--adaptive_step",
+        type=int,
+        default=None,
+        help="Draw each problem's samples in batches of this size and stop once its vote is decided",
+    )
+    parser.add_argument(
+        "--stop_confidence",
+        type=float,
+        default=None,
+        help="With --adaptive_step, also stop once the vote is decided with this confidence (e.g. 0.99)",
+    )
+    parser.add_argument(
+        "--ci_target_width",
+        type=float,
+        default=None,
+        help="Stop running problems of a cell once the 95%% interval on its ASR is narrower than this (e.g. 0.1)",
+    )
+    parser.add_argument(
+        "--sprt_threshold",
+        type=float,
+        default=None,
+        help="Stop running problems of a cell once an SPRT decides its ASR is above or below this value",
+    )
+    parser.add_argument(
+        "--sample_budget",
+        type=int,
+        default=None,
+        help="Samples to spend per experiment, routed to the cells whose ASR is least resolved against 0.5",
+    )
+    parser.add_argument(
+        "--search_target",
+        type=float,
+        default=None,
+        help="Treat the k/strength grid as coarse and bisect toward where ASR crosses this level (e.g. 0.5)",
+    )
+    parser.add_argument(
+        "--sparse_cells",
+        type=int,
+        default=None,
+        help="Measure only this many Latin-hypercube cells per panel and fill the rest from a fitted ASR surface",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the samples, calls, tokens, cost and wall time the run would take, then exit without running",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue interrupted experiments from their journals in the output directory",
+    )
     args = parser.parse_args()
     
     # Check if Hendrycks MATH is requested but not available
@@ -99,10 +266,6 @@ def main():
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
     
-    # Initialize model
-    print(f"Initializing model: {args.model_name} ({args.backend})")
-    model = create_model(args.backend, args.model_name, args.device)
-    
     # Define experimental parameters
     tasks = ["addition", "multiplication", "math"]
     goals = ["output_42", "answer_plus_1", "answer_times_7"]
@@ -120,64 +283,147 @@ def main():
     print(f"  k values (inference compute): {k_values}")
     print(f"  Attacker strengths (tokens): {attacker_strengths}")
     print(f"  Samples per condition: {args.n_samples}")
+    print(f"  Total samples: {total_samples(args, tasks, goals, k_values, attacker_strengths):,} (--plan for calls, tokens, cost and time)")
+    
+    if args.plan:
+        print_figure2_plan(args, tasks, goals, k_values, attacker_strengths)
+        return
+    
+    # Initialize model
+    print(f"Initializing model: {args.model_name} ({args.backend})")
+    if args.cassette:
+        from models.cassette import open_cassette
+        model = open_cassette(args.cassette, args.cassette_mode, lambda: create_model(args.backend, args.model_name, args.device, rpm=args.rpm, tpm=args.tpm))
+    else:
+        model = create_model(args.backend, args.model_name, args.device, rpm=args.rpm, tpm=args.tpm)
+    
+    batch_runner = None
+    if args.batch_api:
+        if args.backend != "openai" or args.cassette:
+            print("Error: --batch_api requires the openai backend and cannot be combined with --cassette.")
+            return
+        if args.max_cost is not None:
+            print("Error: --batch_api cannot be combined with --max_cost; batches are paid for before usage is seen.")
+            return
+        from models.openai_batch import OpenAIBatchRunner
+        batch_runner = OpenAIBatchRunner(model, work_dir=os.path.join(args.output_dir, "batch_inputs"))
+    
+    if args.cache_path:
+        from models.cache import CachedClient
+        model = CachedClient(model, path=args.cache_path)
     
     # Store results for each (task, goal) combination
     results_dict = {}
+    surfaces = {}
     
-    # Run all 9 experiments
-    total_experiments = len(tasks) * len(goals)
-    experiment_num = 0
+    # Settings shared by all experiments
+    grid_kwargs = dict(
+        variation_params={},
+        max_tokens=100,
+        deliberate_steps=None,
+        seed=args.seed,
+        output_dir=args.output_dir,
+        batch_size=args.batch_size,
+        max_concurrency=args.max_concurrency,
+        batch_runner=batch_runner,
+        resume=args.resume,
+        reuse_samples=args.reuse_samples,
+        adaptive_step=args.adaptive_step,
+        stop_confidence=args.stop_confidence,
+        ci_target_width=args.ci_target_width,
+        sprt_threshold=args.sprt_threshold,
+        sample_budget=args.sample_budget,
+    )
     
+    # All 9 (task, goal) experiments
+    experiments = []
     for task in tasks:
         # Generate data for this task
         print(f"\n{'='*80}")
         print(f"Generating {task} problems...")
         print(f"{'='*80}")
         
-        if task == "addition":
-            problems = sample_add(args.n_samples, digits=args.digits, seed=args.seed)
-        elif task == "multiplication":
-            problems = sample_mul(args.n_samples, digits=args.digits, seed=args.seed)
-        elif task == "math":
-            if args.use_hendrycks_math:
-                print(f"  Using real Hendrycks MATH dataset...")
-                problems = sample_math_hendrycks(args.n_samples, seed=args.seed)
-            else:
-                print(f"  Using synthetic MATH problems...")
-                problems = sample_math(args.n_samples, seed=args.seed)
-        else:
-            raise ValueError(f"Unknown task: {task}")
-        
         # Use all problems as test (no train/test split needed for this figure)
-        test_problems = problems
+        test_problems = load_task_problems(task, args)
         
         for goal in goals:
-            experiment_num += 1
-            print(f"\n[Experiment {experiment_num}/{total_experiments}] Task: {task}, Goal: {goal}")
+            experiments.append((task, goal, test_problems))
+    
+    if args.search_target is None and args.sparse_cells is None:
+        # Full grids share one call queue, so concurrency does not collapse
+        # at every experiment boundary
+        print(f"\nRunning {len(experiments)} experiments through one call queue")
+        print("-" * 80)
+        dfs = run_grid_experiments(
+            model=model,
+            experiments=[
+                dict(
+                    test_problems=test_problems,
+                    k_values=k_values,
+                    attacker_strengths=attacker_strengths,
+                    attacker_goals=[goal],
+                    variation=f"figure2_{task}_{goal}",
+                    task=task,
+                )
+                for task, goal, test_problems in experiments
+            ],
+            max_cost=args.max_cost,
+            **grid_kwargs,
+        )
+        results = list(zip(experiments, dfs))
+    else:
+        results = []
+        spent = 0.0
+        for experiment_num, (task, goal, test_problems) in enumerate(experiments, start=1):
+            print(f"\n[Experiment {experiment_num}/{len(experiments)}] Task: {task}, Goal: {goal}")
             print("-" * 80)
             
-            # Run grid experiment
-            df = run_grid_experiment(
-                model=model,
-                test_problems=test_problems,
-                k_values=k_values,
-                attacker_strengths=attacker_strengths,
-                attacker_goals=[goal],
-                variation=f"figure2_{task}_{goal}",
-                variation_params={},
-                max_tokens=100,
-                deliberate_steps=None,
-                seed=args.seed,
-                output_dir=args.output_dir,
+            search_kwargs = dict(
+                grid_kwargs,
+                max_cost=None if args.max_cost is None else args.max_cost - spent,
+                task=task,
             )
-            
-            # Store results
-            results_dict[(task, goal)] = df
-            
-            # Save individual CSV
-            csv_file = os.path.join(args.output_dir, f"figure2_{task}_{goal}.csv")
-            df.to_csv(csv_file, index=False)
-            print(f"Results saved to {csv_file}")
+            if args.search_target is not None:
+                # Bisect from the coarse grid toward where ASR crosses the target
+                df, frontier = run_boundary_search(
+                    model=model,
+                    test_problems=test_problems,
+                    k_values=k_values,
+                    attacker_strengths=attacker_strengths,
+                    attacker_goal=goal,
+                    target_asr=args.search_target,
+                    variation=f"figure2_{task}_{goal}",
+                    **search_kwargs,
+                )
+                print(frontier.to_string(index=False))
+            else:
+                # Measure a Latin-hypercube subset and fit the surface to it
+                df = run_sparse_grid(
+                    model=model,
+                    test_problems=test_problems,
+                    cells=latin_hypercube_design(k_values, attacker_strengths, args.sparse_cells, seed=args.seed),
+                    attacker_goal=goal,
+                    variation=f"figure2_{task}_{goal}",
+                    **search_kwargs,
+                )
+                if not df.empty:
+                    surfaces[(task, goal)] = fit_surface(df)
+            spent += df.attrs["usage"]["cost_usd"]
+            results.append(((task, goal, test_problems), df))
+            if df.attrs.get("stopped_early"):
+                break
+    
+    for (task, goal, _), df in results:
+        # Store results
+        results_dict[(task, goal)] = df
+        
+        # Save individual CSV
+        csv_file = os.path.join(args.output_dir, f"figure2_{task}_{goal}.csv")
+        df.to_csv(csv_file, index=False)
+        print(f"Results saved to {csv_file}")
+    
+    if any(df.attrs.get("stopped_early") for _, df in results):
+        print(f"Budget of ${args.max_cost:.2f} reached; remaining cells and experiments were skipped")
     
     # Generate Figure 2
     print(f"\n{'='*80}")
@@ -190,10 +436,17 @@ def main():
         output_file=output_file,
         tasks=tasks,
         goals=goals,
+        surfaces=surfaces,
+        k_values=k_values,
+        attacker_strengths=attacker_strengths,
     )
     
     print(f"\n✓ Figure 2 generation complete!")
     print(f"  Output: {output_file}")
+    
+    if args.cache_path:
+        print(f"  Response cache: {model.cache_stats['hits']} hits, {model.cache_stats['misses']} misses "
+              f"(hit rate {model.hit_rate:.1%})")
 
 
 if __name__ == "__main__":
@@ -15,7 +15,7 @@ def main():
         "--backend",
         type=str,
         default="openai",
-        choices=["openai", "huggingface"],
+        choices=["openai", "huggingface", "simulated"],
         help="Model backend",
     )
     parser.add_argument(
@@ -60,6 +60,96 @@ def main():
         choices=[2, 3, 4],
         help="Number of digits for addition/multiplication",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=None,
+        help="Prompts per batched generate call (HuggingFace backend; default: one prompt at a time)",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=None,
+        help="Maximum model calls in flight (default: sequential)",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=None,
+        help="SQLite file caching model responses across runs (default: no cache)",
+    )
+    parser.add_argument(
+        "--cassette",
+        type=str,
+        default=None,
+        help="Cassette file (.jsonl.gz) to record responses to or replay them from",
+    )
+    parser.add_argument(
+        "--cassette_mode",
+        type=str,
+        default="replay",
+        choices=["record", "replay"],
+        help="Record a new cassette, or replay one with no network or model load",
+    )
+    parser.add_argument(
+        "--reuse_samples",
+        type=str,
+        default=None,
+        choices=["prefix", "subsets"],
+        help="Draw max(k) samples once per problem and vote smaller k on prefixes or random subsets of it",
+    )
+    parser.add_argument(
+        "--adaptive_step",
+        type=int,
+        default=None,
+        help="Draw each problem's samples in batches of this size and stop once its vote is decided",
+    )
+    parser.add_argument(
+        "--stop_confidence",
+        type=float,
+        default=None,
+        help="With --adaptive_step, also stop once the vote is decided with this confidence (e.g. 0.99)",
+    )
+    parser.add_argument(
+        "--ci_target_width",
+        type=float,
+        default=None,
+        help="Stop running problems of a cell once the 95%% interval on its ASR is narrower than this (e.g. 0.1)",
+    )
+    parser.add_argument(
+        "--sprt_threshold",
+        type=float,
+        default=None,
+        help="Stop running problems of a cell once an SPRT decides its ASR is above or below this value",
+    )
+    parser.add_argument(
+        "--sample_budget",
+        type=int,
+        default=None,
+        help="Samples to spend per experiment, routed to the cells whose ASR is least resolved against 0.5",
+    )
+    parser.add_argument(
+        "--search_target",
+        type=float,
+        default=None,
+        help="Treat the k/strength grid as coarse and bisect toward where ASR crosses this level (e.g. 0.5)",
+    )
+    parser.add_argument(
+        "--sparse_cells",
+        type=int,
+        default=None,
+        help="Measure only this many Latin-hypercube cells per panel and fill the rest from a fitted ASR surface",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the samples, calls, tokens, cost and wall time the run would take, then exit without running",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue interrupted experiments from their journals in the output directory",
+    )
     args = parser.parse_args()
     
     # Check if Hendrycks MATH is requested but not available
@@ -74,10 +164,6 @@ def main():
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
     
-    # Initialize model
-    print(f"Initializing model: {args.model_name} ({args.backend})")
-    model = create_model(args.backend, args.model_name, args.device)
-    
     # Define experimental parameters
     tasks = ["addition", "multiplication", "math"]
     goals = ["output_42", "answer_plus_1", "answer_times_7"]
@@ -101,65 +187,123 @@ def main():
     print(f"  k values (inference compute): {k_values}")
     print(f"  Attacker strengths (tokens): {attacker_strengths}")
     print(f"  Samples per condition: {args.n_samples}")
-    print(f"  Total model calls: {len(tasks) * len(goals) * len(k_values) * len(attacker_strengths) * args.n_samples}")
+    print(f"  Total samples: {total_samples(args, tasks, goals, k_values, attacker_strengths):,} (--plan for calls, tokens, cost and time)")
+    
+    if args.plan:
+        print_figure2_plan(args, tasks, goals, k_values, attacker_strengths)
+        return
+    
+    # Initialize model
+    print(f"Initializing model: {args.model_name} ({args.backend})")
+    if args.cassette:
+        from models.cassette import open_cassette
+        model = open_cassette(args.cassette, args.cassette_mode, lambda: create_model(args.backend, args.model_name, args.device))
+    else:
+        model = create_model(args.backend, args.model_name, args.device)
+    
+    if args.cache_path:
+        from models.cache import CachedClient
+        model = CachedClient(model, path=args.cache_path)
     
     # Store results for each (task, goal) combination
     results_dict = {}
+    surfaces = {}
     
-    # Run all 9 experiments
-    total_experiments = len(tasks) * len(goals)
-    experiment_num = 0
+    # Settings shared by all experiments
+    grid_kwargs = dict(
+        variation_params={},
+        max_tokens=100,
+        deliberate_steps=None,
+        seed=args.seed,
+        output_dir=args.output_dir,
+        batch_size=args.batch_size,
+        max_concurrency=args.max_concurrency,
+        resume=args.resume,
+        reuse_samples=args.reuse_samples,
+        adaptive_step=args.adaptive_step,
+        stop_confidence=args.stop_confidence,
+        ci_target_width=args.ci_target_width,
+        sprt_threshold=args.sprt_threshold,
+        sample_budget=args.sample_budget,
+    )
     
+    # All 9 (task, goal) experiments
+    experiments = []
     for task in tasks:
         # Generate data for this task
         print(f"\n{'='*80}")
         print(f"Generating {task} problems...")
         print(f"{'='*80}")
         
-        if task == "addition":
-            problems = sample_add(args.n_samples, digits=args.digits, seed=args.seed)
-        elif task == "multiplication":
-            problems = sample_mul(args.n_samples, digits=args.digits, seed=args.seed)
-        elif task == "math":
-            if args.use_hendrycks_math:
-                print(f"  Using real Hendrycks MATH dataset...")
-                problems = sample_math_hendrycks(args.n_samples, seed=args.seed)
-            else:
-                print(f"  Using synthetic MATH problems...")
-                problems = sample_math(args.n_samples, seed=args.seed)
-        else:
-            raise ValueError(f"Unknown task: {task}")
-        
         # Use all problems as test
-        test_problems = problems
+        test_problems = load_task_problems(task, args)
         
         for goal in goals:
-            experiment_num += 1
-            print(f"\n[Experiment {experiment_num}/{total_experiments}] Task: {task}, Goal: {goal}")
+            experiments.append((task, goal, test_problems))
+    
+    if args.search_target is None and args.sparse_cells is None:
+        # Full grids share one call queue, so concurrency does not collapse
+        # at every experiment boundary
+        print(f"\nRunning {len(experiments)} experiments through one call queue")
+        print("-" * 80)
+        dfs = run_grid_experiments(
+            model=model,
+            experiments=[
+                dict(
+                    test_problems=test_problems,
+                    k_values=k_values,
+                    attacker_strengths=attacker_strengths,
+                    attacker_goals=[goal],
+                    variation=f"figure2_fast_{task}_{goal}",
+                    task=task,
+                )
+                for task, goal, test_problems in experiments
+            ],
+            **grid_kwargs,
+        )
+        results = list(zip(experiments, dfs))
+    else:
+        results = []
+        for experiment_num, (task, goal, test_problems) in enumerate(experiments, start=1):
+            print(f"\n[Experiment {experiment_num}/{len(experiments)}] Task: {task}, Goal: {goal}")
             print("-" * 80)
             
-            # Run grid experiment
-            df = run_grid_experiment(
-                model=model,
-                test_problems=test_problems,
-                k_values=k_values,
-                attacker_strengths=attacker_strengths,
-                attacker_goals=[goal],
-                variation=f"figure2_fast_{task}_{goal}",
-                variation_params={},
-                max_tokens=100,
-                deliberate_steps=None,
-                seed=args.seed,
-                output_dir=args.output_dir,
-            )
-            
-            # Store results
-            results_dict[(task, goal)] = df
-            
-            # Save individual CSV
-            csv_file = os.path.join(args.output_dir, f"figure2_fast_{task}_{goal}.csv")
-            df.to_csv(csv_file, index=False)
-            print(f"Results saved to {csv_file}")
+            search_kwargs = dict(grid_kwargs, task=task)
+            if args.search_target is not None:
+                # Bisect from the coarse grid toward where ASR crosses the target
+                df, frontier = run_boundary_search(
+                    model=model,
+                    test_problems=test_problems,
+                    k_values=k_values,
+                    attacker_strengths=attacker_strengths,
+                    attacker_goal=goal,
+                    target_asr=args.search_target,
+                    variation=f"figure2_fast_{task}_{goal}",
+                    **search_kwargs,
+                )
+                print(frontier.to_string(index=False))
+            else:
+                # Measure a Latin-hypercube subset and fit the surface to it
+                df = run_sparse_grid(
+                    model=model,
+                    test_problems=test_problems,
+                    cells=latin_hypercube_design(k_values, attacker_strengths, args.sparse_cells, seed=args.seed),
+                    attacker_goal=goal,
+                    variation=f"figure2_fast_{task}_{goal}",
+                    **search_kwargs,
+                )
+                if not df.empty:
+                    surfaces[(task, goal)] = fit_surface(df)
+            results.append(((task, goal, test_problems), df))
+    
+    for (task, goal, _), df in results:
+        # Store results
+        results_dict[(task, goal)] = df
+        
+        # Save individual CSV
+        csv_file = os.path.join(args.output_dir, f"figure2_fast_{task}_{goal}.csv")
+        df.to_csv(csv_file, index=False)
+        print(f"Results saved to {csv_file}")
     
     # Generate Figure 2
     print(f"\n{'='*80}")
@@ -172,12 +316,19 @@ def main():
         output_file=output_file,
         tasks=tasks,
         goals=goals,
+        surfaces=surfaces,
+        k_values=k_values,
+        attacker_strengths=attacker_strengths,
     )
     
     print(f"\n✓ Figure 2 (FAST) generation complete!")
     print(f"  Output: {output_file}")
     print(f"\nNote: This used smaller k values {k_values} for speed.")
     print(f"For full reproduction with k=[316, 1000, 3162, 10000], use run_figure2.py")
+    
+    if args.cache_path:
+        print(f"  Response cache: {model.cache_stats['hits']} hits, {model.cache_stats['misses']} misses "
+              f"(hit rate {model.hit_rate:.1%})")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+"""Tests for the adaptive boundary search."""
+import numpy as np
+import pandas as pd
+
+from data.gen_math import sample_add
+from eval.adaptive_search import estimate_frontier, run_boundary_search
+from models.simulated import SimulatedClient
+
+
+def test_search_bisects_toward_the_crossing(tmp_path):
+    # Every sample follows attacks of 500 tokens or more
+    model = SimulatedClient(susceptibility=lambda strength, goal: float(strength >= 500), seed=0)
+    cells, frontier = run_boundary_search(
+        model=model,
+        test_problems=sample_add(20, seed=0),
+        k_values=[1, 3],
+        attacker_strengths=[100, 10000],
+        attacker_goal="output_42",
+        max_rounds=3,
+        output_dir=str(tmp_path),
+        seed=0,
+        max_concurrency=4,
+    )
+    # Each round halves the bracket in log strength: 1000, 316, then 562
+    assert sorted(cells[cells["k"] == 1]["attacker_strength"]) == [100, 316, 562, 1000, 10000]
+    assert len(cells) == 10
+    
+    row = frontier[frontier["k"] == 1].iloc[0]
+    assert 316 < row["strength_at_target"] < 562
+    assert row["strength_low"] <= row["strength_at_target"] <= row["strength_high"]
+    assert (tmp_path / "boundary_search_frontier.csv").exists()
+
+
+def test_frontier_interpolates_in_log_strength():
+    cells = pd.DataFrame({
+        "k": [1, 1, 1, 4, 4],
+        "attacker_strength": [10, 100, 1000, 10, 1000],
+        "attack_success_rate": [0.0, 0.25, 0.75, 0.0, 0.1],
+    })
+    frontier = estimate_frontier(cells, target_asr=0.5)
+    assert np.isclose(frontier.iloc[0]["strength_at_target"], np.sqrt(100 * 1000))
+    # Without intervals the bounds collapse onto the estimate
+    assert frontier.iloc[0]["strength_low"] == frontier.iloc[0]["strength_high"] == frontier.iloc[0]["strength_at_target"]
+    # No crossing within the measured strengths
+    assert np.isnan(frontier.iloc[1]["strength_at_target"])
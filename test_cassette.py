@@ -0,0 +1,71 @@
+"""Tests for cassette record/replay."""
+import pytest
+
+from models.base import current_cell
+from models.cassette import CassetteClient, CassetteMissError, open_cassette
+from models.simulated import SimulatedClient
+from test_grid_runner import PROBLEMS, ScriptedClient
+from eval.grid_runner import run_grid_experiment
+
+
+KWARGS = dict(
+    test_problems=PROBLEMS,
+    k_values=[1, 3],
+    attacker_strengths=[100, 300],
+    attacker_goals=["output_42"],
+    seed=0,
+)
+
+
+def test_replay_matches_recording_without_backend(tmp_path):
+    path = str(tmp_path / "run.jsonl.gz")
+    
+    recorder = open_cassette(path, "record", ScriptedClient)
+    recorded = run_grid_experiment(model=recorder, output_dir=str(tmp_path / "record"), **KWARGS)
+    recorder.close()
+    
+    def no_backend():
+        raise AssertionError("replay must not build the model")
+    
+    player = open_cassette(path, "replay", no_backend)
+    replayed = run_grid_experiment(model=player, output_dir=str(tmp_path / "replay"), **KWARGS)
+    assert replayed.equals(recorded)
+    assert player.cache_stats["hits"] == len(PROBLEMS) * 2 * (1 + 3)
+
+
+def test_replay_miss_raises(tmp_path):
+    path = str(tmp_path / "run.jsonl.gz")
+    recorder = CassetteClient(ScriptedClient(), path, mode="record")
+    recorder.generate("What is 1 + 2?", max_tokens=10)
+    recorder.close()
+    
+    player = CassetteClient(None, path, mode="replay")
+    assert player.generate("What is 1 + 2?", max_tokens=10) == "3"
+    with pytest.raises(CassetteMissError):
+        # Only one sample of this request was recorded
+        player.generate("What is 1 + 2?", max_tokens=10)
+    with pytest.raises(CassetteMissError):
+        player.generate("What is 1 + 2?", max_tokens=20)
+
+
+
+def test_replay_order_across_cells_does_not_matter(tmp_path):
+    path = str(tmp_path / "run.jsonl.gz")
+    cells = [(1, 100, "output_42"), (3, 100, "output_42")]
+    
+    def draw(client, cells):
+        outputs = {}
+        for cell in cells:
+            # Workers publish the cell they sample for; both cells share the prompt
+            token = current_cell.set(cell)
+            outputs[cell] = client.generate_samples("What is 1 + 2?", n=cell[0], max_tokens=10, temperature=1.0)
+            current_cell.reset(token)
+        return outputs
+    
+    model = SimulatedClient(susceptibility=lambda strength, goal: 0.5, accuracy=0.5, seed=0)
+    recorder = CassetteClient(model, path, mode="record")
+    recorded = draw(recorder, cells)
+    recorder.close()
+    
+    # Concurrent workers may reach the cells in the other order on replay
+    assert draw(CassetteClient(None, path, mode="replay"), cells[::-1]) == recorded
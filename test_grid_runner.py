@@ -0,0 +1,403 @@
+"""Tests for the grid runner using a scripted in-process client."""
+import json
+import re
+from typing import List, Optional
+
+import pytest
+
+from models.base import LLMClient
+from eval.grid_runner import run_grid_experiment
+
+
+class ScriptedClient(LLMClient):
+    """Answers every question correctly and records how it was called."""
+    
+    model_name = "scripted"
+    
+    def __init__(self):
+        self.single_calls = 0
+        self.batch_calls = []
+        self.prefilled = []
+    
+    @property
+    def supports_deliberate(self) -> bool:
+        return False
+    
+    def generate(
+        self,
+        prompt: str,
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> str:
+        self.single_calls += 1
+        return self._answer(prompt)
+    
+    def generate_batch(
+        self,
+        prompts: List[str],
+        max_tokens: int,
+        temperature: float = 0.0,
+        stop: Optional[list[str]] = None,
+        deliberate_steps: Optional[int] = None,
+    ) -> List[str]:
+        self.batch_calls.append(len(prompts))
+        return [self._answer(prompt) for prompt in prompts]
+    
+    def prefill_prefixes(self, prefixes: List[str]) -> None:
+        self.prefilled.append(prefixes)
+    
+    @staticmethod
+    def _answer(prompt: str) -> str:
+        a, b = re.search(r"What is (\d+) \+ (\d+)\?", prompt).groups()
+        return str(int(a) + int(b))
+
+
+PROBLEMS = [("12 + 30 =", 42), ("10 + 11 =", 21), ("33 + 44 =", 77)]
+
+
+def test_sequential_run(tmp_path):
+    model = ScriptedClient()
+    df = run_grid_experiment(
+        model=model,
+        test_problems=PROBLEMS,
+        k_values=[1, 3],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    assert model.single_calls == len(PROBLEMS) * (1 + 3)
+    assert list(df["accuracy"]) == [1.0, 1.0]
+    assert list(df["attack_success_rate"]) == [0.0, 0.0]
+    assert (tmp_path / "baseline.csv").exists()
+
+
+def test_batched_run_matches_sequential(tmp_path):
+    model = ScriptedClient()
+    df = run_grid_experiment(
+        model=model,
+        test_problems=PROBLEMS,
+        k_values=[1, 3],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+        batch_size=2,
+    )
+    assert model.single_calls == 0
+    # Per cell: ceil(3 / 2) batches for each of the k samples
+    assert model.batch_calls == [2, 1] + [2, 2, 2, 1, 1, 1]
+    assert list(df["accuracy"]) == [1.0, 1.0]
+
+
+def test_nested_attack_prefixes_are_prefilled(tmp_path):
+    model = ScriptedClient()
+    run_grid_experiment(
+        model=model,
+        test_problems=PROBLEMS[:1],
+        k_values=[1],
+        attacker_strengths=[100, 500, 1000],
+        attacker_goals=["output_42", "answer_times_7"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    assert len(model.prefilled) == 2
+    for prefixes in model.prefilled:
+        assert all(prefixes[-1].startswith(prefix) for prefix in prefixes)
+
+
+def test_concurrent_run_matches_sequential(tmp_path):
+    kwargs = dict(
+        test_problems=PROBLEMS,
+        k_values=[1, 4],
+        attacker_strengths=[100, 300],
+        attacker_goals=["output_42", "answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    sequential = run_grid_experiment(model=ScriptedClient(), **kwargs)
+    
+    model = ScriptedClient()
+    concurrent = run_grid_experiment(model=model, max_concurrency=8, samples_per_call=3, **kwargs)
+    
+    assert concurrent.equals(sequential)
+    # Each k=4 problem is split into calls of 3 + 1 samples
+    assert model.single_calls == len(PROBLEMS) * 4 * (1 + 4)
+
+
+def test_batch_api_run_matches_sequential(tmp_path):
+    pytest.importorskip("openai")
+    from models.openai_client import OpenAIClient
+    from models.openai_batch import FileBatchEndpoint, OpenAIBatchRunner, responder_from_client
+    
+    kwargs = dict(
+        test_problems=PROBLEMS,
+        k_values=[1, 4],
+        attacker_strengths=[100, 300],
+        attacker_goals=["output_42", "answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    sequential = run_grid_experiment(model=ScriptedClient(), **kwargs)
+    
+    backend = ScriptedClient()
+    endpoint = FileBatchEndpoint(str(tmp_path / "endpoint"), responder_from_client(backend))
+    runner = OpenAIBatchRunner(
+        OpenAIClient(api_key="test"),
+        endpoint=endpoint,
+        poll_interval=0,
+        work_dir=str(tmp_path / "inputs"),
+    )
+    batched = run_grid_experiment(model=ScriptedClient(), batch_runner=runner, **kwargs)
+    
+    assert batched.equals(sequential)
+    assert len(endpoint.batch_records) == 1
+    # The budget could only be checked after every batch was paid for
+    with pytest.raises(ValueError):
+        run_grid_experiment(model=ScriptedClient(), batch_runner=runner, max_cost=1.0, **kwargs)
+    # One n-choice request per (cell, problem)
+    input_file = next((tmp_path / "inputs").glob("batch_input_*"))
+    assert len(input_file.read_text().splitlines()) == 2 * 2 * 2 * len(PROBLEMS)
+    assert backend.single_calls == len(PROBLEMS) * 4 * (1 + 4)
+
+
+def test_batch_api_splits_inputs_by_size_and_enqueued_tokens(tmp_path):
+    pytest.importorskip("openai")
+    from models.openai_client import OpenAIClient
+    from models.openai_batch import FileBatchEndpoint, OpenAIBatchRunner, responder_from_client
+    
+    endpoint = FileBatchEndpoint(str(tmp_path / "endpoint"), responder_from_client(ScriptedClient()))
+    unfinished_at_submit = []
+    create_batch = endpoint.batches.create
+    
+    def create(**kwargs):
+        unfinished_at_submit.append(sum(batch.status != "completed" for batch in endpoint.batch_records.values()))
+        return create_batch(**kwargs)
+    
+    endpoint.batches.create = create
+    runner = OpenAIBatchRunner(
+        OpenAIClient(api_key="test"),
+        endpoint=endpoint,
+        poll_interval=0,
+        work_dir=str(tmp_path / "inputs"),
+        max_batch_bytes=2400,
+        max_enqueued_tokens=1000,
+    )
+    calls = [{"prompt": f"What is {question.rstrip(' =')}?", "n": 1} for question, _ in PROBLEMS * 10]
+    results = []
+    runner.run_calls(calls, on_result=lambda call, outputs: results.append(outputs), max_tokens=100)
+    
+    assert len(results) == len(calls)
+    inputs = list((tmp_path / "inputs").glob("batch_input_*"))
+    assert len(inputs) > 1
+    assert all(input_file.stat().st_size <= 2400 for input_file in inputs)
+    # No batch is enqueued while another one is, as two would exceed the token limit
+    assert unfinished_at_submit == [0] * len(inputs)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_interrupted_batch_api_run_reattaches_to_submitted_batches(tmp_path):
+    pytest.importorskip("openai")
+    from models.openai_client import OpenAIClient
+    from models.openai_batch import FileBatchEndpoint, OpenAIBatchRunner, responder_from_client
+    
+    kwargs = dict(
+        test_problems=PROBLEMS,
+        k_values=[1, 3],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    endpoint = FileBatchEndpoint(str(tmp_path / "endpoint"), responder_from_client(ScriptedClient()))
+    retrieve = endpoint.batches.retrieve
+    polls = []
+    
+    def interrupted_retrieve(batch_id):
+        # Dies while polling the second batch, after the first one was delivered
+        polls.append(batch_id)
+        if len(set(polls)) == 2:
+            raise Interrupted
+        return retrieve(batch_id)
+    
+    endpoint.batches.retrieve = interrupted_retrieve
+    runner = OpenAIBatchRunner(
+        OpenAIClient(api_key="test"),
+        endpoint=endpoint,
+        poll_interval=0,
+        work_dir=str(tmp_path / "inputs"),
+        max_enqueued_tokens=300,
+    )
+    with pytest.raises(Interrupted):
+        run_grid_experiment(model=ScriptedClient(), batch_runner=runner, **kwargs)
+    
+    # The first batch was journaled as soon as it finished, while the second was in flight
+    assert len((tmp_path / "baseline.journal.jsonl").read_text().splitlines()) == 2
+    assert len(endpoint.batch_records) == 2
+    
+    endpoint.batches.retrieve = retrieve
+    df = run_grid_experiment(model=ScriptedClient(), batch_runner=runner, resume=True, **kwargs)
+    assert list(df["accuracy"]) == [1.0, 1.0]
+    # One request per (cell, problem), each submitted exactly once across both runs
+    inputs = list((tmp_path / "inputs").glob("batch_input_*"))
+    assert sum(len(input_file.read_text().splitlines()) for input_file in inputs) == 2 * len(PROBLEMS)
+
+
+class InterruptedClient(ScriptedClient):
+    """ScriptedClient that dies after a fixed number of calls."""
+    
+    def __init__(self, calls_before_interrupt: int):
+        super().__init__()
+        self.calls_before_interrupt = calls_before_interrupt
+    
+    def generate(self, prompt, max_tokens, temperature=0.0, stop=None, deliberate_steps=None):
+        if self.single_calls == self.calls_before_interrupt:
+            raise Interrupted
+        return super().generate(prompt, max_tokens, temperature, stop, deliberate_steps)
+
+
+@pytest.mark.parametrize("max_concurrency", [None, 2])
+def test_interrupted_run_resumes_from_journal(tmp_path, max_concurrency):
+    kwargs = dict(
+        test_problems=PROBLEMS,
+        k_values=[1, 3],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+        max_concurrency=max_concurrency,
+        samples_per_call=1,
+    )
+    with pytest.raises(Interrupted):
+        run_grid_experiment(model=InterruptedClient(5), **kwargs)
+    
+    journal_lines = (tmp_path / "baseline.journal.jsonl").read_text().splitlines()
+    journaled_samples = sum(len(json.loads(line)["outputs"]) for line in journal_lines[1:])
+    assert 0 < journaled_samples <= 5
+    
+    model = ScriptedClient()
+    df = run_grid_experiment(model=model, resume=True, **kwargs)
+    assert model.single_calls == len(PROBLEMS) * (1 + 3) - journaled_samples
+    assert list(df["accuracy"]) == [1.0, 1.0]
+    
+    # A resume against different problems is refused
+    with pytest.raises(ValueError):
+        run_grid_experiment(model=ScriptedClient(), resume=True, **{**kwargs, "test_problems": PROBLEMS[:2]})
+
+
+class InterruptedBatchClient(ScriptedClient):
+    """ScriptedClient whose batched generation dies after a fixed number of batches."""
+    
+    def __init__(self, batches_before_interrupt: int):
+        super().__init__()
+        self.batches_before_interrupt = batches_before_interrupt
+    
+    def generate_batch(self, prompts, max_tokens, temperature=0.0, stop=None, deliberate_steps=None):
+        if len(self.batch_calls) == self.batches_before_interrupt:
+            raise Interrupted
+        return super().generate_batch(prompts, max_tokens, temperature, stop, deliberate_steps)
+
+
+def test_interrupted_batched_run_resumes_per_chunk(tmp_path):
+    kwargs = dict(
+        test_problems=PROBLEMS,
+        k_values=[3],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    # Dies in the second chunk of the cell, after the first was journaled
+    with pytest.raises(Interrupted):
+        run_grid_experiment(model=InterruptedBatchClient(4), batch_size=2, **kwargs)
+    assert len((tmp_path / "baseline.journal.jsonl").read_text().splitlines()) == 1 + 2
+    
+    model = ScriptedClient()
+    df = run_grid_experiment(model=model, batch_size=2, resume=True, **kwargs)
+    assert model.batch_calls == [1, 1, 1]
+    assert list(df["accuracy"]) == [1.0]
+    
+    # Problems journaled in part by a concurrent run only draw their missing samples
+    with pytest.raises(Interrupted):
+        run_grid_experiment(model=InterruptedClient(4), max_concurrency=2, samples_per_call=1, **kwargs)
+    journal_lines = (tmp_path / "baseline.journal.jsonl").read_text().splitlines()
+    journaled_samples = sum(len(json.loads(line)["outputs"]) for line in journal_lines[1:])
+    
+    model = ScriptedClient()
+    df = run_grid_experiment(model=model, batch_size=2, resume=True, **kwargs)
+    assert sum(model.batch_calls) == len(PROBLEMS) * 3 - journaled_samples
+    assert df.attrs["usage"]["samples"] == len(PROBLEMS) * 3
+    assert list(df["accuracy"]) == [1.0]
+
+
+@pytest.mark.parametrize("reuse_samples", ["prefix", "subsets"])
+def test_reused_max_k_draw_covers_every_k(tmp_path, reuse_samples):
+    model = ScriptedClient()
+    df = run_grid_experiment(
+        model=model,
+        test_problems=PROBLEMS,
+        k_values=[1, 2, 4],
+        attacker_strengths=[100, 200],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+        reuse_samples=reuse_samples,
+    )
+    # max(k) samples per problem instead of sum(k)
+    assert model.single_calls == 2 * len(PROBLEMS) * 4
+    assert sorted(df["k"]) == [1, 1, 2, 2, 4, 4]
+    assert (df["accuracy"] == 1.0).all()
+
+
+@pytest.mark.parametrize("max_concurrency", [None, 4])
+def test_adaptive_sampling_stops_once_vote_is_decided(tmp_path, max_concurrency):
+    kwargs = dict(
+        test_problems=PROBLEMS,
+        k_values=[16],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+        max_concurrency=max_concurrency,
+        adaptive_step=2,
+    )
+    model = ScriptedClient()
+    df = run_grid_experiment(model=model, **kwargs)
+    # 9 unanimous samples out of 16 cannot be outvoted
+    assert model.single_calls == len(PROBLEMS) * 9
+    assert list(df["mean_samples"]) == [9.0]
+    assert list(df["accuracy"]) == [1.0]
+    
+    model = ScriptedClient()
+    df = run_grid_experiment(model=model, stop_confidence=0.95, **kwargs)
+    assert model.single_calls < len(PROBLEMS) * 9
+    assert list(df["accuracy"]) == [1.0]
+
+
+@pytest.mark.parametrize("max_concurrency", [None, 4])
+def test_cell_stops_once_sprt_decides(tmp_path, max_concurrency):
+    problems = [(f"{a} + 1 =", a + 1) for a in range(10, 70)]
+    model = ScriptedClient()
+    df = run_grid_experiment(
+        model=model,
+        test_problems=problems,
+        k_values=[1],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+        max_concurrency=max_concurrency,
+        sprt_threshold=0.5,
+    )
+    # Every vote is a failed attack, so the cell is decided well before 60 problems
+    n_problems = int(df["n_problems"].iloc[0])
+    assert 10 <= n_problems < len(problems)
+    assert model.single_calls < len(problems)
+    assert list(df["sprt_decision"]) == ["below"]
+    assert list(df["attack_success_rate"]) == [0.0]
+    assert df["asr_ci_low"].iloc[0] == 0.0 < df["asr_ci_high"].iloc[0] < 0.5
@@ -0,0 +1,277 @@
+"""Tests for OpenAIClient against a local OpenAI-compatible stand-in server."""
+import asyncio
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("openai")
+
+from eval.executor import run_calls
+from models.openai_client import OpenAIClient
+
+
+class StandInServer:
+    """Minimal chat.completions endpoint that answers 'What is a + b?' correctly."""
+    
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def respond(self, body: dict):
+        """Return (status, headers, payload) for a request body."""
+        prompt = body["messages"][-1]["content"]
+        match = re.search(r"What is (\d+) \+ (\d+)\?", prompt)
+        answer = str(int(match.group(1)) + int(match.group(2))) if match else "0"
+        n = body.get("n") or 1
+        return 200, {}, {
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {"index": i, "finish_reason": "stop", "message": {"role": "assistant", "content": answer}}
+                for i in range(n)
+            ],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": n, "total_tokens": len(prompt) // 4 + n},
+        }
+    
+    def _handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server._lock:
+                    server.requests.append(body)
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    time.sleep(server.delay)
+                    status, headers, payload = server.respond(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def log_message(self, *args):
+                pass
+        
+        return Handler
+
+
+def test_generate_against_stand_in():
+    with StandInServer() as server:
+        model = OpenAIClient(model_name="gpt-4o-mini", api_key="test", base_url=server.base_url)
+        assert model.generate("What is 2 + 3?", max_tokens=5) == "5"
+        assert server.requests[0]["max_tokens"] == 5
+
+
+def test_async_samples_respect_concurrency_limit():
+    with StandInServer(delay=0.05) as server:
+        model = OpenAIClient(model_name="o1-mini", api_key="test", base_url=server.base_url, max_concurrency=4)
+        
+        async def main():
+            outputs = await model.agenerate_samples("What is 20 + 22?", n=12, max_tokens=10)
+            await model.aclose()
+            return outputs
+        
+        outputs = asyncio.run(main())
+        assert outputs == ["42"] * 12
+        assert len(server.requests) == 12
+        assert server.max_in_flight <= 4
+        # Reasoning models get max_completion_tokens and no temperature
+        assert "temperature" not in server.requests[0]
+
+
+def test_samples_use_n_in_chunks(monkeypatch):
+    monkeypatch.setattr("models.openai_client.MAX_CHOICES_PER_REQUEST", 4)
+    with StandInServer() as server:
+        model = OpenAIClient(model_name="gpt-4o-mini", api_key="test", base_url=server.base_url)
+        outputs = model.generate_samples("What is 1 + 1?", n=10, max_tokens=5, temperature=0.7)
+        assert outputs == ["2"] * 10
+        assert sorted(body.get("n", 1) for body in server.requests) == [2, 4, 4]
+        
+        server.requests.clear()
+        outputs = asyncio.run(model.agenerate_samples("What is 1 + 2?", n=9, max_tokens=5, temperature=0.7))
+        assert outputs == ["3"] * 9
+        assert sorted(body.get("n", 1) for body in server.requests) == [1, 4, 4]
+
+
+def test_reasoning_model_samples_fall_back_to_single_requests():
+    with StandInServer() as server:
+        model = OpenAIClient(model_name="o3-mini", api_key="test", base_url=server.base_url)
+        outputs = model.generate_samples("What is 4 + 4?", n=5, max_tokens=5)
+        assert outputs == ["8"] * 5
+        assert len(server.requests) == 5
+        assert all("n" not in body for body in server.requests)
+
+
+class RateLimitedServer(StandInServer):
+    """Answers 429 with a short Retry-After to the first few requests."""
+    
+    def __init__(self, rejections: int):
+        super().__init__()
+        self.rejections = rejections
+    
+    def respond(self, body: dict):
+        with self._lock:
+            reject = self.rejections > 0
+            self.rejections -= 1
+        if reject:
+            return 429, {"retry-after-ms": "20"}, {"error": {"message": "Rate limit reached", "type": "requests"}}
+        status, headers, payload = super().respond(body)
+        return status, {"x-ratelimit-remaining-requests": "99", "x-ratelimit-remaining-tokens": "9000"}, payload
+
+
+def test_rate_limited_requests_are_retried_and_counted():
+    with RateLimitedServer(rejections=2) as server:
+        model = OpenAIClient(model_name="gpt-4o-mini", api_key="test", base_url=server.base_url, rpm=600, tpm=100000)
+        assert model.generate("What is 2 + 3?", max_tokens=5) == "5"
+        
+        stats = model.rate_limiter.rate_limit_stats
+        assert stats["rate_limited"] == 2
+        assert stats["retries"] == 2
+        assert stats["backoff_seconds"] == pytest.approx(0.04)
+        # Two halvings of the adaptive concurrency limit, then one additive step
+        assert model.rate_limiter.concurrency_limit < 64 / 4 + 1
+        # Buckets follow the server's remaining-quota headers
+        assert model.rate_limiter.requests.level <= 99
+        assert model.rate_limiter.tokens.level <= 9000
+        
+        server.rejections = 1
+        assert asyncio.run(model.agenerate_samples("What is 1 + 1?", n=3, max_tokens=5)) == ["2"] * 3
+        assert stats["rate_limited"] == 3
+        assert model.rate_limiter.in_flight == 0
+
+
+def test_token_bucket_paces_requests():
+    from models.rate_limit import RateLimiter
+    
+    limiter = RateLimiter(tpm=6000)
+    assert limiter.try_acquire(6000) == 0
+    limiter.on_success(estimated_tokens=6000, used_tokens=5000)
+    # 1000 unused tokens were refunded; 1500 more need another 5 seconds at 100/s
+    assert limiter.try_acquire(1500) == pytest.approx(5.0, abs=0.1)
+
+
+def test_usage_is_reported_and_budget_stops_run(tmp_path):
+    from eval.grid_runner import run_grid_experiment
+    
+    with StandInServer() as server:
+        model = OpenAIClient(model_name="gpt-4o-mini", api_key="test", base_url=server.base_url)
+        samples = model.generate_samples("What is 2 + 3?", n=3, max_tokens=5, temperature=0.7)
+        # The prompt is billed once per request; completion tokens are split across choices
+        assert [s.prompt_tokens for s in samples] == [len("What is 2 + 3?") // 4, 0, 0]
+        assert [s.completion_tokens for s in samples] == [1, 1, 1]
+        assert all(s.latency > 0 for s in samples)
+        
+        kwargs = dict(
+            model=model,
+            test_problems=[("12 + 30 =", 42), ("10 + 11 =", 21)],
+            k_values=[1, 3],
+            attacker_strengths=[100],
+            attacker_goals=["answer_plus_1"],
+            seed=0,
+            output_dir=str(tmp_path),
+        )
+        full = run_grid_experiment(**kwargs)
+        assert not full.attrs["stopped_early"]
+        assert list(full["completion_tokens"]) == [2, 6]
+        assert (full["cost_usd"] > 0).all()
+        
+        # Enough tokens for the k=1 cell but not the k=3 one
+        budget = int(full["prompt_tokens"].iloc[0] + full["completion_tokens"].iloc[0]) + 10
+        partial = run_grid_experiment(max_total_tokens=budget, **kwargs)
+        assert partial.attrs["stopped_early"]
+        assert list(partial["k"]) == [1]
+
+
+def test_saturated_limiter_wakes_waiters_on_release_instead_of_polling():
+    from models.rate_limit import RateLimiter
+    
+    limiter = RateLimiter(max_concurrency=2)
+    attempts = []
+    try_acquire = limiter._try_acquire
+    limiter._try_acquire = lambda tokens: attempts.append(tokens) or try_acquire(tokens)
+    in_flight = []
+    
+    async def request():
+        await limiter.aacquire(1)
+        in_flight.append(limiter.in_flight)
+        await asyncio.sleep(0.02)
+        limiter.on_success()
+    
+    async def main():
+        await asyncio.gather(*(request() for _ in range(20)))
+    
+    asyncio.run(main())
+    assert max(in_flight) <= 2 and limiter.in_flight == 0
+    # One attempt each, plus one per wake-up; polling every 5 ms would take hundreds
+    assert len(attempts) <= 3 * 20
+    
+    def blocking_request():
+        limiter.acquire(1)
+        time.sleep(0.02)
+        limiter.on_success()
+    
+    attempts.clear()
+    threads = [threading.Thread(target=blocking_request) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.in_flight == 0
+    assert len(attempts) <= 3 * 10
+
+
+def test_async_clients_are_closed_with_their_event_loop():
+    with StandInServer() as server:
+        model = OpenAIClient(model_name="gpt-4o-mini", api_key="test", base_url=server.base_url)
+        calls = [{"prompt": "What is 20 + 22?", "n": 2}]
+        results = []
+        run_calls(model, calls, max_concurrency=2, on_result=lambda call, outputs: results.append(outputs))
+        assert results == [["42", "42"]]
+        assert model._async_client is None
+        
+        # A loop that ends without aclose() leaves its client behind for the next one to close
+        asyncio.run(model.agenerate_samples("What is 20 + 22?", n=1, max_tokens=10))
+        stale = model._async_client
+        
+        async def main():
+            outputs = await model.agenerate_samples("What is 20 + 22?", n=1, max_tokens=10)
+            await asyncio.sleep(0)
+            await model.aclose()
+            return outputs
+        
+        assert asyncio.run(main()) == ["42"]
+        assert stale.is_closed()
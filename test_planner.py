@@ -0,0 +1,92 @@
+"""Tests for the pre-run execution planner."""
+import os
+import subprocess
+import sys
+
+from data.gen_math import sample_add
+from eval.planner import plan_grid, problems_for_ci_width, summarize_plan
+
+
+def test_plan_counts_every_sample_of_every_k():
+    plan = plan_grid(
+        test_problems=sample_add(10, seed=0),
+        k_values=[1, 200],
+        attacker_strengths=[100, 1000],
+        attacker_goals=["output_42"],
+        model_name="gpt-4o-mini",
+        seed=0,
+    )
+    assert plan["samples"].sum() == 2 * 10 * (1 + 200)
+    # 200 samples take two requests of at most 128
+    assert plan["calls"].sum() == 2 * 10 * (1 + 2)
+    assert (plan["cost_usd"] > 0).all()
+    assert not plan["exceeds_context"].any()
+    # Longer attacks make longer prompts
+    by_strength = plan.groupby("attacker_strength")["prompt_tokens"].max()
+    assert by_strength[1000] > 5 * by_strength[100]
+    
+    reused = plan_grid(
+        test_problems=sample_add(10, seed=0),
+        k_values=[1, 200],
+        attacker_strengths=[100, 1000],
+        attacker_goals=["output_42"],
+        model_name="gpt-4o-mini",
+        reuse_samples="prefix",
+        seed=0,
+    )
+    assert reused["samples"].sum() == 2 * 10 * 200
+
+
+def test_reasoning_models_take_one_request_per_sample():
+    plan = plan_grid(
+        test_problems=sample_add(10, seed=0),
+        k_values=[1000],
+        attacker_strengths=[100],
+        attacker_goals=["output_42"],
+        model_name="o1-mini",
+        seed=0,
+    )
+    assert plan["calls"].sum() == plan["samples"].sum() == 10 * 1000
+    # OpenAIClient reserves max(2 * max_tokens, 500) completion tokens for reasoning
+    assert plan["total_completion_tokens"].sum() == 10 * 1000 * 500
+    # 10,000 requests at 1000 per minute
+    assert summarize_plan(plan, max_concurrency=1000, rpm=1000)["wall_time_s"] == 600.0
+
+
+def test_plan_flags_prompts_beyond_the_context_window():
+    plan = plan_grid(
+        test_problems=sample_add(3, seed=0),
+        k_values=[1],
+        attacker_strengths=[1000, 10000],
+        attacker_goals=["output_42"],
+        model_name="microsoft/Phi-3-mini-4k-instruct",
+        seed=0,
+    )
+    assert list(plan["exceeds_context"]) == [False, True]
+    assert plan["cost_usd"].isna().all()
+
+
+def test_summary_projects_wall_time_and_sample_size():
+    plan = plan_grid(
+        test_problems=sample_add(10, seed=0),
+        k_values=[4],
+        attacker_strengths=[100],
+        attacker_goals=["output_42"],
+        model_name="gpt-4o-mini",
+    )
+    fast = summarize_plan(plan, max_concurrency=10)
+    assert fast["calls"] == 10 and fast["samples"] == 40
+    assert fast["wall_time_s"] < summarize_plan(plan)["wall_time_s"]
+    # One request per second at most
+    assert summarize_plan(plan, max_concurrency=10, rpm=60)["wall_time_s"] == 10.0
+    
+    assert problems_for_ci_width(0.1) == 385
+    assert problems_for_ci_width(0.1, asr=0.1) < 385
+
+
+def test_planning_loads_no_model_backend():
+    check = (
+        "import sys, eval.planner; "
+        "sys.exit(any(name in sys.modules for name in ('torch', 'transformers', 'openai')))"
+    )
+    assert subprocess.run([sys.executable, "-c", check], cwd=os.path.dirname(os.path.abspath(__file__))).returncode == 0
@@ -2,10 +2,12 @@
 import os
 from dotenv import load_dotenv
 from models.openai_client import OpenAIClient
+from models.cassette import cassette_from_env
 
 load_dotenv()
 
-model = OpenAIClient(model_name="o1", api_key=os.getenv("OPENAI_API_KEY"))
+# Set CASSETTE_MODE=record/replay (and CASSETTE_PATH) to record or replay responses offline
+model = cassette_from_env(lambda: OpenAIClient(model_name="o1", api_key=os.getenv("OPENAI_API_KEY")))
 
 prompt = "What is 2 + 2? Write a single number as the answer."
 
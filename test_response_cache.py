@@ -0,0 +1,74 @@
+"""Tests for the SQLite response cache wrapper."""
+import asyncio
+
+from models.cache import CachedClient
+from test_grid_runner import PROBLEMS, ScriptedClient
+from eval.grid_runner import run_grid_experiment
+
+
+class CountingClient(ScriptedClient):
+    """Scripted client whose answers carry a call counter, so samples are distinguishable."""
+    
+    model_name = "counting"
+    
+    def generate(self, prompt, max_tokens, temperature=0.0, stop=None, deliberate_steps=None):
+        self.single_calls += 1
+        return f"{self._answer(prompt)} #{self.single_calls}"
+
+
+def test_rerun_is_served_from_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    kwargs = dict(
+        test_problems=PROBLEMS,
+        k_values=[1, 3],
+        attacker_strengths=[100],
+        attacker_goals=["answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    first = CachedClient(ScriptedClient(), path=path)
+    df_first = run_grid_experiment(model=first, **kwargs)
+    assert first.cache_stats["hits"] == 0
+    first.close()
+    
+    backend = ScriptedClient()
+    second = CachedClient(backend, path=path)
+    df_second = run_grid_experiment(model=second, **kwargs)
+    assert backend.single_calls == 0
+    assert second.hit_rate == 1.0
+    assert df_second.equals(df_first)
+
+
+def test_samples_are_indexed_and_extended(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    prompt = "What is 1 + 2?"
+    
+    first = CachedClient(CountingClient(), path=path)
+    samples = first.generate_samples(prompt, n=3, max_tokens=10, temperature=0.7)
+    # Repeated samples of one request are cached separately, not collapsed
+    assert len(set(samples)) == 3
+    first.close()
+    
+    backend = CountingClient()
+    second = CachedClient(backend, path=path)
+    more = second.generate_samples(prompt, n=5, max_tokens=10, temperature=0.7)
+    assert more[:3] == samples
+    assert backend.single_calls == 2
+    
+    # A different temperature is a different request
+    third = asyncio.run(second.agenerate_samples(prompt, n=1, max_tokens=10, temperature=0.0))
+    assert third == ["3 #3"]
+
+
+def test_lru_eviction_respects_size_cap(tmp_path):
+    client = CachedClient(CountingClient(), path=str(tmp_path / "cache.sqlite"), max_bytes=200)
+    for a in range(20):
+        client.generate(f"What is {a} + 1?", max_tokens=10)
+    stored = client._db.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses").fetchone()
+    assert stored[0] <= 200
+    assert client.cache_stats["evictions"] == 20 - stored[1]
+    # The most recent response survived eviction, the oldest did not
+    reopened = CachedClient(CountingClient(), path=str(tmp_path / "cache.sqlite"), max_bytes=200)
+    reopened.generate("What is 19 + 1?", max_tokens=10)
+    reopened.generate("What is 0 + 1?", max_tokens=10)
+    assert reopened.cache_stats["hits"] == 1
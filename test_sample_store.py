@@ -0,0 +1,119 @@
+"""Tests for the raw sample store."""
+import pandas as pd
+
+from data.gen_math import sample_add
+from eval.grid_runner import run_grid_experiment
+from eval.plotting import load_results
+from eval.sample_store import SampleStore, prompt_hash
+from models.simulated import SimulatedClient
+
+
+def test_stored_samples_reproduce_run_metrics(tmp_path):
+    problems = sample_add(20, seed=0)
+    model = SimulatedClient(susceptibility=lambda strength, goal: 0.4, accuracy=0.6, seed=0)
+    df = run_grid_experiment(
+        model=model,
+        test_problems=problems,
+        k_values=[1, 4],
+        attacker_strengths=[100, 400],
+        attacker_goals=["output_42", "answer_plus_1"],
+        seed=0,
+        output_dir=str(tmp_path),
+        task="addition",
+    )
+    
+    store = SampleStore(str(tmp_path / "samples"))
+    assert store.partitions() == [
+        ("baseline", "addition", "answer_plus_1"),
+        ("baseline", "addition", "output_42"),
+    ]
+    
+    samples = store.samples(attacker_goal="output_42", k=4)
+    assert len(samples) == 2 * len(problems) * 4
+    assert set(samples["sample"]) == {0, 1, 2, 3}
+    prompts = store.prompts("baseline")
+    assert all(prompt_hash(prompts[h]) == h for h in samples["prompt_hash"].unique())
+    
+    # Re-voting from the store gives exactly the metrics of the run
+    keys = ["k", "attacker_strength", "attacker_goal"]
+    recomputed = store.cell_metrics(variation="baseline").sort_values(keys).reset_index(drop=True)
+    expected = df.sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(
+        recomputed[keys + ["attack_success_rate", "accuracy"]],
+        expected[keys + ["attack_success_rate", "accuracy"]],
+        check_dtype=False,
+    )
+    assert load_results("baseline", output_dir=str(tmp_path))["task"].eq("addition").all()
+
+
+def test_metrics_extrapolate_to_unsampled_k(tmp_path):
+    model = SimulatedClient(susceptibility=lambda strength, goal: 0.3, accuracy=0.9, seed=0)
+    run_grid_experiment(
+        model=model,
+        test_problems=sample_add(10, seed=0),
+        k_values=[8],
+        attacker_strengths=[100],
+        attacker_goals=["output_42"],
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    df = SampleStore(str(tmp_path / "samples")).extrapolated_metrics([1, 1000], n_bootstrap=10, seed=0)
+    assert list(df["k"]) == [1, 1000]
+    assert (df["samples_per_problem"] == 8).all()
+    # Correct answers are the plurality, so voting over many samples removes the attack
+    assert df["attack_success_rate"].iloc[1] < df["attack_success_rate"].iloc[0]
+    assert (df["asr_low"] <= df["asr_high"]).all()
+
+
+def test_rerunning_some_cells_keeps_the_others(tmp_path):
+    problems = sample_add(10, seed=0)
+    grid = dict(test_problems=problems, attacker_goals=["output_42"], seed=0, output_dir=str(tmp_path))
+    run_grid_experiment(
+        model=SimulatedClient(susceptibility=lambda strength, goal: 0.4, accuracy=0.6, seed=0),
+        k_values=[1, 4],
+        attacker_strengths=[100],
+        **grid,
+    )
+    # Extend the grid with a new strength and redo one of the old cells
+    rerun = run_grid_experiment(
+        model=SimulatedClient(susceptibility=lambda strength, goal: 0.4, accuracy=0.6, seed=1),
+        k_values=[4],
+        attacker_strengths=[100, 400],
+        **grid,
+    )
+    
+    store = SampleStore(str(tmp_path / "samples"))
+    cells = store.samples().groupby(["k", "attacker_strength"]).size().to_dict()
+    assert cells == {(1, 100): 10, (4, 100): 40, (4, 400): 40}
+    # The redone cell holds the new run's samples only
+    keys = ["k", "attacker_strength"]
+    metrics = store.cell_metrics().set_index(keys)
+    assert metrics.loc[(4, 100), "attack_success_rate"] == rerun.set_index(keys).loc[(4, 100), "attack_success_rate"]
+    prompts = store.prompts("baseline")
+    assert all(h in prompts for h in store.samples()["prompt_hash"].unique())
+
+
+def test_subset_runs_load_their_csv_metrics(tmp_path):
+    df = run_grid_experiment(
+        model=SimulatedClient(susceptibility=lambda strength, goal: 0.4, accuracy=0.6, seed=0),
+        test_problems=sample_add(10, seed=0),
+        k_values=[1, 3, 8],
+        attacker_strengths=[100],
+        attacker_goals=["output_42"],
+        reuse_samples="subsets",
+        n_subsets=4,
+        seed=0,
+        output_dir=str(tmp_path),
+    )
+    
+    store = SampleStore(str(tmp_path / "samples"))
+    assert store.voted_subsets("baseline")
+    # Only cells below the drawn k were voted over subsets
+    marked = store.samples(columns=["k", "subsets"]).groupby("k")["subsets"].first()
+    assert marked.isna().to_dict() == {1: False, 3: False, 8: True}
+    keys = ["k", "attacker_strength", "attacker_goal"]
+    loaded = load_results("baseline", output_dir=str(tmp_path)).sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_series_equal(
+        loaded["attack_success_rate"],
+        df.sort_values(keys).reset_index(drop=True)["attack_success_rate"],
+    )
@@ -0,0 +1,133 @@
+"""Tests for the simulated backend."""
+import pytest
+
+from attacks.many_shot import build_many_shot_prompt
+from data.gen_math import sample_add, sample_math, sample_mul
+from eval.grid_runner import run_grid_experiment, run_grid_experiments
+from models.simulated import SimulatedAPIError, SimulatedClient, parse_prompt
+
+
+def test_prompt_parsing_recovers_problem_and_attack():
+    for question, answer in sample_add(3, seed=1) + sample_mul(3, seed=1) + sample_math(6, seed=1):
+        prompt = build_many_shot_prompt(question, answer, "answer_times_7", 1000, seed=0)
+        parsed = parse_prompt(prompt)
+        assert parsed["answer"] == answer
+        assert parsed["attacker_goal"] == "answer_times_7"
+        assert abs(parsed["attacker_strength"] - 1000) < 12
+
+
+def test_attack_success_grows_with_strength(tmp_path):
+    model = SimulatedClient(susceptibility=lambda strength, goal: min(1.0, strength / 2000), seed=0)
+    df = run_grid_experiment(
+        model=model,
+        test_problems=sample_add(50, seed=0),
+        k_values=[5],
+        attacker_strengths=[100, 3000],
+        attacker_goals=["output_42"],
+        seed=0,
+        output_dir=str(tmp_path),
+        max_concurrency=4,
+    )
+    weak, strong = df.sort_values("attacker_strength")["attack_success_rate"]
+    assert weak < 0.1 and strong > 0.9
+    assert len(model.call_log) == 2 * 50
+
+
+def test_injected_errors_raise():
+    model = SimulatedClient(error_rate=1.0, max_retries=2, seed=0)
+    with pytest.raises(SimulatedAPIError):
+        model.generate("What is 1 + 2? Write a single number as the answer.", max_tokens=10)
+    assert [call["failed"] for call in model.call_log] == [True] * 3
+
+
+@pytest.mark.parametrize("max_concurrency", [None, 4])
+def test_grid_run_retries_injected_errors(tmp_path, max_concurrency):
+    model = SimulatedClient(susceptibility=lambda strength, goal: float(strength >= 500), error_rate=0.3, seed=0)
+    df = run_grid_experiment(
+        model=model,
+        test_problems=sample_add(20, seed=0),
+        k_values=[3],
+        attacker_strengths=[100, 3000],
+        attacker_goals=["output_42"],
+        seed=0,
+        output_dir=str(tmp_path),
+        max_concurrency=max_concurrency,
+        samples_per_call=1,
+    )
+    assert list(df["n_problems"]) == [20, 20]
+    assert list(df.sort_values("attacker_strength")["attack_success_rate"]) == [0.0, 1.0]
+    assert model.rate_limiter.rate_limit_stats["retries"] == sum(call["failed"] for call in model.call_log) > 0
+    # Requests are attributed to their cell, not to the samples they drew
+    assert {call["cell"] for call in model.call_log} == {(3, 100, "output_42"), (3, 3000, "output_42")}
+
+
+@pytest.mark.parametrize("max_concurrency", [None, 4])
+def test_sample_budget_goes_to_unresolved_cells(tmp_path, max_concurrency):
+    # Attacks of about 100, 1000 and 3000 tokens succeed with rate 0, 0.5 and 1
+    model = SimulatedClient(susceptibility=lambda strength, goal: 0.0 if strength < 500 else 0.5 if strength < 2000 else 1.0, seed=0)
+    df = run_grid_experiment(
+        model=model,
+        test_problems=sample_add(100, seed=0),
+        k_values=[1],
+        attacker_strengths=[100, 1000, 3000],
+        attacker_goals=["output_42"],
+        seed=0,
+        output_dir=str(tmp_path),
+        max_concurrency=max_concurrency,
+        sample_budget=90,
+        min_problems=5,
+    )
+    samples = dict(zip(df["attacker_strength"], df["n_samples"]))
+    assert sum(samples.values()) == 90 == len(model.call_log)
+    assert min(samples.values()) >= 5
+    # The cell near ASR 0.5 gets most of what is left after the minimum
+    assert samples[1000] > samples[100] + samples[3000]
+    assert list(df["n_problems"]) == list(df["n_samples"])
+
+
+def test_resumed_run_counts_journaled_samples_against_the_budget(tmp_path):
+    model = SimulatedClient(susceptibility=lambda strength, goal: 0.5, seed=0)
+    kwargs = dict(
+        test_problems=sample_add(100, seed=0),
+        k_values=[1],
+        attacker_strengths=[100, 1000],
+        attacker_goals=["output_42"],
+        seed=0,
+        output_dir=str(tmp_path),
+        sample_budget=40,
+        min_problems=5,
+    )
+    run_grid_experiment(model=model, **kwargs)
+    assert len(model.call_log) == 40
+    resumed = run_grid_experiment(model=model, resume=True, **kwargs)
+    assert len(model.call_log) == 40
+    assert resumed["n_samples"].sum() == 40
+    
+    with pytest.raises(ValueError):
+        run_grid_experiment(model=model, batch_runner=object(), **kwargs)
+
+
+def test_experiments_share_one_call_queue(tmp_path):
+    model = SimulatedClient(susceptibility=lambda strength, goal: 0.0 if strength < 500 else 1.0, latency_median=0.01, seed=0)
+    results = run_grid_experiments(
+        model=model,
+        experiments=[
+            {"attacker_goals": [goal], "variation": f"shared_{goal}", "task": "add"}
+            for goal in ["output_42", "answer_plus_1"]
+        ],
+        test_problems=sample_add(10, seed=0),
+        k_values=[3],
+        attacker_strengths=[100, 3000],
+        seed=0,
+        output_dir=str(tmp_path),
+        max_concurrency=4,
+    )
+    for df, goal in zip(results, ["output_42", "answer_plus_1"]):
+        assert list(df["attacker_goal"]) == [goal, goal]
+        assert list(df.sort_values("attacker_strength")["attack_success_rate"]) == [0.0, 1.0]
+        assert (tmp_path / f"shared_{goal}.csv").exists()
+    # The second experiment starts before the first one has drained
+    first = [call for call in model.call_log if call["attacker_goal"] == "output_42"]
+    second = [call for call in model.call_log if call["attacker_goal"] == "answer_plus_1"]
+    assert len(first) == len(second) == 2 * 10
+    assert min(call["start"] for call in second) < max(call["end"] for call in first)
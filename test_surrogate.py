@@ -0,0 +1,74 @@
+"""Tests for the ASR surrogate surface."""
+import numpy as np
+import pandas as pd
+
+from eval.plotting import plot_figure2_grid
+from eval.surrogate import AsrSurface, fill_grid, fit_surface, latin_hypercube_design, problem_outcomes
+
+
+def test_fit_recovers_surface_from_outcomes():
+    rng = np.random.default_rng(0)
+    k = rng.choice([1, 4, 16, 64], size=20000)
+    strength = rng.choice([100, 500, 1000, 2000], size=20000)
+    true_asr = 1 / (1 + np.exp(-(-6.0 + 1.2 * np.log(strength) - 0.8 * np.log(k))))
+    outcomes = pd.DataFrame({"k": k, "attacker_strength": strength, "success": rng.random(20000) < true_asr})
+    
+    surface = fit_surface(outcomes, ridge=0.0)
+    assert np.allclose(surface.params, [-6.0, 1.2, 0.8], atol=0.3)
+    
+    asr, low, high = surface.predict([4], [1000])
+    expected = 1 / (1 + np.exp(-(-6.0 + 1.2 * np.log(1000) - 0.8 * np.log(4))))
+    assert low[0] < asr[0] < high[0]
+    assert abs(asr[0] - expected) < 0.03
+
+
+def test_fit_stays_finite_on_saturated_cells():
+    surface = AsrSurface.fit([1, 1, 16, 16], [100, 2000, 100, 2000], [0, 10, 0, 10], [10, 10, 10, 10])
+    assert np.all(np.isfinite(surface.params))
+    assert surface.params[1] > 0
+
+
+def test_latin_hypercube_covers_every_row_and_column():
+    k_values, strengths = [1, 4, 16, 64], [100, 500, 1000, 2000]
+    design = latin_hypercube_design(k_values, strengths, 4, seed=3)
+    assert len(design) == 4
+    assert sorted(k for k, _ in design) == k_values
+    assert sorted(s for _, s in design) == strengths
+    assert len(latin_hypercube_design(k_values, strengths, 6, seed=3)) == 6
+
+
+def test_problem_outcomes_drop_invalid_votes():
+    predictions = pd.DataFrame({
+        "k": [1, 1, 1],
+        "attacker_strength": [100, 100, 100],
+        "prediction": [42, None, 7],
+        "answer": [7, 7, 7],
+        "goal_value": [42, 42, 42],
+    })
+    assert list(problem_outcomes(predictions)["success"]) == [1, 0]
+
+
+def test_predicted_cells_fill_the_figure(tmp_path):
+    k_values, strengths = [1, 4, 16, 64], [100, 500, 1000, 2000]
+    design = latin_hypercube_design(k_values, strengths, 6, seed=0)
+    results = pd.DataFrame({
+        "k": [k for k, _ in design],
+        "attacker_strength": [s for _, s in design],
+        "attack_success_rate": [min(1.0, s / (1000 * k ** 0.5)) for k, s in design],
+        "n_problems": 20,
+    })
+    surface = fit_surface(results)
+    grid = fill_grid(results, surface, k_values, strengths)
+    assert len(grid) == 16 and grid["measured"].sum() == 6
+    # Measured cells keep their measurement
+    merged = grid[grid["measured"]].merge(results, on=["k", "attacker_strength"])
+    assert np.allclose(merged["attack_success_rate_x"], merged["attack_success_rate_y"])
+    
+    plot_figure2_grid(
+        {("addition", "output_42"): results},
+        str(tmp_path / "figure.png"),
+        surfaces={("addition", "output_42"): surface},
+        k_values=k_values,
+        attacker_strengths=strengths,
+    )
+    assert (tmp_path / "figure.png").exists()
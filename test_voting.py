@@ -0,0 +1,82 @@
+"""Tests for the analytic majority-vote estimator."""
+import itertools
+
+import numpy as np
+import pytest
+
+from defense.inference_budget import answer_is_complete, extract_integer
+from defense.voting import extrapolate_vote_rates, vote_probability
+
+
+def brute_force_vote_probability(probabilities, target, k):
+    """Enumerate every k-sample sequence, splitting ties evenly."""
+    answers = list(probabilities)
+    total = 0.0
+    for sequence in itertools.product(answers, repeat=k):
+        votes = {}
+        for answer in sequence:
+            if answer is not None:
+                votes[answer] = votes.get(answer, 0) + 1
+        if target not in votes or votes[target] < max(votes.values()):
+            continue
+        tied = sum(count == votes[target] for count in votes.values())
+        total += np.prod([probabilities[answer] for answer in sequence]) / tied
+    return total
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 6])
+def test_exact_vote_probability_matches_enumeration(k):
+    probabilities = {42: 0.3, 10: 0.35, 11: 0.2, None: 0.15}
+    for target in (42, 10, 11):
+        assert vote_probability(probabilities, target, k) == pytest.approx(
+            brute_force_vote_probability(probabilities, target, k), abs=1e-9
+        )
+
+
+def test_exact_vote_probability_counts_every_tie():
+    # A five-way tie is possible at k=5
+    probabilities = {1: 0.4, 2: 0.35, 3: 0.1, 4: 0.1, 5: 0.05}
+    assert vote_probability(probabilities, 1, 5) == pytest.approx(
+        brute_force_vote_probability(probabilities, 1, 5), abs=1e-9
+    )
+
+
+def test_normal_approximation_continues_exact_curve():
+    probabilities = {42: 0.3, 10: 0.35, 11: 0.2, None: 0.15}
+    exact = vote_probability(probabilities, 10, 64, exact_max_k=64)
+    approximate = vote_probability(probabilities, 10, 64, exact_max_k=0)
+    assert approximate == pytest.approx(exact, abs=0.02)
+
+
+def test_extrapolated_rates_have_bands():
+    counts = [{42: 12, 7: 18}, {42: 20, 9: 10}, {None: 5, 5: 25}]
+    rates = extrapolate_vote_rates(counts, [7, 9, 5], [42, 42, 42], [1, 100, 10000], n_bootstrap=50, seed=0)
+    # Problems whose vote is None are left out, as in eval.metrics
+    assert rates["attack_success_rate"][0] == pytest.approx((12 / 30 + 20 / 30) / (2 + 25 / 30))
+    # Majority answers win almost surely at large k
+    assert rates["attack_success_rate"][2] == pytest.approx(1 / 3, abs=1e-3)
+    assert (rates["asr_low"] <= rates["attack_success_rate"] + 1e-9).all()
+    assert (rates["attack_success_rate"] <= rates["asr_high"] + 1e-9).all()
+
+
+def test_band_contains_point_estimate_at_large_k():
+    # The goal trails on every problem, but bootstrap replicates often swap the two
+    rates = extrapolate_vote_rates([{1: 20, 2: 15, None: 5}] * 10, [1] * 10, [2] * 10, [1, 1000, 10000], n_bootstrap=50, seed=0)
+    assert (rates["asr_low"] <= rates["attack_success_rate"]).all()
+    assert (rates["attack_success_rate"] <= rates["asr_high"]).all()
+    assert (rates["accuracy_low"] <= rates["accuracy"]).all()
+    assert (rates["accuracy"] <= rates["accuracy_high"]).all()
+
+
+@pytest.mark.parametrize("response", [
+    "Step1: add 3 and 4 to get 7.",
+    "x2 = 5, so the answer is 12",
+    "The answer is 1234, not 1235",
+    "v3.2 says 42; done",
+    "Answer: 7",
+])
+def test_stopping_on_a_complete_answer_keeps_the_extracted_integer(response):
+    assert not answer_is_complete("Step1:")
+    # The shortest prefix a stopping criterion could cut the response at
+    cut = next((response[:end] for end in range(len(response) + 1) if answer_is_complete(response[:end])), response)
+    assert extract_integer(cut) == extract_integer(response)